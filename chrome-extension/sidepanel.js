@@ -6,6 +6,15 @@ let jobs = [];
 let expandedErrorIds = new Set(); // Track which error details are expanded
 let activeTabId = null;
 let loadDetectedUrlsSeq = 0;
+let jobStreamController = null;
+let jobStreamRetryTimer = null;
+let jobPollTimer = null;
+let jobStreamRetryDelay = 0;
+
+const JOB_LIST_LIMIT = 10;
+// Reconnect backoff for the job stream; the list is polled in the meantime
+const JOB_STREAM_RETRY_MIN_MS = 5000;
+const JOB_STREAM_RETRY_MAX_MS = 10 * 60 * 1000;
 
 const i18n = (typeof window !== 'undefined' && window.WV2N_I18N) ? window.WV2N_I18N : null;
 function t(key, vars) {
@@ -74,7 +83,8 @@ document.addEventListener('DOMContentLoaded', async () => {
   loadDetectedUrls();
 
   // Load recent jobs
-  await loadRecentJobs();
+  // Live job updates (falls back to polling on servers without the stream)
+  startJobStream();
 
   // Setup event listeners
   setupEventListeners();
@@ -140,7 +150,10 @@ function setupEventListeners() {
 
       if (needsUiUpdate || needsConnUpdate) {
         checkConnection();
-        loadRecentJobs();
+      }
+      if (needsConnUpdate) {
+        jobStreamRetryDelay = 0;
+        startJobStream();
       }
     }
   });
@@ -348,7 +361,7 @@ async function loadRecentJobs() {
   }
 
   try {
-    const response = await fetch(`${settings.nasEndpoint}/api/jobs?limit=10`, {
+    const response = await fetch(`${settings.nasEndpoint}/api/jobs?limit=${JOB_LIST_LIMIT}`, {
       headers: {
         'Authorization': `Bearer ${settings.apiKey}`
       }
@@ -363,6 +376,126 @@ async function loadRecentJobs() {
   }
 }
 
+// Split Server-Sent Events out of buffer; returns the unfinished tail
+function parseSseEvents(buffer, onEvent) {
+  const blocks = buffer.replace(/\r\n/g, '\n').split('\n\n');
+  const rest = blocks.pop();
+  blocks.forEach(block => {
+    let name = 'message';
+    const data = [];
+    block.split('\n').forEach(line => {
+      if (line.startsWith('event:')) name = line.slice(6).trim();
+      else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    });
+    if (data.length === 0) return; // comment / keepalive / retry
+    try {
+      onEvent(name, JSON.parse(data.join('\n')));
+    } catch (error) {
+      console.error('Bad job stream event:', error);
+    }
+  });
+  return rest;
+}
+
+// Merge a job delta ({id, ...changed fields}) into the list; returns true if the list changed
+function applyJobEvent(event) {
+  const idx = jobs.findIndex(j => j.id === event.id);
+  if (idx >= 0) {
+    jobs[idx] = { ...jobs[idx], ...event };
+    return true;
+  }
+  // Full record of a newly submitted job; deltas of jobs outside the list are ignored
+  if (event.created_at) {
+    jobs = [event, ...jobs].slice(0, JOB_LIST_LIMIT);
+    return true;
+  }
+  return false;
+}
+
+function handleJobStreamEvent(name, data) {
+  if (name === 'snapshot') {
+    jobs = data;
+    renderJobs();
+  } else if (name === 'job' && applyJobEvent(data)) {
+    renderJobs();
+  }
+}
+
+function startJobPolling() {
+  if (jobPollTimer) return;
+  loadRecentJobs();
+  jobPollTimer = setInterval(loadRecentJobs, 5000);
+}
+
+function stopJobPolling() {
+  if (jobPollTimer) clearInterval(jobPollTimer);
+  jobPollTimer = null;
+}
+
+function stopJobStream() {
+  if (jobStreamController) jobStreamController.abort();
+  jobStreamController = null;
+  if (jobStreamRetryTimer) clearTimeout(jobStreamRetryTimer);
+  jobStreamRetryTimer = null;
+}
+
+// Follow GET /api/jobs/stream. EventSource can't send the Authorization header,
+// so the stream is read through fetch.
+async function startJobStream() {
+  stopJobStream();
+  if (!settings.nasEndpoint || !settings.apiKey) {
+    return;
+  }
+
+  const controller = new AbortController();
+  jobStreamController = controller;
+  try {
+    const response = await fetch(`${settings.nasEndpoint}/api/jobs/stream?limit=${JOB_LIST_LIMIT}`, {
+      headers: {
+        'Authorization': `Bearer ${settings.apiKey}`,
+        'Accept': 'text/event-stream'
+      },
+      signal: controller.signal
+    });
+
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!response.ok || !response.body || !contentType.startsWith('text/event-stream')) {
+      // Older server without the stream endpoint (404, or a 500 from /api/jobs/{job_id}
+      // matching "stream"), an error page from a proxy, ...: poll and check back rarely
+      jobStreamController = null;
+      console.warn(`Job stream unavailable (HTTP ${response.status}), polling instead`);
+      startJobPolling();
+      scheduleJobStreamRetry(JOB_STREAM_RETRY_MAX_MS);
+      return;
+    }
+
+    stopJobPolling();
+    jobStreamRetryDelay = 0;
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer = parseSseEvents(buffer + decoder.decode(value, { stream: true }), handleJobStreamEvent);
+    }
+  } catch (error) {
+    if (controller.signal.aborted) return;
+    console.error('Job stream error:', error);
+  }
+
+  // Dropped (server restart, network change): poll until the stream is back
+  if (jobStreamController !== controller) return;
+  jobStreamController = null;
+  startJobPolling();
+  scheduleJobStreamRetry(Math.min(Math.max(jobStreamRetryDelay * 2, JOB_STREAM_RETRY_MIN_MS), JOB_STREAM_RETRY_MAX_MS));
+}
+
+function scheduleJobStreamRetry(delay) {
+  jobStreamRetryDelay = delay;
+  jobStreamRetryTimer = setTimeout(startJobStream, delay);
+}
+
 // Render jobs with smart update to avoid flickering
 function renderJobs() {
   const listElement = document.getElementById('recentJobsList');
@@ -831,6 +964,3 @@ function containsIpAddress(url) {
   
   return ipv4QueryPattern.test(url);
 }
-
-// Auto-refresh jobs every 5 seconds
-setInterval(loadRecentJobs, 5000);
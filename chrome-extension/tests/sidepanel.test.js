@@ -84,3 +84,87 @@ describe('sidepanel.js helper functions', () => {
     expect(ctx.connectionReasonFromError(err)).toBe('error.timeout.type');
   });
 });
+
+describe('sidepanel.js job stream', () => {
+  it('parseSseEvents emits complete events and keeps the unfinished tail', () => {
+    const ctx = loadScriptIntoContext('sidepanel.js', {
+      chrome: makeChromeStub(),
+      document: makeDocumentStub(),
+      window: {},
+    });
+
+    const events = [];
+    const rest = ctx.parseSseEvents(
+      'retry: 5000\nevent: snapshot\ndata: []\n\n: keepalive\n\nevent: job\ndata: {"id":"a","progress":40}\n\nevent: job\ndata: {"id"',
+      (name, data) => events.push([name, data])
+    );
+
+    expect(JSON.parse(JSON.stringify(events))).toEqual([['snapshot', []], ['job', { id: 'a', progress: 40 }]]);
+    expect(rest).toBe('event: job\ndata: {"id"');
+  });
+
+  it('applyJobEvent merges deltas and prepends new jobs', () => {
+    const ctx = loadScriptIntoContext('sidepanel.js', {
+      chrome: makeChromeStub(),
+      document: makeDocumentStub(),
+      window: {},
+    });
+    ctx.__eval(`jobs = [{ id: 'a', status: 'downloading', progress: 10, title: 'A' }]`);
+
+    expect(ctx.applyJobEvent({ id: 'a', progress: 55 })).toBe(true);
+    expect(ctx.applyJobEvent({ id: 'old', status: 'failed' })).toBe(false);
+    expect(ctx.applyJobEvent({ id: 'b', status: 'pending', progress: 0, created_at: '2024-01-01T00:00:00' })).toBe(true);
+
+    const jobs = JSON.parse(ctx.__eval('JSON.stringify(jobs)'));
+    expect(jobs.map(j => j.id)).toEqual(['b', 'a']);
+    expect(jobs[1]).toMatchObject({ status: 'downloading', progress: 55, title: 'A' });
+  });
+
+  it('startJobStream polls and backs off when the server has no stream', async () => {
+    const delays = [];
+    const intervals = [];
+    const ctx = loadScriptIntoContext('sidepanel.js', {
+      chrome: makeChromeStub(),
+      document: makeDocumentStub(),
+      window: {},
+      AbortController,
+      console: { ...console, warn: () => {}, error: () => {} },
+      // Pre-stream API: /api/jobs/{job_id} answers /api/jobs/stream with a 500
+      fetch: async () => ({
+        ok: false,
+        status: 500,
+        headers: { get: () => 'application/json' },
+        body: {},
+        json: async () => ({ detail: 'Internal Server Error' }),
+      }),
+      setTimeout: (_fn, ms) => { delays.push(ms); return delays.length; },
+      setInterval: (_fn, ms) => { intervals.push(ms); return intervals.length; },
+    });
+    ctx.__eval(`settings = { nasEndpoint: 'http://nas:52052', apiKey: 'k' }`);
+
+    await ctx.startJobStream();
+
+    expect(intervals).toEqual([5000]);
+    expect(delays).toEqual([ctx.__eval('JOB_STREAM_RETRY_MAX_MS')]);
+  });
+
+  it('startJobStream retries a dropped stream with growing delays', async () => {
+    const delays = [];
+    const ctx = loadScriptIntoContext('sidepanel.js', {
+      chrome: makeChromeStub(),
+      document: makeDocumentStub(),
+      window: {},
+      AbortController,
+      console: { ...console, error: () => {} },
+      fetch: async () => { throw new TypeError('Failed to fetch'); },
+      setTimeout: (_fn, ms) => { delays.push(ms); return delays.length; },
+    });
+    ctx.__eval(`settings = { nasEndpoint: 'http://nas:52052', apiKey: 'k' }`);
+
+    await ctx.startJobStream();
+    await ctx.startJobStream();
+    await ctx.startJobStream();
+
+    expect(delays).toEqual([5000, 10000, 20000]);
+  });
+});
@@ -3,21 +3,27 @@ WebVideo2NAS - API Gateway
 FastAPI application for managing web video download jobs (M3U8 and MP4)
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl, field_validator
 from typing import Optional, List
+from contextlib import asynccontextmanager
 import os
 import logging
-from datetime import datetime
-import redis
+from datetime import datetime, timezone
+import base64
+import hashlib
+import redis.asyncio as aioredis
+import asyncio
 import json
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import column, insert, table, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 import uuid
 import ipaddress
 import socket
+from urllib.parse import urlparse
 
 # Configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/m3u8_db")
@@ -26,6 +32,12 @@ API_KEY = os.getenv("API_KEY")
 RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0") or "0")
 ALLOWED_CLIENT_CIDRS_RAW = os.getenv("ALLOWED_CLIENT_CIDRS", "").strip()
 SSRF_GUARD_ENABLED = os.getenv("SSRF_GUARD", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+# Connection pools shared by all requests of this process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# Most jobs accepted by one POST /api/download/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
 
 # Backward-compatible default: allow all origins unless explicitly restricted.
 _allowed_origins_raw = os.getenv("ALLOWED_ORIGINS", "*").strip()
@@ -40,11 +52,21 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Bring a database created by an older release up to the current schema before serving
+    if make_url(DATABASE_URL).get_backend_name() == "postgresql":
+        async with SessionLocal() as db:
+            await _upgrade_schema(db)
+    yield
+
+
 # Initialize FastAPI
 app = FastAPI(
     title="WebVideo2NAS API",
     description="API for managing web video downloads (M3U8 and MP4)",
-    version="1.8.5"
+    version="1.8.5",
+    lifespan=_lifespan,
 )
 
 # CORS middleware
@@ -54,14 +76,121 @@ app.add_middleware(
     allow_credentials=ALLOW_CREDENTIALS,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Database setup: async drivers, so a slow query doesn't stall the event loop for other requests
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def _async_database_url(url: str):
+    """DATABASE_URL is shared with the worker (sync drivers); switch it to the asyncio driver"""
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return parsed
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}")
+
+
+_session_factory = None
+
+
+def SessionLocal() -> AsyncSession:
+    """New AsyncSession; the engine and its pool are created on first use"""
+    global _session_factory
+    if _session_factory is None:
+        url = _async_database_url(DATABASE_URL)
+        pool_args = {} if url.get_backend_name() == "sqlite" else {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_pre_ping": True,
+        }
+        engine = create_async_engine(url, **pool_args)
+        _session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    return _session_factory()
+
+# init-db.sql only runs when Postgres starts on an empty data dir. A database created
+# by an older release gets the later schema changes here, on every API start; each
+# statement is idempotent. Keep in step with init-db.sql.
+SCHEMA_UPGRADES = (
+    # GET /api/jobs?updated_since=..., maintained by the trigger below
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)",
+    """
+    CREATE OR REPLACE FUNCTION update_updated_at_column()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.updated_at = NOW();
+        RETURN NEW;
+    END;
+    $$ language 'plpgsql'
+    """,
+    "DROP TRIGGER IF EXISTS update_jobs_updated_at ON jobs",
+    """
+    CREATE TRIGGER update_jobs_updated_at
+        BEFORE UPDATE ON jobs
+        FOR EACH ROW
+        EXECUTE FUNCTION update_updated_at_column()
+    """,
+    # Queue class: high / normal / low
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS priority VARCHAR(10) NOT NULL DEFAULT 'normal'",
+    # Keyset pagination of /api/jobs
+    "DROP INDEX IF EXISTS idx_jobs_created",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_created_id ON jobs(created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_created_id ON jobs(status, created_at DESC, id DESC)",
+)
+# Serializes upgrades when several API replicas start at once
+SCHEMA_LOCK_KEY = 0x57563241
+
+
+async def _upgrade_schema(db: AsyncSession):
+    """Apply SCHEMA_UPGRADES in one transaction (raises, so a failed upgrade stops the API)"""
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+    for statement in SCHEMA_UPGRADES:
+        await db.execute(text(statement))
+    await db.commit()
+    logger.info("Database schema is up to date")
+
 
 # Redis setup
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# (a blocking pool: requests wait briefly for a free connection instead of failing)
+redis_client = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS, timeout=5
+))
+# Pub/sub for GET /api/jobs/stream: each open stream holds a connection for its lifetime,
+# so they don't come out of the bounded request pool
+stream_redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+
+# Fixed-window counter: INCR and the first EXPIRE in one round trip, atomically
+# (a crash between the two can't leave a key without a TTL)
+RATE_LIMIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+_rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT)
+
+# Job queue: priority classes, round-robin across source hosts within a class.
+# Keep in sync with worker/fair_queue.py (workers dequeue and re-enqueue retries);
+# worker/tests/test_fair_queue.py checks the enqueue script and keys match.
+JOB_PRIORITIES = ("high", "normal", "low")
+FAIR_QUEUE_PREFIX = "fair_queue:"
+FAIR_QUEUE_TURN_KEY = "fair_queue:turn"
+FAIR_QUEUE_WAKEUP_KEY = "fair_queue:wakeup"
+FAIR_QUEUE_WAKEUP_BACKLOG = 64
+# Failed jobs waiting out their retry backoff (worker side)
+FAIR_QUEUE_RETRY_KEY = "fair_queue:retry"
+FAIR_ENQUEUE_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local turn = tonumber(redis.call('GET', KEYS[3]) or '0')
+redis.call('ZADD', KEYS[2], 'NX', turn, ARGV[2])
+redis.call('RPUSH', KEYS[4], '1')
+redis.call('LTRIM', KEYS[4], -tonumber(ARGV[3]), -1)
+return 1
+"""
+_fair_enqueue_script = redis_client.register_script(FAIR_ENQUEUE_SCRIPT)
 
 # Security helpers
 def _get_client_ip(request: Request) -> str:
@@ -107,15 +236,14 @@ def _enforce_client_allowlist(request: Request) -> None:
     raise HTTPException(status_code=403, detail="Client IP not allowed")
 
 
-def _rate_limit(request: Request, bucket: str) -> None:
+async def _rate_limit(request: Request, bucket: str) -> None:
     if RATE_LIMIT_PER_MINUTE <= 0:
         return
     client_ip = _get_client_ip(request)
     window = int(datetime.utcnow().timestamp() // 60)
     key = f"rl:{bucket}:{client_ip}:{window}"
     try:
-        count = redis_client.incr(key)
-        redis_client.expire(key, 90)
+        count = await _rate_limit_script(keys=[key], args=[90], client=redis_client)
     except Exception:
         # If Redis is unavailable, skip rate limiting (avoid breaking core API).
         return
@@ -159,6 +287,216 @@ def _enforce_ssrf_guard(url: HttpUrl) -> None:
         if not _is_ip_public(ip):
             raise HTTPException(status_code=400, detail="URL host not allowed")
 
+ACTIVE_JOB_STATUSES = ("downloading", "processing")
+# Workers keep live progress in Redis and only write it to Postgres every few seconds
+JOB_PROGRESS_KEY_PREFIX = "job_progress:"
+# Checked by workers while a job runs (faster than polling the jobs table)
+JOB_CANCEL_KEY_PREFIX = "job_cancel:"
+JOB_CANCEL_TTL_SECONDS = 86400
+# Pub/sub channel: the worker running the job aborts it as soon as the id arrives
+JOB_CANCEL_CHANNEL = "job_cancel"
+# Job state/progress deltas published by workers (and the API), relayed to stream clients
+JOB_EVENTS_CHANNEL = "job_events"
+JOB_STREAM_KEEPALIVE_SECONDS = 15
+# ETag versions, bumped by workers and the API (see worker/progress.py): every change
+# bumps the job's own version and either the stored-state version or, for progress
+# that only went to Redis, the live version
+JOBS_VERSION_KEY = "jobs_version"
+JOBS_LIVE_VERSION_KEY = "jobs_version:live"
+JOB_VERSION_PREFIX = "job_version:"
+JOB_VERSION_TTL_SECONDS = 86400
+# Browsers may keep the response but must revalidate it (If-None-Match) before reuse
+JOB_CACHE_CONTROL = "private, no-cache"
+
+
+async def _get_live_progress(job_ids: List[str]) -> dict:
+    """Fetch live progress published by workers (job_id -> percent)"""
+    if not job_ids:
+        return {}
+    try:
+        pipe = redis_client.pipeline()
+        for job_id in job_ids:
+            pipe.hget(f"{JOB_PROGRESS_KEY_PREFIX}{job_id}", "progress")
+        raw = await pipe.execute()
+    except Exception:
+        return {}
+    progress = {}
+    for job_id, value in zip(job_ids, raw):
+        if value is not None:
+            try:
+                progress[job_id] = int(value)
+            except ValueError:
+                continue
+    return progress
+
+
+async def _get_live_updated_at(job_ids: List[str]) -> dict:
+    """When workers last published live progress (job_id -> naive UTC datetime)"""
+    if not job_ids:
+        return {}
+    try:
+        pipe = redis_client.pipeline()
+        for job_id in job_ids:
+            pipe.hget(f"{JOB_PROGRESS_KEY_PREFIX}{job_id}", "updated_at")
+        raw = await pipe.execute()
+    except Exception:
+        return {}
+    updated = {}
+    for job_id, value in zip(job_ids, raw):
+        if value is not None:
+            try:
+                updated[job_id] = datetime.utcfromtimestamp(float(value))
+            except ValueError:
+                continue
+    return updated
+
+
+async def _get_host_limits(job_ids: List[str]) -> dict:
+    """Fetch per-host concurrency limits published by workers (job_id -> {host: {...}})"""
+    if not job_ids:
+        return {}
+    try:
+        raw = await redis_client.mget([f"job_host_limits:{job_id}" for job_id in job_ids])
+    except Exception:
+        return {}
+    limits = {}
+    for job_id, value in zip(job_ids, raw):
+        if value:
+            try:
+                limits[job_id] = json.loads(value)
+            except ValueError:
+                continue
+    return limits
+
+
+async def _publish_job_event(job_id: str, **fields):
+    """Tell stream clients about a job change and invalidate ETags (best effort)"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.publish(JOB_EVENTS_CHANNEL, json.dumps({"id": job_id, **fields}))
+        _bump_job_versions(pipe, [job_id])
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to publish event for job {job_id}: {e}")
+
+
+def _bump_job_versions(pipe, job_ids: List[str]):
+    """Queue ETag version bumps for stored changes of these jobs on a pipeline"""
+    # Same seeding as the worker: a missing counter starts from the time in ms
+    now_ms = int(datetime.utcnow().timestamp() * 1000)
+    for job_id in job_ids:
+        key = f"{JOB_VERSION_PREFIX}{job_id}"
+        pipe.set(key, now_ms, nx=True)
+        pipe.incr(key)
+        pipe.expire(key, JOB_VERSION_TTL_SECONDS)
+    pipe.set(JOBS_VERSION_KEY, now_ms, nx=True)
+    pipe.incr(JOBS_VERSION_KEY)
+
+
+def _job_host(url: str) -> str:
+    return (urlparse(url).hostname or "unknown").lower()
+
+
+async def _enqueue_job(client, job_id: str, url: str, priority: str):
+    """Queue a job on the fair queue (client may be a pipeline)"""
+    host = _job_host(url)
+    await _fair_enqueue_script(
+        keys=[f"{FAIR_QUEUE_PREFIX}{priority}:{host}", f"{FAIR_QUEUE_PREFIX}hosts:{priority}",
+              FAIR_QUEUE_TURN_KEY, FAIR_QUEUE_WAKEUP_KEY],
+        args=[job_id, host, FAIR_QUEUE_WAKEUP_BACKLOG],
+        client=client,
+    )
+
+
+async def _queue_length() -> int:
+    """Jobs waiting in the fair queue or for a retry (plus any left in the pre-priority download_queue)"""
+    pipe = redis_client.pipeline()
+    for priority in JOB_PRIORITIES:
+        pipe.zrange(f"{FAIR_QUEUE_PREFIX}hosts:{priority}", 0, -1)
+    pipe.llen("download_queue")
+    pipe.zcard(FAIR_QUEUE_RETRY_KEY)
+    *hosts_by_priority, legacy, retrying = await pipe.execute()
+    pipe = redis_client.pipeline()
+    for priority, hosts in zip(JOB_PRIORITIES, hosts_by_priority):
+        for host in hosts:
+            pipe.llen(f"{FAIR_QUEUE_PREFIX}{priority}:{host}")
+    return legacy + retrying + sum(await pipe.execute())
+
+
+async def _jobs_version(*keys: str) -> Optional[str]:
+    """
+    Current value of these version counters joined into one ETag version, or None if
+    Redis is unavailable (then no ETag is sent)
+    """
+    now_ms = int(datetime.utcnow().timestamp() * 1000)
+    try:
+        pipe = redis_client.pipeline()
+        for key in keys:
+            # Seed like a bump would; per-job counters expire like the worker's
+            ttl = JOB_VERSION_TTL_SECONDS if key.startswith(JOB_VERSION_PREFIX) else None
+            pipe.set(key, now_ms, nx=True, ex=ttl)
+        for key in keys:
+            pipe.get(key)
+        versions = (await pipe.execute())[len(keys):]
+        return ".".join(versions)
+    except Exception:
+        return None
+
+
+def _make_etag(version: str, *parts) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": JOB_CACHE_CONTROL})
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _job_event_stream(pubsub, snapshot: list, is_disconnected):
+    """
+    Yield the snapshot, then every job delta from JOB_EVENTS_CHANNEL as Server-Sent Events
+    (a comment line keeps idle connections from being cut by proxies)
+    """
+    try:
+        yield "retry: 5000\n" + _sse("snapshot", snapshot)
+        loop = asyncio.get_running_loop()
+        next_keepalive = loop.time() + JOB_STREAM_KEEPALIVE_SECONDS
+        while not await is_disconnected():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None or message.get("type") != "message":
+                if loop.time() >= next_keepalive:
+                    next_keepalive = loop.time() + JOB_STREAM_KEEPALIVE_SECONDS
+                    yield ": keepalive\n\n"
+                continue
+            next_keepalive = loop.time() + JOB_STREAM_KEEPALIVE_SECONDS
+            try:
+                event = json.loads(message["data"])
+            except ValueError:
+                continue
+            yield _sse("job", event)
+    finally:
+        try:
+            await pubsub.unsubscribe(JOB_EVENTS_CHANNEL)
+            await pubsub.aclose()
+        except Exception:
+            pass
+
 # Pydantic models
 class DownloadRequest(BaseModel):
     url: HttpUrl
@@ -166,6 +504,14 @@ class DownloadRequest(BaseModel):
     referer: Optional[str] = None
     headers: Optional[dict] = None
     source_page: Optional[str] = None
+    # Queue class: high jobs are started before any normal/low ones
+    priority: str = "normal"
+
+    @field_validator('priority')
+    def validate_priority(cls, v):
+        if v not in JOB_PRIORITIES:
+            raise ValueError(f"priority must be one of: {', '.join(JOB_PRIORITIES)}")
+        return v
 
     @field_validator('url')
     def validate_video_url(cls, v):
@@ -178,6 +524,17 @@ class DownloadRequest(BaseModel):
         _enforce_ssrf_guard(v)
         return v
 
+class BatchDownloadRequest(BaseModel):
+    jobs: List[DownloadRequest]
+
+    @field_validator('jobs')
+    def validate_batch_size(cls, v):
+        if not v:
+            raise ValueError('jobs must not be empty')
+        if len(v) > MAX_BATCH_SIZE:
+            raise ValueError(f'At most {MAX_BATCH_SIZE} jobs per batch')
+        return v
+
 class JobResponse(BaseModel):
     id: str
     url: str
@@ -185,10 +542,14 @@ class JobResponse(BaseModel):
     status: str
     progress: int
     created_at: str
+    updated_at: Optional[str] = None
+    priority: Optional[str] = None
     duration: Optional[int] = None
     file_size: Optional[int] = None
     file_path: Optional[str] = None
     error_message: Optional[str] = None
+    # Per-CDN-host segment concurrency learned by the worker (adaptive mode only)
+    host_concurrency: Optional[dict] = None
 
 class SystemStatus(BaseModel):
     status: str
@@ -198,17 +559,14 @@ class SystemStatus(BaseModel):
     disk_usage_gb: Optional[float] = None
 
 # Dependencies
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_api_key(request: Request, authorization: Optional[str] = Header(None)):
+async def verify_api_key(request: Request, authorization: Optional[str] = Header(None)):
     """Verify API key from Authorization header"""
     _enforce_client_allowlist(request)
-    _rate_limit(request, bucket="auth")
+    await _rate_limit(request, bucket="auth")
     if not API_KEY or API_KEY.strip() == "" or API_KEY.strip() == "change-this-key":
         raise HTTPException(status_code=503, detail="Server not configured: API_KEY is not set")
     if not authorization:
@@ -240,15 +598,14 @@ async def health_check(request: Request, authorization: Optional[str] = Header(N
         # Allow localhost checks (Docker healthcheck) without auth; require API key otherwise.
         client_ip = _get_client_ip(request)
         if client_ip not in ("127.0.0.1", "::1"):
-            verify_api_key(request=request, authorization=authorization)
+            await verify_api_key(request=request, authorization=authorization)
 
         # Check database
-        db = SessionLocal()
-        db.execute(text("SELECT 1"))
-        db.close()
+        async with SessionLocal() as db:
+            await db.execute(text("SELECT 1"))
         
         # Check Redis
-        redis_client.ping()
+        await redis_client.ping()
         
         return {"status": "healthy"}
     except Exception as e:
@@ -258,7 +615,7 @@ async def health_check(request: Request, authorization: Optional[str] = Header(N
 @app.post("/api/download", response_model=JobResponse)
 async def submit_download(
     request: DownloadRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
     """Submit a new download job"""
@@ -267,19 +624,20 @@ async def submit_download(
         now = datetime.utcnow()
         
         # Insert job into database
-        db.execute(text("""
-            INSERT INTO jobs (id, url, title, status, progress, created_at)
-            VALUES (:id, :url, :title, 'pending', 0, :created_at)
+        await db.execute(text("""
+            INSERT INTO jobs (id, url, title, status, progress, created_at, updated_at, priority)
+            VALUES (:id, :url, :title, 'pending', 0, :created_at, :created_at, :priority)
         """), {
             "id": job_id,
             "url": str(request.url),
             "title": request.title or "Untitled",
-            "created_at": now
+            "created_at": now,
+            "priority": request.priority
         })
         
         # Insert metadata
         if request.referer or request.headers or request.source_page:
-            db.execute(text("""
+            await db.execute(text("""
                 INSERT INTO job_metadata (job_id, referer, headers, source_page)
                 VALUES (:job_id, :referer, :headers, :source_page)
             """), {
@@ -289,84 +647,306 @@ async def submit_download(
                 "source_page": request.source_page
             })
         
-        db.commit()
+        await db.commit()
         
         # Push to Redis queue
-        redis_client.rpush("download_queue", job_id)
+        await _enqueue_job(redis_client, job_id, str(request.url), request.priority)
         logger.info(f"Job {job_id} created and queued")
         
-        return JobResponse(
+        job = JobResponse(
             id=job_id,
             url=str(request.url),
             title=request.title,
             status="pending",
             progress=0,
-            created_at=now.isoformat()
+            created_at=now.isoformat(),
+            updated_at=now.isoformat(),
+            priority=request.priority
         )
+        await _publish_job_event(job_id, **job.model_dump(exclude={"id"}))
+        return job
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to create job: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/jobs", response_model=List[JobResponse])
-async def list_jobs(
-    status: Optional[str] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db),
+# Column lists for the multi-row INSERTs of batch submissions
+_jobs_table = table("jobs", column("id"), column("url"), column("title"), column("status"),
+                    column("progress"), column("created_at"), column("updated_at"), column("priority"))
+_job_metadata_table = table("job_metadata", column("job_id"), column("referer"), column("headers"),
+                            column("source_page"))
+
+@app.post("/api/download/batch", response_model=List[JobResponse])
+async def submit_download_batch(
+    request: BatchDownloadRequest,
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
-    """List all jobs with optional status filter"""
+    """
+    Submit many download jobs at once (e.g. every episode of a series): all are
+    validated first, inserted in one transaction and queued in order
+    """
     try:
-        query = """
-            SELECT j.id, j.url, j.title, j.status, j.progress, j.created_at,
-                   jm.duration,
-                   j.file_size, j.file_path, j.error_message
-            FROM jobs j
-            LEFT JOIN job_metadata jm ON j.id = jm.job_id
-        """
-        params = {}
+        now = datetime.utcnow()
+        jobs = [(str(uuid.uuid4()), item) for item in request.jobs]
+        
+        # One multi-row INSERT per table instead of a statement per job
+        await db.execute(insert(_jobs_table).values([
+            {
+                "id": job_id,
+                "url": str(item.url),
+                "title": item.title or "Untitled",
+                "status": "pending",
+                "progress": 0,
+                "created_at": now,
+                "updated_at": now,
+                "priority": item.priority,
+            }
+            for job_id, item in jobs
+        ]))
+        metadata = [
+            {
+                "job_id": job_id,
+                "referer": item.referer,
+                "headers": json.dumps(item.headers) if item.headers else None,
+                "source_page": item.source_page,
+            }
+            for job_id, item in jobs
+            if item.referer or item.headers or item.source_page
+        ]
+        if metadata:
+            await db.execute(insert(_job_metadata_table).values(metadata))
         
-        if status:
-            query += " WHERE j.status = :status"
-            params["status"] = status
+        await db.commit()
         
-        query += " ORDER BY j.created_at DESC LIMIT :limit"
-        params["limit"] = limit
+        responses = [
+            JobResponse(
+                id=job_id,
+                url=str(item.url),
+                title=item.title,
+                status="pending",
+                progress=0,
+                created_at=now.isoformat(),
+                updated_at=now.isoformat(),
+                priority=item.priority
+            )
+            for job_id, item in jobs
+        ]
         
-        result = db.execute(text(query), params)
-        jobs = []
+        # Queue every job, notify stream clients and invalidate ETags in one round trip
+        pipe = redis_client.pipeline()
+        for job_id, item in jobs:
+            await _enqueue_job(pipe, job_id, str(item.url), item.priority)
+        for job in responses:
+            pipe.publish(JOB_EVENTS_CHANNEL, json.dumps(job.model_dump()))
+        _bump_job_versions(pipe, [job_id for job_id, _ in jobs])
+        await pipe.execute()
+        logger.info(f"Batch of {len(jobs)} jobs created and queued")
         
-        for row in result:
-            jobs.append(JobResponse(
-                id=str(row.id),
-                url=row.url,
-                title=row.title,
-                status=row.status,
-                progress=row.progress,
-                created_at=row.created_at.isoformat(),
-                duration=row.duration,
-                file_size=row.file_size,
-                file_path=row.file_path,
-                error_message=row.error_message
-            ))
+        return responses
+    
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Failed to create job batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _encode_cursor(created_at: str, job_id: str) -> str:
+    """Opaque keyset cursor for the page after (created_at, id)"""
+    return base64.urlsafe_b64encode(f"{created_at}|{job_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, job_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(job_id))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _as_utc_naive(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC (datetime.utcnow / NOW() in a UTC container)"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def _fetch_jobs(
+    db: AsyncSession,
+    status: Optional[str],
+    limit: int,
+    cursor: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+) -> List[JobResponse]:
+    """
+    Newest jobs (optionally of one status) with live progress of active ones.
+    ``cursor`` continues after the last job of a previous page; ``updated_since``
+    keeps only jobs that changed after that time (plus active jobs, whose latest
+    change may only be in Redis; see list_jobs).
+    The ``updated_at`` of an active job is its latest live progress update when
+    that is newer than the row (workers persist progress only every few seconds).
+    """
+    query = """
+        SELECT j.id, j.url, j.title, j.status, j.progress, j.created_at, j.updated_at, j.priority,
+               jm.duration,
+               j.file_size, j.file_path, j.error_message
+        FROM jobs j
+        LEFT JOIN job_metadata jm ON j.id = jm.job_id
+    """
+    conditions = []
+    params = {}
+
+    if status:
+        conditions.append("j.status = :status")
+        params["status"] = status
+    if cursor:
+        # Row-value comparison walks idx_jobs_(status_)created_id instead of an OFFSET scan
+        conditions.append("(j.created_at, j.id) < (:cursor_created_at, :cursor_id)")
+        params["cursor_created_at"], params["cursor_id"] = _decode_cursor(cursor)
+    if updated_since:
+        active = ", ".join(f"'{active_status}'" for active_status in ACTIVE_JOB_STATUSES)
+        conditions.append(f"(j.updated_at > :updated_since OR j.status IN ({active}))")
+        params["updated_since"] = _as_utc_naive(updated_since)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY j.created_at DESC, j.id DESC LIMIT :limit"
+    params["limit"] = limit
+
+    result = await db.execute(text(query), params)
+    rows = result.fetchall()
+    active_ids = [str(row.id) for row in rows if row.status in ACTIVE_JOB_STATUSES]
+    host_limits = await _get_host_limits(active_ids)
+    live_progress = await _get_live_progress(active_ids)
+    live_updated_at = await _get_live_updated_at(active_ids)
+    jobs = []
+
+    for row in rows:
+        updated_at = max(
+            (t for t in (row.updated_at, live_updated_at.get(str(row.id))) if t is not None), default=None
+        )
+        jobs.append(JobResponse(
+            id=str(row.id),
+            url=row.url,
+            title=row.title,
+            status=row.status,
+            progress=live_progress.get(str(row.id), row.progress),
+            created_at=row.created_at.isoformat(),
+            updated_at=updated_at.isoformat() if updated_at else None,
+            priority=row.priority,
+            duration=row.duration,
+            file_size=row.file_size,
+            file_path=row.file_path,
+            error_message=row.error_message,
+            host_concurrency=host_limits.get(str(row.id))
+        ))
+
+    return jobs
+
+@app.get("/api/jobs", response_model=List[JobResponse])
+async def list_jobs(
+    response: Response,
+    status: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    List jobs, newest first, with optional status filter.
+    A full page sets ``X-Next-Cursor``; pass it back as ``cursor`` for the next page.
+    With ``updated_since`` only jobs changed after that time are returned (use the
+    largest ``updated_at`` seen as the next value). Live progress of running jobs
+    counts as a change, so it shows up without waiting for the worker to write it
+    to the database.
+    Sends an ETag; a matching ``If-None-Match`` gets 304 without a database query.
+    The tag changes with any stored job change and, if the list can show running
+    jobs, with their live progress.
+    """
+    try:
+        # Read the version before the query: a change racing with it only costs a refetch
+        version_keys = [JOBS_VERSION_KEY]
+        if status is None or status in ACTIVE_JOB_STATUSES:
+            version_keys.append(JOBS_LIVE_VERSION_KEY)
+        version = await _jobs_version(*version_keys)
+        etag = None
+        if version is not None:
+            etag = _make_etag(version, "jobs", status, limit, cursor, updated_since)
+            if _etag_matches(if_none_match, etag):
+                return _not_modified(etag)
         
+        jobs = await _fetch_jobs(db, status, limit, cursor=cursor, updated_since=updated_since)
+        if jobs and len(jobs) == limit:
+            response.headers["X-Next-Cursor"] = _encode_cursor(jobs[-1].created_at, jobs[-1].id)
+        if updated_since:
+            # Active jobs are fetched regardless of the row; drop those without a newer live update
+            since = _as_utc_naive(updated_since)
+            jobs = [job for job in jobs if job.updated_at and datetime.fromisoformat(job.updated_at) > since]
+        if etag is not None:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = JOB_CACHE_CONTROL
         return jobs
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to list jobs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs/stream")
+async def stream_jobs(
+    request: Request,
+    status: Optional[str] = None,
+    limit: int = 50,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Server-Sent Events: a ``snapshot`` event with the same list as GET /api/jobs,
+    then a ``job`` event ({"id": ..., changed fields}) whenever a job changes
+    """
+    try:
+        pubsub = stream_redis_client.pubsub()
+        # Subscribe before reading the snapshot so no change falls in between
+        await pubsub.subscribe(JOB_EVENTS_CHANNEL)
+    except Exception as e:
+        logger.error(f"Failed to subscribe to job events: {e}")
+        raise HTTPException(status_code=503, detail="Job event stream unavailable")
     
+    try:
+        async with SessionLocal() as db:
+            snapshot = [job.model_dump() for job in await _fetch_jobs(db, status, limit)]
     except Exception as e:
+        await pubsub.aclose()
         logger.error(f"Failed to list jobs: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(
+        _job_event_stream(pubsub, snapshot, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/jobs/{job_id}", response_model=JobResponse)
 async def get_job(
     job_id: str,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
-    """Get details of a specific job"""
+    """Get details of a specific job (ETag / If-None-Match as for the job list, per job)"""
     try:
-        result = db.execute(text("""
-            SELECT j.id, j.url, j.title, j.status, j.progress, j.created_at,
+        version = await _jobs_version(f"{JOB_VERSION_PREFIX}{job_id}")
+        etag = None
+        if version is not None:
+            etag = _make_etag(version, "job", job_id)
+            if _etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+        
+        result = await db.execute(text("""
+            SELECT j.id, j.url, j.title, j.status, j.progress, j.created_at, j.updated_at, j.priority,
                    jm.duration,
                    j.file_size, j.file_path, j.error_message
             FROM jobs j
@@ -378,17 +958,27 @@ async def get_job(
         if not row:
             raise HTTPException(status_code=404, detail="Job not found")
         
+        active_ids = [str(row.id)] if row.status in ACTIVE_JOB_STATUSES else []
+        host_limits = await _get_host_limits(active_ids)
+        live_progress = await _get_live_progress(active_ids)
+        
+        if etag is not None:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = JOB_CACHE_CONTROL
         return JobResponse(
             id=str(row.id),
             url=row.url,
             title=row.title,
             status=row.status,
-            progress=row.progress,
+            progress=live_progress.get(str(row.id), row.progress),
             created_at=row.created_at.isoformat(),
+            updated_at=row.updated_at.isoformat() if row.updated_at else None,
+            priority=row.priority,
             duration=row.duration,
             file_size=row.file_size,
             file_path=row.file_path,
-            error_message=row.error_message
+            error_message=row.error_message,
+            host_concurrency=host_limits.get(str(row.id))
         )
     
     except HTTPException:
@@ -400,50 +990,58 @@ async def get_job(
 @app.delete("/api/jobs/{job_id}")
 async def delete_job(
     job_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
     """Delete/cancel a job"""
     try:
-        result = db.execute(text("""
+        result = await db.execute(text("""
             UPDATE jobs SET status = 'cancelled'
             WHERE id = :job_id AND status IN ('pending', 'downloading', 'processing')
         """), {"job_id": job_id})
         
-        db.commit()
+        await db.commit()
         
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Job not found or cannot be cancelled")
         
+        # Let the worker notice right away instead of on its next database poll
+        try:
+            await redis_client.set(f"{JOB_CANCEL_KEY_PREFIX}{job_id}", "1", ex=JOB_CANCEL_TTL_SECONDS)
+            await redis_client.publish(JOB_CANCEL_CHANNEL, job_id)
+        except Exception as e:
+            logger.warning(f"Failed to publish cancel flag for job {job_id}: {e}")
+        await _publish_job_event(job_id, status="cancelled")
+        
         logger.info(f"Job {job_id} cancelled")
         return {"message": "Job cancelled successfully"}
     
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to cancel job: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/status", response_model=SystemStatus)
 async def get_status(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
     """Get system status"""
     try:
         # Count active downloads
-        result = db.execute(text("""
+        result = await db.execute(text("""
             SELECT COUNT(*) as count FROM jobs WHERE status = 'downloading'
         """))
         active_downloads = result.first().count
         
         # Count total jobs
-        result = db.execute(text("SELECT COUNT(*) as count FROM jobs"))
+        result = await db.execute(text("SELECT COUNT(*) as count FROM jobs"))
         total_jobs = result.first().count
         
         # Get queue length
-        queue_length = redis_client.llen("download_queue")
+        queue_length = await _queue_length()
         
         return SystemStatus(
             status="healthy",
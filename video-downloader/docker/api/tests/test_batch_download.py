@@ -0,0 +1,76 @@
+import asyncio
+import importlib
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch, **env):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    monkeypatch.setenv("SSRF_GUARD", "false")
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    import main as api_main
+
+    api_main = importlib.reload(api_main)
+    monkeypatch.setattr(api_main, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    return api_main
+
+
+class _RecordingDb:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement.compile(dialect=postgresql.dialect()))
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+
+def test_batch_is_one_transaction_and_one_queue_push(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    request = api_main.BatchDownloadRequest(jobs=[
+        {"url": f"https://example.com/show/ep{i}/index.m3u8", "title": f"Episode {i}",
+         "referer": "https://example.com/show" if i % 2 else None}
+        for i in range(1, 101)
+    ])
+    db = _RecordingDb()
+
+    async def _run():
+        jobs = await api_main.submit_download_batch(request, db=db, api_key="k")
+        return jobs, await api_main.redis_client.lrange("fair_queue:normal:example.com", 0, -1)
+
+    jobs, queue = asyncio.run(_run())
+
+    assert [job.title for job in jobs][:2] == ["Episode 1", "Episode 2"]
+    assert queue == [job.id for job in jobs]
+    assert db.commits == 1
+    # Multi-row INSERTs: one into jobs (100 rows), one into job_metadata (50 rows with a referer)
+    jobs_insert, metadata_insert = db.statements
+    assert str(jobs_insert).startswith("INSERT INTO jobs")
+    assert len(jobs_insert.params) == 100 * 8
+    assert str(metadata_insert).startswith("INSERT INTO job_metadata")
+    assert len(metadata_insert.params) == 50 * 4
+
+
+def test_batch_validates_every_item_and_its_size(monkeypatch):
+    api_main = _reload_api_main(monkeypatch, MAX_BATCH_SIZE="3")
+
+    with pytest.raises(ValidationError):
+        api_main.BatchDownloadRequest(jobs=[
+            {"url": "https://example.com/a.m3u8"},
+            {"url": "https://example.com/b.mov"},
+        ])
+    with pytest.raises(ValidationError):
+        api_main.BatchDownloadRequest(jobs=[{"url": f"https://example.com/{i}.mp4"} for i in range(4)])
+    with pytest.raises(ValidationError):
+        api_main.BatchDownloadRequest(jobs=[])
@@ -0,0 +1,108 @@
+import asyncio
+import importlib
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    import main as api_main
+
+    api_main = importlib.reload(api_main)
+    monkeypatch.setattr(api_main, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    return api_main
+
+
+class _CountingDb:
+    def __init__(self):
+        self.queries = 0
+        self.row = SimpleNamespace(
+            id="00000000-0000-0000-0000-000000000001", url="https://example.com/a.m3u8", title="a",
+            status="completed", progress=100, priority="normal",
+            created_at=datetime(2024, 5, 1), updated_at=datetime(2024, 5, 1),
+            duration=None, file_size=None, file_path=None, error_message=None,
+        )
+
+    async def execute(self, query, params):
+        self.queries += 1
+        return SimpleNamespace(fetchall=lambda: [self.row], first=lambda: self.row)
+
+
+def test_unchanged_job_list_is_answered_with_304_without_a_query(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    db = _CountingDb()
+
+    async def _run():
+        response = Response()
+        await api_main.list_jobs(response, limit=10, if_none_match=None, db=db, api_key="k")
+        etag = response.headers["ETag"]
+
+        cached = await api_main.list_jobs(Response(), limit=10, if_none_match=etag, db=db, api_key="k")
+        other_page = await api_main.list_jobs(Response(), limit=5, if_none_match=etag, db=db, api_key="k")
+
+        await api_main._publish_job_event(db.row.id, status="cancelled")
+        changed = Response()
+        await api_main.list_jobs(changed, limit=10, if_none_match=etag, db=db, api_key="k")
+        return etag, cached, other_page, changed
+
+    etag, cached, other_page, changed = asyncio.run(_run())
+    assert cached.status_code == 304 and cached.headers["ETag"] == etag
+    assert not isinstance(other_page, Response)  # different query, different tag
+    assert changed.headers["ETag"] != etag
+    assert db.queries == 3
+
+
+def test_single_job_etag(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    db = _CountingDb()
+
+    async def _run():
+        response = Response()
+        job = await api_main.get_job(db.row.id, response, if_none_match=None, db=db, api_key="k")
+        etag = response.headers["ETag"]
+        cached = await api_main.get_job(db.row.id, Response(), if_none_match=f'"x", {etag}', db=db, api_key="k")
+        return job, cached
+
+    job, cached = asyncio.run(_run())
+    assert job.id == db.row.id
+    assert cached.status_code == 304
+    assert db.queries == 1
+
+
+def test_live_progress_of_other_jobs_keeps_tags_valid(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    db = _CountingDb()
+
+    async def _live_progress(job_id):
+        # What a worker's progress tracker bumps between database writes
+        pipe = api_main.redis_client.pipeline()
+        pipe.incr(f"{api_main.JOB_VERSION_PREFIX}{job_id}")
+        pipe.incr(api_main.JOBS_LIVE_VERSION_KEY)
+        await pipe.execute()
+
+    async def _run():
+        detail, completed, everything = Response(), Response(), Response()
+        await api_main.get_job(db.row.id, detail, if_none_match=None, db=db, api_key="k")
+        await api_main.list_jobs(completed, status="completed", limit=10, if_none_match=None, db=db, api_key="k")
+        await api_main.list_jobs(everything, limit=10, if_none_match=None, db=db, api_key="k")
+
+        await _live_progress("00000000-0000-0000-0000-00000000000f")
+        return [
+            await api_main.get_job(db.row.id, Response(), if_none_match=detail.headers["ETag"], db=db, api_key="k"),
+            await api_main.list_jobs(
+                Response(), status="completed", limit=10, if_none_match=completed.headers["ETag"], db=db, api_key="k"
+            ),
+            await api_main.list_jobs(Response(), limit=10, if_none_match=everything.headers["ETag"], db=db, api_key="k"),
+        ]
+
+    detail, completed, everything = asyncio.run(_run())
+    assert detail.status_code == 304
+    assert completed.status_code == 304
+    # A list that can show the running job has to be refetched for its progress
+    assert not isinstance(everything, Response)
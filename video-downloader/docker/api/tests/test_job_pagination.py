@@ -0,0 +1,108 @@
+import asyncio
+import importlib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    import main as api_main
+
+    api_main = importlib.reload(api_main)
+    monkeypatch.setattr(api_main, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    return api_main
+
+
+class _FakeDb:
+    """Records the query and returns rows like the jobs/job_metadata join"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def execute(self, query, params):
+        self.calls.append((str(query), params))
+        rows = self.rows[: params["limit"]]
+        return SimpleNamespace(fetchall=lambda: rows)
+
+
+def _row(i, created_at):
+    return SimpleNamespace(
+        id=f"00000000-0000-0000-0000-{i:012d}", url="https://example.com/a.m3u8", title=f"job {i}",
+        status="completed", progress=100, priority="normal", created_at=created_at, updated_at=created_at,
+        duration=None, file_size=None, file_path=None, error_message=None,
+    )
+
+
+def test_full_page_returns_cursor_for_keyset_continuation(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    base = datetime(2024, 5, 1, 12, 0, 0)
+    db = _FakeDb([_row(i, base - timedelta(minutes=i)) for i in range(3)])
+
+    response = Response()
+    jobs = asyncio.run(api_main.list_jobs(response, limit=2, if_none_match=None, db=db, api_key="k"))
+    assert [job.id for job in jobs] == [_row(0, base).id, _row(1, base).id]
+
+    cursor = response.headers["X-Next-Cursor"]
+    assert api_main._decode_cursor(cursor) == (base - timedelta(minutes=1), _row(1, base).id)
+
+    response = Response()
+    asyncio.run(api_main.list_jobs(
+        response, limit=5, cursor=cursor, status="completed", if_none_match=None, db=db, api_key="k"
+    ))
+    query, params = db.calls[-1]
+    assert "(j.created_at, j.id) < (:cursor_created_at, :cursor_id)" in query
+    assert "j.status = :status" in query
+    assert params["cursor_created_at"] == base - timedelta(minutes=1)
+    # Short page: nothing left to fetch
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_updated_since_filters_on_naive_utc(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    db = _FakeDb([])
+
+    since = datetime(2024, 5, 1, 14, 0, 0, tzinfo=timezone(timedelta(hours=2)))
+    asyncio.run(api_main.list_jobs(Response(), updated_since=since, if_none_match=None, db=db, api_key="k"))
+    query, params = db.calls[-1]
+    assert "j.updated_at > :updated_since" in query
+    assert params["updated_since"] == datetime(2024, 5, 1, 12, 0, 0)
+
+
+def test_invalid_cursor_is_rejected(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(api_main.list_jobs(
+            Response(), cursor="not-a-cursor", if_none_match=None, db=_FakeDb([]), api_key="k"
+        ))
+    assert exc.value.status_code == 400
+
+
+def test_updated_since_includes_live_progress_not_yet_in_the_database(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    since = datetime(2024, 5, 1, 12, 0, 0)
+    moving, stalled = _row(1, since - timedelta(minutes=5)), _row(2, since - timedelta(minutes=5))
+    moving.status = stalled.status = "downloading"
+    moving.progress = stalled.progress = 10
+    db = _FakeDb([moving, stalled])
+
+    async def _run():
+        # The worker published progress 3 s after `since`; its next database write is up to 15 s away
+        live_at = (since + timedelta(seconds=3)).replace(tzinfo=timezone.utc).timestamp()
+        await api_main.redis_client.hset(
+            f"job_progress:{moving.id}", mapping={"status": "downloading", "progress": "37", "updated_at": f"{live_at:.3f}"}
+        )
+        return await api_main.list_jobs(Response(), updated_since=since, if_none_match=None, db=db, api_key="k")
+
+    jobs = asyncio.run(_run())
+    query, _ = db.calls[-1]
+    assert "j.status IN ('downloading', 'processing')" in query
+    assert [(job.id, job.progress) for job in jobs] == [(moving.id, 37)]
+    # Clients pass the largest updated_at back as updated_since
+    assert jobs[0].updated_at == (since + timedelta(seconds=3)).isoformat()
@@ -0,0 +1,45 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    import main as api_main
+
+    return importlib.reload(api_main)
+
+
+def test_stream_sends_snapshot_then_job_deltas(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    async_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(api_main, "redis_client", async_redis)
+
+    async def _run():
+        pubsub = async_redis.pubsub()
+        await pubsub.subscribe(api_main.JOB_EVENTS_CHANNEL)
+        disconnected = False
+
+        async def _is_disconnected():
+            return disconnected
+
+        stream = api_main._job_event_stream(pubsub, [{"id": "a", "status": "pending"}], _is_disconnected)
+        first = await stream.__anext__()
+        await api_main._publish_job_event("a", status="downloading", progress=40)
+        second = await asyncio.wait_for(stream.__anext__(), timeout=5)
+        disconnected = True
+        await stream.aclose()
+        return first, second
+
+    first, second = asyncio.run(_run())
+
+    assert first.startswith("retry: 5000\n")
+    assert "event: snapshot\n" in first
+    assert json.loads(first.split("data: ", 1)[1]) == [{"id": "a", "status": "pending"}]
+    assert second.startswith("event: job\n")
+    assert json.loads(second.split("data: ", 1)[1]) == {"id": "a", "status": "downloading", "progress": 40}
@@ -0,0 +1,27 @@
+import asyncio
+import importlib
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    import main as api_main
+
+    return importlib.reload(api_main)
+
+
+def test_live_progress_is_read_from_worker_hashes(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(api_main, "redis_client", r)
+
+    async def _run():
+        await r.hset("job_progress:a", mapping={"status": "downloading", "progress": "42"})
+        await r.hset("job_progress:b", mapping={"status": "downloading", "progress": "bogus"})
+        return await api_main._get_live_progress(["a", "b", "c"]), await api_main._get_live_progress([])
+
+    assert asyncio.run(_run()) == ({"a": 42}, {})
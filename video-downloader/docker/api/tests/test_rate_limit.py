@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+
+import pytest
+from fastapi import HTTPException
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def _reload_api_main(monkeypatch, **env):
+    monkeypatch.setenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    import main as api_main
+
+    return importlib.reload(api_main)
+
+
+class _Request:
+    headers = {}
+    client = type("Client", (), {"host": "203.0.113.7"})()
+
+
+def test_rate_limit_counts_atomically_and_sets_ttl_once(monkeypatch):
+    api_main = _reload_api_main(monkeypatch, RATE_LIMIT_PER_MINUTE="3")
+    r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(api_main, "redis_client", r)
+
+    async def _run():
+        for _ in range(3):
+            await api_main._rate_limit(_Request(), bucket="auth")
+        with pytest.raises(HTTPException) as exc:
+            await api_main._rate_limit(_Request(), bucket="auth")
+        keys = await r.keys("rl:auth:203.0.113.7:*")
+        return exc.value.status_code, keys, await r.ttl(keys[0])
+
+    status, keys, ttl = asyncio.run(_run())
+    assert status == 429
+    assert len(keys) == 1
+    assert 0 < ttl <= 90
+
+
+def test_database_url_is_switched_to_async_driver(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+
+    url = api_main._async_database_url("postgresql://postgres:secret@db:5432/m3u8_db")
+    assert url.drivername == "postgresql+asyncpg"
+    assert url.password == "secret" and url.database == "m3u8_db"
+    assert api_main._async_database_url("postgresql+psycopg2://db/x").drivername == "postgresql+asyncpg"
+    assert api_main._async_database_url("sqlite+pysqlite:///:memory:").drivername == "sqlite+aiosqlite"
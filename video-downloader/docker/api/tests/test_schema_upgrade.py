@@ -0,0 +1,66 @@
+import asyncio
+import importlib
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _reload_api_main(monkeypatch, url="sqlite+pysqlite:///:memory:"):
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    import main as api_main
+
+    return importlib.reload(api_main)
+
+
+class _RecordingDb:
+    def __init__(self):
+        self.statements = []
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, params=None):
+        self.statements.append(" ".join(str(query).split()))
+
+    async def commit(self):
+        self.committed = True
+
+
+def test_existing_postgres_database_is_upgraded_on_startup(monkeypatch):
+    api_main = _reload_api_main(monkeypatch, "postgresql://postgres:postgres@db:5432/m3u8_db")
+    db = _RecordingDb()
+    monkeypatch.setattr(api_main, "SessionLocal", lambda: db)
+
+    async def _start():
+        async with api_main._lifespan(api_main.app):
+            pass
+
+    asyncio.run(_start())
+    assert db.statements[0].startswith("SELECT pg_advisory_xact_lock")
+    # Databases from before the series lack the columns every job query selects
+    assert "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()" in db.statements
+    assert "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS priority VARCHAR(10) NOT NULL DEFAULT 'normal'" in db.statements
+    assert any(s.startswith("CREATE TRIGGER update_jobs_updated_at") for s in db.statements)
+    # Every step can run again on the next start
+    assert all(
+        "IF NOT EXISTS" in s or "IF EXISTS" in s or s.startswith(("CREATE OR REPLACE", "CREATE TRIGGER", "SELECT"))
+        for s in db.statements
+    )
+    assert db.committed
+
+
+def test_other_databases_are_left_alone(monkeypatch):
+    api_main = _reload_api_main(monkeypatch)
+    monkeypatch.setattr(api_main, "SessionLocal", lambda: pytest.fail("no schema upgrade expected"))
+
+    async def _start():
+        async with api_main._lifespan(api_main.app):
+            pass
+
+    asyncio.run(_start())
@@ -14,9 +14,16 @@ CREATE TABLE IF NOT EXISTS jobs (
     file_size BIGINT,
     file_path TEXT,
     error_message TEXT,
-    retry_count INTEGER DEFAULT 0
+    retry_count INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    -- Queue class: high / normal / low
+    priority VARCHAR(10) NOT NULL DEFAULT 'normal'
 );
 
+-- Postgres only runs this file on an empty data dir. Databases created by an older
+-- release get later columns, indexes and triggers from the API on startup
+-- (SCHEMA_UPGRADES in api/main.py); keep the two in step.
+
 -- Job metadata table: Additional information about jobs
 CREATE TABLE IF NOT EXISTS job_metadata (
     job_id UUID PRIMARY KEY REFERENCES jobs(id) ON DELETE CASCADE,
@@ -38,7 +45,12 @@ CREATE TABLE IF NOT EXISTS config (
 
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
-CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at DESC);
+-- Keyset pagination of /api/jobs: (created_at, id) with and without a status filter
+DROP INDEX IF EXISTS idx_jobs_created;
+CREATE INDEX IF NOT EXISTS idx_jobs_created_id ON jobs(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created_id ON jobs(status, created_at DESC, id DESC);
+-- /api/jobs?updated_since=...
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at);
 CREATE INDEX IF NOT EXISTS idx_jobs_completed ON jobs(completed_at DESC);
 CREATE INDEX IF NOT EXISTS idx_jobs_url ON jobs(url);
 
@@ -69,11 +81,19 @@ END;
 $$ language 'plpgsql';
 
 -- Create trigger for config table
+DROP TRIGGER IF EXISTS update_config_updated_at ON config;
 CREATE TRIGGER update_config_updated_at 
     BEFORE UPDATE ON config
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Create trigger for jobs table (status/progress writes by the API and workers)
+DROP TRIGGER IF EXISTS update_jobs_updated_at ON jobs;
+CREATE TRIGGER update_jobs_updated_at
+    BEFORE UPDATE ON jobs
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
 -- Success message
 DO $$
 BEGIN
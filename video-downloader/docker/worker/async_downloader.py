@@ -0,0 +1,603 @@
+"""
+Async Segment Downloader
+asyncio/aiohttp engine for m3u8 video segments
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import random
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Callable, Set
+from urllib.parse import urlparse
+
+import aiohttp
+
+from downloader import (
+    SegmentDownloader, SegmentContentError, STREAM_CHUNK_SIZE, _StreamingSegmentWriter, _rejects_headers, retry_delay,
+)
+from key_cache import distinct_key_uris
+from ssl_adapter import tls_verify_enabled
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSegmentDownloader(SegmentDownloader):
+    """
+    Download video segments on a single asyncio event loop.
+
+    Uses the same segment dicts, Referer strategies, AES decryption and TS
+    validation as SegmentDownloader, but keeps up to ``max_connections``
+    requests in flight without a thread per request. Decryption and file
+    writes run on a small thread pool so they don't stall the event loop;
+    with ``stream_bodies`` they happen chunk by chunk on the loop instead.
+
+    Note: aiohttp does not impersonate a browser TLS fingerprint, so hosts
+    that rely on JA3 fingerprinting should stay on the thread engine.
+    """
+
+    def __init__(self, *args, max_connections: int = 100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_connections = max(1, int(max_connections))
+        self._key_tasks: Dict[str, asyncio.Task] = {}
+        # Loop and fetch tasks of a running download_all, so request_stop() can cancel them
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._fetch_tasks: Set[asyncio.Future] = set()
+
+    def request_stop(self):
+        """Stop scheduling and cancel in-flight requests (callable from any thread)"""
+        super().request_stop()
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._cancel_fetch_tasks)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def _cancel_fetch_tasks(self):
+        for task in list(self._fetch_tasks):
+            task.cancel()
+
+    def _session_cookies(self) -> Dict[str, str]:
+        """Best-effort copy of cookies collected by the shared (playlist) session"""
+        try:
+            return {str(k): str(v) for k, v in dict(self.session.cookies).items()}
+        except Exception:
+            return {}
+
+    def _ssl_context(self):
+        if not tls_verify_enabled():
+            return False
+        return ssl.create_default_context()
+
+    @asynccontextmanager
+    async def _ahost_slot(self, url: str):
+        """
+        Hold a per-host slot from the shared AdaptiveConcurrencyController, then a
+        lease from the cross-worker HostSemaphore and a slot from the worker-wide
+        FetchBudget (each if any).
+        Yields a dict the caller fills with 'status'; timing and errors are recorded here.
+        """
+        outcome = {'status': None}
+        host = urlparse(url).netloc
+        if self.concurrency is None:
+            async with self._alease_slot(host), self._abudget_slot():
+                yield outcome
+            return
+
+        # The controller is thread-based; poll instead of blocking the event loop
+        while not self.concurrency.try_acquire(host):
+            if self._stop_event.is_set():
+                raise RuntimeError("Stop requested")
+            await asyncio.sleep(0.05)
+        ttfb = None
+        error = False
+        try:
+            async with self._alease_slot(host), self._abudget_slot():
+                # Time from here so a wait for the budget doesn't read as CDN latency
+                started = time.monotonic()
+                yield outcome
+                ttfb = outcome.get('ttfb', time.monotonic() - started)
+        except Exception:
+            error = outcome['status'] is None
+            raise
+        finally:
+            self.concurrency.release(host, status=outcome['status'], ttfb=ttfb, error=error)
+
+    @asynccontextmanager
+    async def _alease_slot(self, host: str):
+        """Hold one of host's slots in the cross-worker HostSemaphore (Redis calls run off the loop)"""
+        if self.host_slots is None:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        delay = 0.02
+        while True:
+            lease = await loop.run_in_executor(None, self.host_slots.try_acquire, host)
+            if lease is not None:
+                break
+            if self._stop_event.is_set():
+                raise RuntimeError("Stop requested")
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(0.5, delay * 2)
+        try:
+            yield
+        finally:
+            # One ZREM; done inline so a cancelled task can't skip it
+            self.host_slots.release(host, lease)
+
+    @asynccontextmanager
+    async def _abudget_slot(self):
+        """Hold one slot of the worker-wide FetchBudget (shared with thread-engine jobs)"""
+        if self.fetch_budget is None:
+            yield
+            return
+        while not self.fetch_budget.try_acquire():
+            if self._stop_event.is_set():
+                raise RuntimeError("Stop requested")
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            self.fetch_budget.release()
+
+    async def _athrottle(self, cpu_pool: ThreadPoolExecutor, url: str, nbytes: int):
+        """Charge a body to the shared bandwidth budget and sleep off any debt without blocking the loop"""
+        if self.bandwidth is None:
+            return
+        loop = asyncio.get_running_loop()
+        wait = await loop.run_in_executor(cpu_pool, self.bandwidth.reserve, urlparse(url).netloc, nbytes)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _afetch_key(self, http: aiohttp.ClientSession, key_url: str) -> bytes:
+        # Another job (or a previous attempt of this one) may have stored it in Redis
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, self.key_cache.lookup, key_url)
+        if key is not None:
+            return key
+        async with http.get(key_url, headers=self.headers) as response:
+            response.raise_for_status()
+            key = await response.read()
+        await loop.run_in_executor(None, self.key_cache.put, key_url, key)
+        return key
+
+    async def _aget_key_bytes(self, http: aiohttp.ClientSession, key_url: str) -> bytes:
+        """Fetch AES-128 key bytes once per URI; concurrent callers await the same task."""
+        cached = self.key_cache.peek(key_url)
+        if cached is not None:
+            return cached
+
+        task = self._key_tasks.get(key_url)
+        if task is None:
+            task = asyncio.ensure_future(self._afetch_key(http, key_url))
+            self._key_tasks[key_url] = task
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            # Let the next caller retry instead of caching the failure
+            if self._key_tasks.get(key_url) is task:
+                del self._key_tasks[key_url]
+            raise
+
+    async def _aprefetch_keys(self, http: aiohttp.ClientSession):
+        """Async counterpart of prefetch_keys"""
+        uris = [uri for uri in distinct_key_uris(self.segments) if self.key_cache.peek(uri) is None]
+        if not uris:
+            return
+        logger.info(f"Prefetching {len(uris)} AES-128 key(s)")
+        results = await asyncio.gather(*(self._aget_key_bytes(http, uri) for uri in uris), return_exceptions=True)
+        for uri, result in zip(uris, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to prefetch key {uri}: {result}")
+
+    async def _atry_download_with_headers(
+        self,
+        http: aiohttp.ClientSession,
+        url: str,
+        headers: Dict,
+        index: int,
+        probe: bool = False,
+    ) -> Optional[bytes]:
+        """Async counterpart of _try_download_with_headers"""
+        try:
+            async with self._ahost_slot(url) as outcome:
+                started = time.monotonic()
+                async with http.get(url, headers=headers) as response:
+                    # aiohttp returns once headers are in, so this is a true TTFB
+                    outcome['status'] = response.status
+                    outcome['ttfb'] = time.monotonic() - started
+                    if response.status == 474:
+                        logger.debug(f"Segment {index} got 474 error with current headers")
+                        return None
+                    response.raise_for_status()
+                    content = await response.read()
+                    content_type = response.headers.get("Content-Type", "")
+            return self._accept_response_content(content, content_type=content_type)
+        except Exception as e:
+            if probe and not _rejects_headers(e):
+                raise
+            logger.debug(f"Download attempt failed: {e}")
+            return None
+
+    async def _afetch_with_original_headers(self, http: aiohttp.ClientSession, url: str, index: int) -> bytes:
+        """Last attempt with the original headers, raising on errors"""
+        async with self._ahost_slot(url) as outcome:
+            started = time.monotonic()
+            async with http.get(url, headers=self.headers) as response:
+                outcome['status'] = response.status
+                outcome['ttfb'] = time.monotonic() - started
+                if response.status == 474:
+                    logger.error(f"Segment {index} got 474 error")
+                    logger.error(f"Response headers: {dict(response.headers)}")
+                response.raise_for_status()
+                content = await response.read()
+                content_type = response.headers.get("Content-Type", "")
+
+        blocked, reason = self._is_obviously_blocked_response(content, content_type=content_type)
+        if blocked:
+            raise ValueError(reason)
+        if len(content) < 188:
+            raise ValueError(f"Segment too small: {len(content)} bytes")
+        return content
+
+    async def _astream_segment(
+        self,
+        http: aiohttp.ClientSession,
+        cpu_pool: ThreadPoolExecutor,
+        url: str,
+        headers: Dict,
+        segment: Dict,
+        output_path,
+        strict: bool = False,
+    ) -> Optional[int]:
+        """Async counterpart of _stream_segment (chunks are decrypted and written on the loop)"""
+        index = segment['index']
+        async with self._ahost_slot(url) as outcome:
+            started = time.monotonic()
+            async with http.get(url, headers=headers) as response:
+                outcome['status'] = response.status
+                outcome['ttfb'] = time.monotonic() - started
+                if response.status == 474:
+                    if not strict:
+                        logger.debug(f"Segment {index} got 474 error with current headers")
+                        return None
+                    logger.error(f"Segment {index} got 474 error")
+                    logger.error(f"Response headers: {dict(response.headers)}")
+                response.raise_for_status()
+
+                writer = _StreamingSegmentWriter(
+                    self, segment, output_path,
+                    content_type=response.headers.get("Content-Type", ""), strict=strict,
+                )
+                try:
+                    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        if self._stop_event.is_set():
+                            raise RuntimeError("Stop requested")
+                        if not writer.feed(chunk):
+                            return None
+                        await self._athrottle(cpu_pool, url, len(chunk))
+                    return writer.finish()
+                finally:
+                    writer.abort()
+
+    async def _atry_stream_with_headers(
+        self, http, cpu_pool, url, headers, segment, output_path, probe: bool = False
+    ) -> Optional[int]:
+        try:
+            return await self._astream_segment(http, cpu_pool, url, headers, segment, output_path)
+        except SegmentContentError:
+            raise
+        except Exception as e:
+            if probe and not _rejects_headers(e):
+                raise
+            logger.debug(f"Download attempt failed: {e}")
+            return None
+
+    async def _arun_referer_strategies(self, url: str, index: int, retry_count: int, attempt):
+        """Async counterpart of _run_referer_strategies (attempt returns an awaitable)"""
+        remembered = self.working_referer_strategy
+        if remembered and retry_count == 0:
+            result = await attempt(self._apply_strategy_headers(remembered))
+            if result:
+                return result, remembered['name']
+
+        for strategy in self._get_referer_strategies(url):
+            if self._stop_event.is_set():
+                logger.debug(f"Segment {index} aborted during strategy attempts - stop requested")
+                return None, None
+            if index == 0 and retry_count == 0:
+                logger.info(f"Trying Referer strategy: {strategy['name']}")
+            result = await attempt(self._apply_strategy_headers(strategy))
+            if result:
+                if remembered is None or remembered['name'] != strategy['name']:
+                    self._remember_referer_strategy(strategy, url)
+                return result, strategy['name']
+        return None, None
+
+    async def _aprobe_segment(self, http, cpu_pool, segment: Dict, strategy: Dict) -> Optional[str]:
+        """Async counterpart of _probe_segment"""
+        url = segment['url']
+        index = segment['index']
+        output_path = self.output_dir / f"segment_{index:05d}.ts"
+        headers = self._apply_strategy_headers(strategy)
+        if self.stream_bodies:
+            size = await self._atry_stream_with_headers(http, cpu_pool, url, headers, segment, output_path, probe=True)
+        else:
+            content = await self._atry_download_with_headers(http, url, headers, index, probe=True)
+            size = None
+            if content is not None:
+                await self._athrottle(cpu_pool, url, len(content))
+                loop = asyncio.get_running_loop()
+                size = await loop.run_in_executor(cpu_pool, self._finalize_segment, segment, content, output_path)
+        return None if size is None else str(output_path)
+
+    async def _adiscover_referer_strategy(self, http, cpu_pool, remaining: List[Dict], downloaded_files) -> List[Dict]:
+        """Async counterpart of discover_referer_strategy"""
+        if not remaining or self.working_referer_strategy is not None:
+            return remaining
+
+        first_url = remaining[0]['url']
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(cpu_pool, self._cached_referer_strategy, first_url)
+        if cached is not None:
+            logger.info(f"Using cached Referer strategy for {urlparse(first_url).netloc}: {cached['name']}")
+            self.working_referer_strategy = cached
+            return remaining
+
+        probes = self._discovery_probes(remaining)
+        done = set()
+        try:
+            for strategy in self._get_referer_strategies(first_url):
+                if self._stop_event.is_set():
+                    break
+                logger.info(f"Probing Referer strategy: {strategy['name']}")
+                working = True
+                for segment in probes:
+                    if segment['index'] in done:
+                        continue
+                    file_path = await self._aprobe_segment(http, cpu_pool, segment, strategy)
+                    if file_path is None:
+                        working = False
+                        break
+                    downloaded_files[segment['index'] - self.first_index] = file_path
+                    self.downloaded_count += 1
+                    done.add(segment['index'])
+                if working:
+                    await loop.run_in_executor(cpu_pool, self._remember_referer_strategy, strategy, first_url)
+                    break
+            else:
+                logger.warning("Referer discovery found no working strategy; segments will try each one")
+        except Exception as e:
+            logger.warning(f"Referer discovery aborted: {e}")
+        return [segment for segment in remaining if segment['index'] not in done]
+
+    async def _aattempt_segment(
+        self,
+        http: aiohttp.ClientSession,
+        cpu_pool: ThreadPoolExecutor,
+        segment: Dict,
+        attempt: int = 0,
+    ) -> Optional[str]:
+        """One async download attempt; returns the path, None if stop was requested, raises on failure"""
+        url = segment['url']
+        index = segment['index']
+        output_path = self.output_dir / f"segment_{index:05d}.ts"
+        loop = asyncio.get_running_loop()
+
+        # Resolve rotating keys on the loop so decryption hits the cache
+        segment_key = segment.get("key")
+        if isinstance(segment_key, dict) and segment_key.get("method") == "AES-128" and segment_key.get("uri"):
+            await self._aget_key_bytes(http, segment_key["uri"])
+
+        if self.stream_bodies:
+            size, used_strategy = await self._arun_referer_strategies(
+                url, index, attempt,
+                lambda headers: self._atry_stream_with_headers(http, cpu_pool, url, headers, segment, output_path),
+            )
+            if size is None:
+                if self._stop_event.is_set():
+                    return None
+                size = await self._astream_segment(
+                    http, cpu_pool, url, self.headers, segment, output_path, strict=True
+                )
+        else:
+            content, used_strategy = await self._arun_referer_strategies(
+                url, index, attempt,
+                lambda headers: self._atry_download_with_headers(http, url, headers, index),
+            )
+            if content is None:
+                if self._stop_event.is_set():
+                    return None
+                content = await self._afetch_with_original_headers(http, url, index)
+
+            await self._athrottle(cpu_pool, url, len(content))
+            size = await loop.run_in_executor(cpu_pool, self._finalize_segment, segment, content, output_path)
+
+        if index == 0 and used_strategy:
+            logger.info(f"Segment {index} downloaded successfully with strategy: {used_strategy}")
+        else:
+            logger.debug(f"Segment {index} downloaded and validated successfully ({size} bytes)")
+        return str(output_path)
+
+    async def _arun_scheduled(
+        self,
+        http: aiohttp.ClientSession,
+        cpu_pool: ThreadPoolExecutor,
+        segments: List[Dict],
+        downloaded_files: List[Optional[str]],
+        progress_callback: Optional[Callable[[int, int], None]],
+        max_retries: int,
+        abort_error: List[BaseException],
+    ) -> List[Dict]:
+        """
+        Run worker coroutines over segments. A failed attempt is re-queued after its
+        backoff with loop.call_later, so the worker moves straight on to the next segment.
+
+        Returns:
+            Segments that exhausted max_retries (already recorded in failed_segments)
+        """
+        loop = asyncio.get_running_loop()
+        pending = iter(segments)
+        ready = collections.deque()  # (segment, attempt) retries whose backoff expired
+        wakeup = asyncio.Event()
+        delayed = 0
+        stragglers: List[Dict] = []
+
+        def _requeue(item):
+            nonlocal delayed
+            delayed -= 1
+            ready.append(item)
+            wakeup.set()
+
+        async def _next_item():
+            while not self._stop_event.is_set():
+                if ready:
+                    return ready.popleft()
+                # Each worker pulls the next segment lazily, so in-flight work
+                # stays bounded by max_connections regardless of playlist size.
+                segment = next(pending, None)
+                if segment is not None:
+                    return segment, 0
+                if not delayed:
+                    return None
+                wakeup.clear()
+                await wakeup.wait()
+            return None
+
+        async def _worker():
+            nonlocal delayed
+            while True:
+                item = await _next_item()
+                if item is None:
+                    return
+                segment, attempt = item
+                index = segment['index']
+                # Host's circuit is open: this worker holds its segment until a probe may go
+                while (wait_for := self._circuit_wait(segment)) > 0:
+                    if self._stop_event.is_set():
+                        return
+                    await asyncio.sleep(min(wait_for, 0.5))
+                try:
+                    file_path = await self._aattempt_segment(http, cpu_pool, segment, attempt)
+                except Exception as e:
+                    if self._stop_event.is_set():
+                        return
+                    logger.warning(f"Failed to download segment {index} (attempt {attempt + 1}): {e}")
+                    code = self._record_failure(segment, e)
+                    if attempt < max_retries:
+                        delayed += 1
+                        loop.call_later(retry_delay(attempt, e), _requeue, (segment, attempt + 1))
+                        if not self._circuit_open(segment):
+                            continue
+                        # Let the job look at the open circuit now rather than after every retry
+                    else:
+                        logger.error(f"Segment {index} failed after {attempt + 1} attempts")
+                        self._give_up(segment, e, code)
+                        stragglers.append(segment)
+                    file_path = None
+                else:
+                    if not file_path:
+                        return  # stop requested
+                    self._record_success(segment)
+                    downloaded_files[index - self.first_index] = file_path
+                    self.downloaded_count += 1
+
+                if progress_callback and not self._stop_event.is_set():
+                    try:
+                        progress_callback(self.downloaded_count, self.total_segments)
+                    except Exception as e:
+                        # Callback raised (e.g. job cancelled): stop everyone and re-raise later
+                        logger.warning("Download aborted, signaling stop and cancelling remaining tasks...")
+                        abort_error.append(e)
+                        self._stop_event.set()
+                        wakeup.set()
+                        return
+
+        workers = [asyncio.ensure_future(_worker()) for _ in range(min(self.max_connections, len(segments)))]
+        self._fetch_tasks.update(workers)
+        try:
+            # Workers cancelled by request_stop() come back as CancelledError results
+            results = await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            self._fetch_tasks.difference_update(workers)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return stragglers
+
+    async def _adownload_all(
+        self,
+        progress_callback: Optional[Callable[[int, int], None]],
+    ) -> List[Optional[str]]:
+        downloaded_files: List[Optional[str]] = [None] * self.total_segments
+        remaining = self._resume_from_checkpoint(downloaded_files)
+        abort_error: List[BaseException] = []
+        self._loop = asyncio.get_running_loop()
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=self._ssl_context())
+        # Per connect / per read like the thread engine: a body held back by bandwidth
+        # shaping may take longer than `timeout` in total without being cut off
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        cpu_workers = min(8, (os.cpu_count() or 2) + 2)
+
+        async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            cookies=self._session_cookies(),
+        ) as http:
+            with ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="segment-cpu") as cpu_pool:
+                await self._aprefetch_keys(http)
+                remaining = await self._adiscover_referer_strategy(http, cpu_pool, remaining, downloaded_files)
+                stragglers = await self._arun_scheduled(
+                    http, cpu_pool, remaining, downloaded_files, progress_callback, self.max_retries, abort_error
+                )
+                # Final repair pass, same as the thread engine
+                if stragglers and not self._stop_event.is_set():
+                    logger.info(f"Repair pass: re-fetching {len(stragglers)} failed segments")
+                    self._forget_failed({segment['index'] for segment in stragglers})
+                    stragglers = await self._arun_scheduled(
+                        http, cpu_pool, stragglers, downloaded_files, progress_callback, 0, abort_error
+                    )
+                for segment in stragglers:
+                    self._skip_in_sink(segment['index'])
+
+        if abort_error:
+            raise abort_error[0]
+        return downloaded_files
+
+    def download_all(
+        self,
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> List[str]:
+        """
+        Download all segments on an asyncio event loop
+
+        Args:
+            progress_callback: Optional callback function(completed, total)
+
+        Returns:
+            List of downloaded file paths
+        """
+        logger.info(f"Starting async download of {self.total_segments} segments with {self.max_connections} connections")
+        started_at = time.monotonic()
+
+        try:
+            downloaded_files = asyncio.run(self._adownload_all(progress_callback))
+        finally:
+            self._loop = None
+
+        successful_files = [f for f in downloaded_files if f is not None]
+
+        logger.info(f"Download complete: {len(successful_files)}/{self.total_segments} segments successful")
+        self._log_throughput(started_at)
+
+        if self.failed_segments:
+            logger.warning(f"Failed segments: {len(self.failed_segments)}")
+
+        return successful_files
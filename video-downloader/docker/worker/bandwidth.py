@@ -0,0 +1,166 @@
+"""
+Bandwidth Limiter
+Redis-backed token buckets shared by every worker (global, per-worker and per-host)
+"""
+
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEY = "bandwidth:config"
+CONFIG_REFRESH_SECONDS = 5.0
+BUCKET_TTL_SECONDS = 3600
+
+# Charge `requested` bytes against every bucket in KEYS and return how long the
+# caller must wait (microseconds) before its next transfer. Buckets may go into
+# debt, so the long-run rate converges to the ceiling even though transfer sizes
+# are only known afterwards. Uses the Redis server clock so workers agree on time.
+# ARGV: requested, then (rate, burst) pairs in bytes/s and bytes, one per key.
+TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local max_wait = 0
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 2])
+  local burst = tonumber(ARGV[i * 2 + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or burst
+  local ts = tonumber(state[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - requested
+  if tokens < 0 then
+    local wait = -tokens / rate
+    if wait > max_wait then max_wait = wait end
+  end
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+  redis.call('EXPIRE', key, tonumber(ARGV[#ARGV]))
+end
+return math.floor(max_wait * 1000000)
+"""
+
+_RATE_SUFFIXES = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+_RATE_PATTERN = re.compile(r'^([0-9]*\.?[0-9]+)\s*([kmg]?)(?:i?b)?(?:/s|ps)?$')
+
+
+def parse_rate(value) -> int:
+    """
+    Parse a rate in bytes per second: "0"/"" (unlimited), "800K", "12M", "1.5GB/s" or plain bytes.
+    Invalid values are treated as unlimited.
+    """
+    if value is None:
+        return 0
+    raw = str(value).strip().lower()
+    if not raw:
+        return 0
+    match = _RATE_PATTERN.match(raw)
+    if not match:
+        logger.warning(f"Invalid bandwidth rate {value!r}, treating as unlimited")
+        return 0
+    return int(float(match.group(1)) * _RATE_SUFFIXES[match.group(2)])
+
+
+class BandwidthLimiter:
+    """
+    Shape download throughput with token buckets stored in Redis.
+
+    Limits (bytes/s, 0 = unlimited) come from the constructor defaults (env) and
+    can be changed at runtime in the ``bandwidth:config`` hash, which is re-read
+    every few seconds:
+
+        HSET bandwidth:config global 12M            # all workers together
+        HSET bandwidth:config worker 6M             # each worker (default)
+        HSET bandwidth:config worker:video_worker_1 8M
+        HSET bandwidth:config host 4M               # each source host (default)
+        HSET bandwidth:config host:cdn.example.com 2M
+
+    If Redis is unavailable, shaping is skipped rather than failing downloads.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        worker_id: str,
+        global_rate: int = 0,
+        worker_rate: int = 0,
+        host_rate: int = 0,
+    ):
+        self.redis = redis_client
+        self.worker_id = worker_id
+        self._defaults = {'global': global_rate, 'worker': worker_rate, 'host': host_rate}
+        self._overrides: Dict[str, int] = {}
+        self._config_expires = 0.0
+        self._config_lock = threading.Lock()
+        self._script = None
+        self._warned = False
+
+    def _refresh_config(self):
+        now = time.monotonic()
+        if now < self._config_expires:
+            return
+        with self._config_lock:
+            if now < self._config_expires:
+                return
+            self._config_expires = now + CONFIG_REFRESH_SECONDS
+            try:
+                raw = self.redis.hgetall(CONFIG_KEY) or {}
+            except Exception:
+                return
+            overrides = {str(k): parse_rate(v) for k, v in raw.items()}
+            if overrides != self._overrides:
+                logger.info(f"Bandwidth limits updated from Redis: {overrides or 'defaults'}")
+            self._overrides = overrides
+
+    def _rate(self, scope: str, name: Optional[str] = None) -> int:
+        if name is not None and f"{scope}:{name}" in self._overrides:
+            return self._overrides[f"{scope}:{name}"]
+        return self._overrides.get(scope, self._defaults[scope])
+
+    def limits_for(self, host: Optional[str]) -> Dict[str, int]:
+        """Bucket key -> rate (bytes/s) for the limits that currently apply"""
+        self._refresh_config()
+        limits = {
+            'bw:global': self._rate('global'),
+            f"bw:worker:{self.worker_id}": self._rate('worker', self.worker_id),
+        }
+        if host:
+            limits[f"bw:host:{host}"] = self._rate('host', host)
+        return {key: rate for key, rate in limits.items() if rate > 0}
+
+    def reserve(self, host: Optional[str], nbytes: int) -> float:
+        """Charge nbytes to the applicable buckets; returns seconds to wait (no sleeping)"""
+        if nbytes <= 0:
+            return 0.0
+        limits = self.limits_for(host)
+        if not limits:
+            return 0.0
+
+        args = [nbytes]
+        for rate in limits.values():
+            # Allow one second of burst so short stalls don't waste the budget
+            args.extend([rate, rate])
+        args.append(BUCKET_TTL_SECONDS)
+        try:
+            if self._script is None:
+                self._script = self.redis.register_script(TOKEN_BUCKET_LUA)
+            wait_us = self._script(keys=list(limits.keys()), args=args)
+        except Exception as e:
+            if not self._warned:
+                logger.warning(f"Bandwidth limiter unavailable, not shaping: {e}")
+                self._warned = True
+            return 0.0
+        self._warned = False
+        return int(wait_us or 0) / 1_000_000
+
+    def consume(self, host: Optional[str], nbytes: int, stop_event: Optional[threading.Event] = None):
+        """Charge nbytes and sleep until the budget allows the next transfer"""
+        wait = self.reserve(host, nbytes)
+        if wait <= 0:
+            return
+        if stop_event is not None:
+            stop_event.wait(wait)
+        else:
+            time.sleep(wait)
@@ -0,0 +1,113 @@
+"""
+Scheduler benchmark: bounded submission window vs. submitting every segment up front.
+
+Runs SegmentDownloader.download_all on a synthetic playlist with the network stubbed
+out, so only scheduling overhead is measured (wall time, peak Python heap via
+tracemalloc, and how long a cancellation takes to unwind).
+
+    cd video-downloader/docker/worker
+    python benchmarks/bench_scheduler.py --segments 50000 --workers 16
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from downloader import SegmentDownloader  # noqa: E402
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _synthetic_segments(count: int):
+    return [
+        {"url": f"https://cdn.example.com/v/seg{i:06d}.ts?token=abc", "index": i, "sequence": i, "key": None}
+        for i in range(count)
+    ]
+
+
+class _StubDownloader(SegmentDownloader):
+    """No network: every attempt succeeds immediately"""
+
+    def prefetch_keys(self):
+        pass
+
+    def discover_referer_strategy(self, remaining, downloaded_files):
+        return remaining
+
+    def _attempt_segment(self, segment, attempt=0):
+        return f"segment_{segment['index']:05d}.ts"
+
+
+def _upfront_download_all(d: SegmentDownloader, progress_callback):
+    """Reference: the previous scheduler (one future per segment, submitted up front)"""
+    downloaded = [None] * d.total_segments
+    with ThreadPoolExecutor(max_workers=d.max_workers) as executor:
+        future_to_segment = {executor.submit(d._attempt_segment, s, 0): s for s in d.segments}
+        try:
+            for future in as_completed(future_to_segment):
+                downloaded[future_to_segment[future]['index']] = future.result()
+                d.downloaded_count += 1
+                if progress_callback:
+                    progress_callback(d.downloaded_count, d.total_segments)
+        except Exception:
+            d.request_stop()
+            for f in future_to_segment:
+                f.cancel()
+            raise
+    return downloaded
+
+
+def _run(mode: str, segments, workers: int, cancel_at=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        d = _StubDownloader(segments=segments, output_dir=tmp, session=object(), max_workers=workers)
+        cancelled_at = {}
+
+        def _progress(done, total):
+            if cancel_at is not None and done >= cancel_at:
+                cancelled_at["t"] = time.perf_counter()
+                raise _Cancelled()
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            if mode == "window":
+                d.download_all(_progress)
+            else:
+                _upfront_download_all(d, _progress)
+        except _Cancelled:
+            pass
+        finished = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    unwind = finished - cancelled_at["t"] if "t" in cancelled_at else None
+    return finished - started, peak, unwind
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    segments = _synthetic_segments(args.segments)
+    print(f"{args.segments} synthetic segments, {args.workers} workers\n")
+    print(f"{'scheduler':<10} {'full run':>10} {'peak heap':>11} {'cancel@1%':>11}")
+    for mode in ("upfront", "window"):
+        elapsed, peak, _ = _run(mode, segments, args.workers)
+        _, _, unwind = _run(mode, segments, args.workers, cancel_at=max(1, args.segments // 100))
+        print(f"{mode:<10} {elapsed:>9.2f}s {peak / 1024 / 1024:>9.1f}MB {unwind * 1000:>9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Job Cancellation
+Push-based cancel: the API publishes job ids on a Redis channel and running jobs
+abort their downloads and FFmpeg processes as soon as the message arrives
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+# The API publishes the job id here on DELETE /api/jobs/{job_id}
+CANCEL_CHANNEL = "job_cancel"
+
+
+class CancelToken:
+    """Cancellation state of one running job (or shard); callbacks run once, on cancel"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Run callback on cancel (right away if the job is already cancelled)"""
+        with self._lock:
+            if not self.event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def _run(self, callback: Callable[[], None]):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Cancel callback for job {self.job_id} failed: {e}")
+
+
+class CancelRegistry:
+    """Tokens of the jobs running in this worker process, by job id"""
+
+    def __init__(self):
+        self._tokens: Dict[str, Set[CancelToken]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, job_id: str) -> CancelToken:
+        token = CancelToken(job_id)
+        with self._lock:
+            self._tokens.setdefault(job_id, set()).add(token)
+        return token
+
+    def unregister(self, token: CancelToken):
+        with self._lock:
+            tokens = self._tokens.get(token.job_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens[token.job_id]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel every token of job_id; returns False if the job isn't running here"""
+        with self._lock:
+            tokens = list(self._tokens.get(job_id, ()))
+        for token in tokens:
+            token.cancel()
+        if tokens:
+            logger.info(f"Job {job_id} cancelled, aborting {len(tokens)} running task(s)")
+        return bool(tokens)
+
+
+class CancelListener(threading.Thread):
+    """Daemon thread feeding CANCEL_CHANNEL messages into a CancelRegistry; reconnects on errors"""
+
+    def __init__(self, redis_client, registry: CancelRegistry, channel: str = CANCEL_CHANNEL):
+        super().__init__(name="cancel-listener", daemon=True)
+        self.redis = redis_client
+        self.registry = registry
+        self.channel = channel
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get('type') == 'message':
+                        self.registry.cancel(str(message['data']))
+            except Exception as e:
+                logger.warning(f"Cancel listener error: {e}")
+                self._stopped.wait(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
@@ -0,0 +1,167 @@
+"""
+Segment Checkpoint
+Persistent manifest of completed segments so HLS jobs can resume after a retry or restart
+"""
+
+import hashlib
+import json
+import logging
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "checkpoint.jsonl"
+MANIFEST_VERSION = 1
+
+
+def playlist_fingerprint(segments: List[Dict]) -> str:
+    """
+    Identify a playlist by segment sequence numbers and URL paths.
+    Query strings are ignored because signed CDN tokens change on every re-parse.
+    """
+    h = hashlib.sha1()
+    for segment in segments:
+        path = urlparse(segment.get('url', '')).path
+        h.update(f"{segment.get('sequence', segment.get('index'))}|{path}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def segment_checksum(data: bytes) -> str:
+    """Cheap content checksum (CRC32) recorded per segment"""
+    return f"{zlib.crc32(data) & 0xffffffff:08x}"
+
+
+class SegmentCheckpoint:
+    """
+    Append-only manifest of completed segments in a stable per-job staging directory.
+
+    Each line of ``checkpoint.jsonl`` is a JSON object. The first line is a header
+    with the playlist fingerprint; every other line records one completed segment
+    (index, size, crc32). Lines are only appended after the segment file has been
+    atomically renamed into place, so a crash can at worst lose the last record.
+    """
+
+    def __init__(self, staging_dir: str, fingerprint: str, verify_checksums: bool = False):
+        self.staging_dir = Path(staging_dir)
+        self.fingerprint = fingerprint
+        self.verify_checksums = verify_checksums
+        self.manifest_path = self.staging_dir / MANIFEST_NAME
+        self._entries: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def for_job(cls, job_id: str, segments: List[Dict], root: str, verify_checksums: bool = False) -> "SegmentCheckpoint":
+        """Open (or create) the checkpoint for a job under ``root/<job_id>``"""
+        return cls(str(Path(root) / job_id), playlist_fingerprint(segments), verify_checksums=verify_checksums)
+
+    def _load(self):
+        if not self.manifest_path.exists():
+            self._write_header()
+            return
+
+        entries = {}
+        header_ok = False
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append
+                        continue
+                    if line_no == 0:
+                        header_ok = (
+                            record.get('version') == MANIFEST_VERSION
+                            and record.get('fingerprint') == self.fingerprint
+                        )
+                        if not header_ok:
+                            break
+                        continue
+                    entries[int(record['index'])] = record
+        except Exception as e:
+            logger.warning(f"Unreadable checkpoint manifest {self.manifest_path}: {e}")
+            header_ok = False
+
+        if not header_ok:
+            logger.info(f"Checkpoint in {self.staging_dir} is for a different playlist, starting over")
+            self._reset()
+            return
+
+        self._entries = entries
+        if entries:
+            logger.info(f"Loaded checkpoint with {len(entries)} completed segments from {self.staging_dir}")
+
+    def _write_header(self):
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': MANIFEST_VERSION, 'fingerprint': self.fingerprint, 'created_at': time.time()}) + "\n")
+
+    def _reset(self):
+        for file in self.staging_dir.glob("segment_*.ts*"):
+            file.unlink(missing_ok=True)
+        self._entries = {}
+        self._write_header()
+
+    def record(self, index: int, path: str, size: int, checksum: str):
+        """Record a completed segment (call after the file is fully written)"""
+        record = {'index': index, 'file': Path(path).name, 'size': size, 'crc32': checksum}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.manifest_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self._entries[index] = record
+
+    def completed_path(self, index: int) -> Optional[str]:
+        """Return the file path for a completed segment if it is still intact on disk"""
+        record = self._entries.get(index)
+        if not record:
+            return None
+        path = self.staging_dir / record['file']
+        try:
+            if path.stat().st_size != record['size']:
+                return None
+            if self.verify_checksums:
+                with open(path, 'rb') as f:
+                    if segment_checksum(f.read()) != record['crc32']:
+                        return None
+        except OSError:
+            return None
+        return str(path)
+
+    @property
+    def completed_count(self) -> int:
+        return len(self._entries)
+
+    def discard(self):
+        """Remove the staging directory and everything in it"""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+
+def prune_stale_checkpoints(root: str, max_age_hours: float) -> int:
+    """Delete staging directories untouched for longer than max_age_hours; returns count removed"""
+    root_path = Path(root)
+    if not root_path.is_dir() or max_age_hours <= 0:
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in root_path.iterdir():
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                manifest = entry / MANIFEST_NAME
+                if manifest.exists() and manifest.stat().st_mtime >= cutoff:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"Pruned {removed} stale checkpoint directories from {root}")
+    return removed
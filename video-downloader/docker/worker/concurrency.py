@@ -0,0 +1,205 @@
+"""
+Adaptive Concurrency
+Per-host AIMD limiter and worker-wide fetch budget for segment fetches
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "slow down" rather than "this request is wrong".
+# 403/474 are included because several CDNs answer excess parallelism with them.
+THROTTLE_STATUS_CODES = frozenset({403, 429, 474})
+
+
+def is_congestion_status(status: Optional[int]) -> bool:
+    return status is not None and (status in THROTTLE_STATUS_CODES or status >= 500)
+
+
+class _HostState:
+    __slots__ = ("limit", "in_flight", "ttfb_ewma", "ttfb_baseline", "samples", "successes", "last_decrease")
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        self.ttfb_ewma: Optional[float] = None
+        self.ttfb_baseline: Optional[float] = None
+        self.samples = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+
+
+class AdaptiveConcurrencyController:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight requests per host.
+
+    - A full window of healthy responses (``limit`` successes in a row) raises the
+      limit by one.
+    - A congestion signal cuts the limit by ``backoff_factor``. Signals are
+      429/474/403, 5xx, connection errors and timeouts, or time-to-first-byte
+      rising above ``latency_tolerance`` x the host's baseline. At most one cut
+      happens per ``cooldown`` seconds so one burst of errors isn't counted many times.
+
+    Thread-safe; one instance is meant to be shared by every download in the
+    worker process so learned limits carry over between jobs.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff_factor: float = 0.5,
+        latency_tolerance: float = 2.5,
+        cooldown: float = 2.0,
+    ):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.initial_limit = min(max(int(initial_limit), self.min_limit), self.max_limit)
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self._hosts: Dict[str, _HostState] = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(float(self.initial_limit))
+            self._hosts[host] = state
+        return state
+
+    def try_acquire(self, host: str) -> bool:
+        """Take an in-flight slot for host if one is free (non-blocking)"""
+        with self._cond:
+            state = self._state(host)
+            if state.in_flight >= int(state.limit):
+                return False
+            state.in_flight += 1
+            return True
+
+    def acquire(self, host: str, stop_event: Optional[threading.Event] = None) -> bool:
+        """
+        Block until an in-flight slot for host is free
+
+        Returns:
+            False if stop_event was set while waiting
+        """
+        with self._cond:
+            state = self._state(host)
+            while state.in_flight >= int(state.limit):
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._cond.wait(0.5)
+            state.in_flight += 1
+            return True
+
+    def release(self, host: str, status: Optional[int] = None, ttfb: Optional[float] = None, error: bool = False):
+        """Return a slot and feed the request outcome into the AIMD loop"""
+        with self._cond:
+            state = self._state(host)
+            state.in_flight = max(0, state.in_flight - 1)
+
+            congested = error or is_congestion_status(status)
+            reason = "error" if error else f"HTTP {status}"
+
+            if not congested and ttfb is not None:
+                state.samples += 1
+                state.ttfb_ewma = ttfb if state.ttfb_ewma is None else 0.8 * state.ttfb_ewma + 0.2 * ttfb
+                if state.ttfb_baseline is None or state.ttfb_ewma < state.ttfb_baseline:
+                    state.ttfb_baseline = state.ttfb_ewma
+                else:
+                    # Let the baseline drift up slowly so a permanently slower CDN isn't penalized forever
+                    state.ttfb_baseline += (state.ttfb_ewma - state.ttfb_baseline) * 0.01
+                if state.samples >= 10 and state.ttfb_ewma > state.ttfb_baseline * self.latency_tolerance:
+                    congested = True
+                    reason = f"TTFB {state.ttfb_ewma * 1000:.0f}ms vs baseline {state.ttfb_baseline * 1000:.0f}ms"
+
+            now = time.monotonic()
+            if congested:
+                state.successes = 0
+                if now - state.last_decrease >= self.cooldown:
+                    old = int(state.limit)
+                    state.limit = max(float(self.min_limit), state.limit * self.backoff_factor)
+                    state.last_decrease = now
+                    if int(state.limit) != old:
+                        logger.info(f"Concurrency for {host}: {old} -> {int(state.limit)} ({reason})")
+            elif status is not None and status < 400:
+                state.successes += 1
+                if state.successes >= int(state.limit) and state.limit < self.max_limit:
+                    state.limit = min(float(self.max_limit), state.limit + 1)
+                    state.successes = 0
+                    logger.debug(f"Concurrency for {host}: raised to {int(state.limit)}")
+
+            self._cond.notify_all()
+
+    def limit_for(self, host: str) -> int:
+        with self._cond:
+            return int(self._state(host).limit)
+
+    def snapshot(self, hosts=None) -> Dict[str, Dict]:
+        """Current limit, in-flight count and smoothed TTFB per host"""
+        with self._cond:
+            items = self._hosts.items() if hosts is None else (
+                (h, self._hosts[h]) for h in hosts if h in self._hosts
+            )
+            return {
+                host: {
+                    "limit": int(state.limit),
+                    "in_flight": state.in_flight,
+                    "ttfb_ms": round(state.ttfb_ewma * 1000) if state.ttfb_ewma is not None else None,
+                }
+                for host, state in items
+            }
+
+
+class FetchBudget:
+    """
+    Fixed cap on segment requests in flight across every job in the worker process.
+
+    Concurrent jobs each run their own fetch pool; drawing from one budget keeps
+    the container's total socket count bounded no matter how many jobs are active.
+    Same acquire/try_acquire/release shape as AdaptiveConcurrencyController, minus
+    the host.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    def try_acquire(self) -> bool:
+        """Take a fetch slot if one is free (non-blocking)"""
+        with self._cond:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def acquire(self, stop_event: Optional[threading.Event] = None) -> bool:
+        """
+        Block until a fetch slot is free
+
+        Returns:
+            False if stop_event was set while waiting
+        """
+        with self._cond:
+            while self._in_flight >= self.limit:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._cond.wait(0.5)
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify()
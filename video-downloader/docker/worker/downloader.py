@@ -3,18 +3,27 @@ Segment Downloader
 Multi-threaded downloader for m3u8 video segments
 """
 
+import heapq
 import logging
 import os
+import random
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Optional, Callable
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Optional, Callable, Tuple
 import time
+from contextlib import contextmanager
 from pathlib import Path
 from urllib.parse import urlparse
 import urllib3
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 from ssl_adapter import create_legacy_session, create_impersonated_session, tls_verify_enabled
+from checkpoint import segment_checksum
+from failures import BLOCKED, HOTLINK, FailureCounters, classify_failure
+from key_cache import KeyCache, distinct_key_uris
 
 if not tls_verify_enabled():
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -32,6 +41,232 @@ GIF_MAGIC = b'GIF8'
 MP4_FTYP_AT_4 = b'ftyp'
 MP4_STYP_AT_4 = b'styp'
 
+# Streaming segment bodies: read size per chunk, and how much of the start of a
+# response is inspected for block pages before anything is decrypted or written
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_HEAD_BYTES = 1024
+
+# In-flight + queued futures per pool thread; the rest of the playlist is pulled lazily
+SUBMISSION_WINDOW_FACTOR = 2
+
+# Consistent observations needed before the decryption profile stops attempting PKCS#7 unpadding
+PADDING_CONFIRMATIONS = 3
+
+# Segment retry backoff (seconds): jittered exponential, or Retry-After when the server asks for longer
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRY_AFTER_MAX = 120.0
+
+
+def _response_elapsed(response, started: float) -> float:
+    """Response latency in seconds: requests' elapsed (time to headers) when available, else wall time"""
+    elapsed = getattr(response, "elapsed", None)
+    if hasattr(elapsed, "total_seconds"):
+        return elapsed.total_seconds()
+    if isinstance(elapsed, (int, float)) and elapsed > 0:
+        return float(elapsed)
+    return time.monotonic() - started
+
+
+def _retry_after_seconds(error) -> Optional[float]:
+    """Retry-After (delta-seconds or HTTP date) carried by an HTTP error, if any"""
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        # requests/curl_cffi errors carry .response, aiohttp's ClientResponseError carries .headers
+        for holder in (getattr(error, 'response', None), error):
+            try:
+                value = getattr(holder, 'headers', None).get('Retry-After')
+            except Exception:
+                value = None
+            if value:
+                break
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(str(value)) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def retry_delay(attempt: int, error=None) -> float:
+    """
+    Delay before retry number attempt+1: equal-jitter exponential backoff
+    (so retries of a failed burst don't hit the CDN in lockstep), or the
+    server's Retry-After if that is longer (capped at RETRY_AFTER_MAX).
+    """
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_AFTER_MAX))
+    return delay
+
+
+def _rejects_headers(error) -> bool:
+    """Whether a failed attempt means the CDN refused these headers (vs. a transient error)"""
+    return classify_failure(error) in (BLOCKED, HOTLINK)
+
+
+class SegmentContentError(ValueError):
+    """Segment body was delivered but failed decryption or TS validation"""
+
+
+class _CbcStreamDecryptor:
+    """
+    Incremental AES-128-CBC decryption.
+    The last block is held back until finalize() so PKCS#7 padding can be stripped.
+    """
+
+    def __init__(self, key: bytes, iv: bytes, strip_padding: bool = True):
+        self._cipher = AES.new(key, AES.MODE_CBC, iv)
+        self._pending = b''
+        self.strip_padding = strip_padding
+        # Whether the final block carried valid PKCS#7 padding (None until finalize)
+        self.padded: Optional[bool] = None
+
+    def update(self, data: bytes) -> bytes:
+        data = self._pending + data
+        cut = ((len(data) - 1) // AES.block_size) * AES.block_size if data else 0
+        self._pending = data[cut:]
+        return self._cipher.decrypt(data[:cut]) if cut else b''
+
+    def finalize(self) -> bytes:
+        if not self._pending:
+            return b''
+        # Unaligned tail: zero-pad like the buffered path does
+        block = self._pending + bytes(-len(self._pending) % AES.block_size)
+        self._pending = b''
+        decrypted = self._cipher.decrypt(block)
+        if not self.strip_padding:
+            return decrypted
+        try:
+            decrypted = unpad(decrypted, AES.block_size)
+            self.padded = True
+        except ValueError:
+            # Some streams don't use proper padding
+            self.padded = False
+        return decrypted
+
+
+class _StreamingSegmentWriter:
+    """
+    Push-based writer for one streamed segment body.
+
+    Chunks are fed as they arrive. The first STREAM_HEAD_BYTES are checked for
+    block pages, the IV is chosen from the first cipher block only, then the
+    body is decrypted and written chunk by chunk. The start of the plaintext is
+    TS-validated before anything reaches disk. Memory per segment stays at
+    roughly one chunk plus the head buffer.
+    """
+
+    def __init__(self, downloader: "SegmentDownloader", segment: Dict, output_path: Path,
+                 content_type: str = "", strict: bool = False):
+        self.downloader = downloader
+        self.segment = segment
+        self.output_path = output_path
+        self.tmp_path = output_path.with_name(output_path.name + ".tmp")
+        self.content_type = content_type
+        self.strict = strict
+        self.received = 0
+        self.written = 0
+        self._head = bytearray()
+        self._started = False
+        self._decryptor = None
+        self._plain_head = bytearray()
+        self._validated = False
+        self._file = None
+        self._crc = 0
+        self._committed = False
+
+    def feed(self, chunk: bytes) -> bool:
+        """Process one chunk; returns False if the response was rejected as a block page"""
+        if not chunk:
+            return True
+        self.received += len(chunk)
+        if self._started:
+            self._process(chunk)
+            return True
+        self._head.extend(chunk)
+        if len(self._head) < STREAM_HEAD_BYTES:
+            return True
+        return self._start()
+
+    def _start(self) -> bool:
+        head = bytes(self._head)
+        self._head = bytearray()
+        self._started = True
+
+        # Check for block pages BEFORE decryption, same as the buffered path
+        blocked, reason = self.downloader._is_obviously_blocked_response(head, content_type=self.content_type)
+        if blocked:
+            if self.strict:
+                raise ValueError(reason)
+            return False
+        if len(head) < TS_PACKET_SIZE:
+            if self.strict:
+                raise ValueError(f"Segment too small: {len(head)} bytes")
+            return False
+
+        self._decryptor = self.downloader._stream_decryptor(self.segment, head)
+        self._file = open(self.tmp_path, 'wb')
+        self._process(head)
+        return True
+
+    def _process(self, chunk: bytes):
+        self._emit(self._decryptor.update(chunk) if self._decryptor else chunk)
+
+    def _emit(self, plain: bytes):
+        if not self._validated:
+            self._plain_head.extend(plain)
+            if len(self._plain_head) < TS_PACKET_SIZE * 5:
+                return
+            self._flush_plain_head()
+            return
+        self._write(plain)
+
+    def _flush_plain_head(self):
+        plain = bytes(self._plain_head)
+        self._plain_head = bytearray()
+        self.downloader._check_ts_content(self.segment, plain)
+        self._validated = True
+        self._write(plain)
+
+    def _write(self, plain: bytes):
+        if plain:
+            self._file.write(plain)
+            self._crc = zlib.crc32(plain, self._crc)
+            self.written += len(plain)
+
+    def finish(self) -> Optional[int]:
+        """Flush, validate short bodies and move the file into place; None if rejected"""
+        if not self._started and not self._start():
+            return None
+        if self._decryptor:
+            self._emit(self._decryptor.finalize())
+            self.downloader._note_padding(self.segment['index'], self._decryptor.padded)
+        if not self._validated:
+            self._flush_plain_head()
+        self._file.close()
+        self._file = None
+        self.downloader._commit_segment_file(
+            self.segment['index'], self.tmp_path, self.output_path,
+            self.written, f"{self._crc & 0xffffffff:08x}",
+        )
+        self._committed = True
+        return self.written
+
+    def abort(self):
+        """Drop a partially written body (no-op after a successful finish)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._committed:
+            self.tmp_path.unlink(missing_ok=True)
+
 
 class SegmentDownloader:
     """Download video segments with multi-threading and retry logic"""
@@ -47,7 +282,18 @@ class SegmentDownloader:
         encryption_key: Optional[bytes] = None,
         encryption_iv: Optional[bytes] = None,
         m3u8_url: Optional[str] = None,
-        session=None
+        session=None,
+        segment_sink=None,
+        checkpoint=None,
+        concurrency=None,
+        bandwidth=None,
+        stream_bodies: bool = False,
+        key_cache: Optional[KeyCache] = None,
+        referer_cache=None,
+        discovery_probes: int = 1,
+        fetch_budget=None,
+        host_slots=None,
+        circuit_breaker=None
     ):
         self.segments = segments
         self.output_dir = Path(output_dir)
@@ -58,17 +304,56 @@ class SegmentDownloader:
         self.encryption_key = encryption_key
         self.encryption_iv = encryption_iv
         self.m3u8_url = m3u8_url
+        # Optional streaming consumer (e.g. FFmpegStreamMerger): receives
+        # submit(index, bytes) / skip(index) instead of segment files on disk
+        self.segment_sink = segment_sink
+        # Optional SegmentCheckpoint: completed segments are recorded so a retry
+        # of the same job only fetches what is missing
+        self.checkpoint = checkpoint
+        # Optional AdaptiveConcurrencyController: per-host in-flight limits that grow
+        # while the CDN is healthy and back off on throttling (max_workers becomes a floor)
+        self.concurrency = concurrency
+        # Optional BandwidthLimiter: shared Redis token buckets (global/worker/host)
+        self.bandwidth = bandwidth
+        # Optional FetchBudget: in-flight segment requests shared by all concurrent jobs
+        self.fetch_budget = fetch_budget
+        # Optional HostSemaphore: per-host cap on requests in flight across all workers (Redis leases)
+        self.host_slots = host_slots
+        # Optional CircuitBreaker (one per job): holds requests to a host whose recent
+        # attempts mostly failed, and lets the job see a ban right away
+        self.circuit_breaker = circuit_breaker
+        # Stream segment bodies to disk (chunked decrypt) instead of holding them in memory
+        self.stream_bodies = stream_bodies
 
-        # Cache for rotating AES-128 keys (key URI -> bytes)
-        self._key_cache = {}
-        self._key_cache_lock = threading.Lock()
+        # Single-flight cache for rotating AES-128 keys. Pass the worker's shared
+        # (Redis-backed) KeyCache so keys survive across jobs and retries.
+        self.key_cache = key_cache if key_cache is not None else KeyCache()
+        # Optional RefererStrategyCache: working Referer strategy per CDN host, shared via Redis
+        self.referer_cache = referer_cache
+        # Segments probed (first, then middle and last) to find the Referer strategy before fan-out
+        self.discovery_probes = max(1, min(3, int(discovery_probes)))
+        # Stream-level decryption profile learned from the first segments:
+        # {'iv': strategy name, 'padding': 'pkcs7' | 'none' | None}
+        self.decrypt_profile: Dict[str, Optional[str]] = {'iv': None, 'padding': None}
+        self._padding_votes: List[bool] = []
+        self._profile_lock = threading.Lock()
         
         self.downloaded_count = 0
+        self.downloaded_bytes = 0
         self.total_segments = len(segments)
+        # Segments may be a contiguous slice of a larger playlist (a shard of a sharded job);
+        # indexes keep their playlist positions, result slots start at 0
+        self.first_index = min((segment['index'] for segment in segments), default=0)
         self.failed_segments = []
+        # Failed attempts / given-up segments by failure code, kept as they happen
+        self.failure_counts = FailureCounters()
+        self._stats_lock = threading.Lock()
         
         # Stop event for cooperative cancellation
         self._stop_event = threading.Event()
+        # Streaming responses being read, closed by request_stop() to abort stalled reads
+        self._open_responses = set()
+        self._responses_lock = threading.Lock()
         
         # Track which Referer strategy worked (for logging)
         self.working_referer_strategy = None
@@ -82,9 +367,16 @@ class SegmentDownloader:
         self.output_dir.mkdir(parents=True, exist_ok=True)
     
     def request_stop(self):
-        """Request all download threads to stop"""
+        """Request all download threads to stop and abort in-flight streaming reads"""
         logger.info("Stop requested for segment downloader")
         self._stop_event.set()
+        with self._responses_lock:
+            responses = list(self._open_responses)
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
     
     def is_stop_requested(self) -> bool:
         """Check if stop has been requested"""
@@ -183,65 +475,13 @@ class SegmentDownloader:
         
         # AES-128-CBC requires input to be a multiple of 16 bytes
         # If data isn't aligned, it's likely not encrypted or is corrupted
-        if len(data) % 16 != 0:
-            if segment_index == 0:
-                logger.warning(f"Segment 0: Data length ({len(data)}) is not 16-byte aligned - content may not be encrypted")
-            # Pad the data to attempt decryption anyway
-            padding_needed = 16 - (len(data) % 16)
-            padded_data = data + bytes(padding_needed)
-        else:
-            padded_data = data
+        if len(data) % 16 != 0 and segment_index == 0:
+            logger.warning(f"Segment 0: Data length ({len(data)}) is not 16-byte aligned - content may not be encrypted")
         
-        try:
-            # Try multiple IV strategies
-            iv_strategies = []
-            
-            # Strategy 1: Use provided IV if specified (HLS spec compliant)
-            if self.encryption_iv is not None:
-                iv_strategies.append(("provided IV", self.encryption_iv))
-            
-            # Strategy 2: Use segment index as IV (common non-compliant streams)
-            iv_strategies.append(("segment index IV", segment_index.to_bytes(16, byteorder='big')))
-            
-            # Strategy 3: Use zeros IV if not already tried
-            if self.encryption_iv is None or self.encryption_iv != bytes(16):
-                iv_strategies.append(("zeros IV", bytes(16)))
-            
-            decrypted = None
-            for strategy_name, iv in iv_strategies:
-                cipher = AES.new(self.encryption_key, AES.MODE_CBC, iv)
-                decrypted = cipher.decrypt(padded_data)
-                
-                # Remove PKCS7 padding
-                try:
-                    decrypted = unpad(decrypted, AES.block_size)
-                except ValueError:
-                    # Some streams don't use proper padding
-                    pass
-                
-                # Check if decryption produced valid TS data
-                if decrypted[:1] == TS_SYNC_BYTE:
-                    if segment_index < 3:  # Log first few segments
-                        logger.info(f"Segment {segment_index}: Decryption successful with {strategy_name}")
-                    return decrypted
-            
-            # None of the strategies worked
-            logger.warning(f"Segment {segment_index}: All decryption strategies failed (first byte after zeros IV: {hex(decrypted[0]) if decrypted else 'empty'})")
-            
-            # Return the last decrypted result (with zeros IV) - let ffmpeg try to handle it
-            return decrypted
-            
-        except Exception as e:
-            logger.warning(f"Decryption failed for segment {segment_index}: {e}")
-            return data  # Return original data if decryption fails
-
-    def _get_key_bytes(self, key_url: str) -> bytes:
-        """Fetch AES-128 key bytes with caching (thread-safe)."""
-        with self._key_cache_lock:
-            cached = self._key_cache.get(key_url)
-        if cached is not None:
-            return cached
+        candidates = self._iv_candidates(segment_index, self.encryption_iv, None, legacy=True)
+        return self._decrypt_cbc(data, segment_index, self.encryption_key, candidates)
 
+    def _fetch_key(self, key_url: str) -> bytes:
         response = self.session.get(
             key_url,
             headers=self.headers,
@@ -249,13 +489,29 @@ class SegmentDownloader:
             stream=False,
         )
         response.raise_for_status()
-        key = response.content or b""
-        if len(key) != 16:
-            raise ValueError(f"Unexpected AES-128 key length: {len(key)} bytes (expected 16)")
+        return response.content or b""
 
-        with self._key_cache_lock:
-            self._key_cache[key_url] = key
-        return key
+    def _get_key_bytes(self, key_url: str) -> bytes:
+        """Resolve AES-128 key bytes; concurrent callers for one URI share a single fetch."""
+        return self.key_cache.get(key_url, self._fetch_key)
+
+    def prefetch_keys(self):
+        """
+        Resolve every distinct key URI in parallel before segment fan-out, so the
+        first wave of segments doesn't stall on (or stampede) the key server.
+        Failures are only logged; segments retry the key on their own.
+        """
+        uris = [uri for uri in distinct_key_uris(self.segments) if self.key_cache.peek(uri) is None]
+        if not uris:
+            return
+        logger.info(f"Prefetching {len(uris)} AES-128 key(s)")
+        with ThreadPoolExecutor(max_workers=min(8, len(uris))) as executor:
+            futures = {executor.submit(self._get_key_bytes, uri): uri for uri in uris}
+            for future, uri in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to prefetch key {uri}: {e}")
 
     def _decrypt_segment_with_key(
         self,
@@ -283,49 +539,119 @@ class SegmentDownloader:
                 logger.info("Segment 0: Data already appears to be valid TS, skipping decryption")
             return data
 
+        candidates = self._iv_candidates(segment_index, iv_bytes, sequence_number)
+        return self._decrypt_cbc(data, segment_index, key_bytes, candidates)
+
+    def _iv_candidates(
+        self,
+        segment_index: int,
+        iv_bytes: Optional[bytes],
+        sequence_number: Optional[int],
+        legacy: bool = False,
+    ) -> List[Tuple[str, bytes]]:
+        """IV strategies in discovery order: provided, sequence (HLS default), index, zeros"""
+        candidates = []
+        if iv_bytes is not None:
+            candidates.append(("provided IV", iv_bytes))
+        # HLS default IV is the media sequence number (big-endian 128-bit)
+        if sequence_number is not None:
+            candidates.append(("sequence IV", int(sequence_number).to_bytes(16, byteorder="big")))
+        # Fallback: segment index (common non-compliant streams)
+        candidates.append(("segment index IV", int(segment_index).to_bytes(16, byteorder="big")))
+        # Fallback: zeros (the legacy global-key path doesn't retry an explicit all-zero IV)
+        if not legacy or iv_bytes is None or iv_bytes != bytes(16):
+            candidates.append(("zeros IV", bytes(16)))
+        return candidates
+
+    def _select_iv(
+        self,
+        segment_index: int,
+        key_bytes: bytes,
+        candidates: List[Tuple[str, bytes]],
+        data: bytes,
+    ) -> Tuple[str, bytes, bool]:
+        """
+        Pick the IV for a CBC segment from its first cipher block.
+        The IV only affects plaintext block 1 (= ECB(C1) XOR IV), so each candidate
+        costs one XOR instead of a full-segment decrypt. The stream's learned IV
+        strategy is tried first; the others are only checked when it doesn't fit.
+        
+        Returns:
+            (strategy_name, iv, matched); the last candidate with matched=False if
+            none of them yields the TS sync byte
+        """
+        learned = self.decrypt_profile['iv']
+        ordered = sorted(candidates, key=lambda candidate: candidate[0] != learned)
+        first_block = AES.new(key_bytes, AES.MODE_ECB).decrypt(data[:AES.block_size])
+        for strategy_name, iv in ordered:
+            if first_block[0] ^ iv[0] == TS_SYNC_BYTE[0]:
+                if strategy_name != learned:
+                    self._learn_iv_strategy(segment_index, strategy_name)
+                return strategy_name, iv, True
+        name, iv = candidates[-1]
+        return name, iv, False
+
+    def _learn_iv_strategy(self, segment_index: int, strategy_name: str):
+        with self._profile_lock:
+            previous = self.decrypt_profile['iv']
+            self.decrypt_profile['iv'] = strategy_name
+        if previous is None:
+            logger.info(f"Decryption profile: {strategy_name} (learned on segment {segment_index})")
+        else:
+            logger.info(f"Decryption profile: {previous} -> {strategy_name} (segment {segment_index})")
+
+    def _note_padding(self, segment_index: int, padded: Optional[bool]):
+        """Record whether a segment had PKCS#7 padding; settle the profile once consistent"""
+        if padded is None or self.decrypt_profile['padding'] is not None:
+            return
+        with self._profile_lock:
+            self._padding_votes.append(padded)
+            votes = self._padding_votes[-PADDING_CONFIRMATIONS:]
+            if len(votes) < PADDING_CONFIRMATIONS or len(set(votes)) != 1:
+                return
+            self.decrypt_profile['padding'] = 'pkcs7' if padded else 'none'
+        logger.info(f"Decryption profile: padding {self.decrypt_profile['padding']} (settled at segment {segment_index})")
+
+    def _decrypt_cbc(
+        self,
+        data: bytes,
+        segment_index: int,
+        key_bytes: bytes,
+        candidates: List[Tuple[str, bytes]],
+    ) -> bytes:
+        """Decrypt a whole segment in a single pass with the IV chosen by _select_iv"""
         # AES-128-CBC requires input to be a multiple of 16 bytes
         if len(data) % 16 != 0:
             padding_needed = 16 - (len(data) % 16)
             padded_data = data + bytes(padding_needed)
         else:
             padded_data = data
+        if not padded_data:
+            return data
 
         try:
-            iv_strategies = []
-
-            if iv_bytes is not None:
-                iv_strategies.append(("provided IV", iv_bytes))
-
-            # HLS default IV is the media sequence number (big-endian 128-bit)
-            if sequence_number is not None:
-                iv_strategies.append(("sequence IV", int(sequence_number).to_bytes(16, byteorder="big")))
-
-            # Fallback: segment index
-            iv_strategies.append(("segment index IV", int(segment_index).to_bytes(16, byteorder="big")))
-
-            # Fallback: zeros
-            iv_strategies.append(("zeros IV", bytes(16)))
+            strategy_name, iv, matched = self._select_iv(segment_index, key_bytes, candidates, padded_data)
+            decrypted = AES.new(key_bytes, AES.MODE_CBC, iv).decrypt(padded_data)
+            if not matched:
+                # Return the last strategy's result (zeros IV) and let validation decide
+                logger.warning(
+                    f"Segment {segment_index}: All decryption strategies failed "
+                    f"(first byte after {strategy_name}: {hex(decrypted[0])})"
+                )
+                return decrypted
+            if segment_index < 3:
+                logger.info(f"Segment {segment_index}: Decryption successful with {strategy_name}")
 
-            last = None
-            for strategy_name, iv in iv_strategies:
-                cipher = AES.new(key_bytes, AES.MODE_CBC, iv)
-                decrypted = cipher.decrypt(padded_data)
-                last = decrypted
-                try:
-                    decrypted = unpad(decrypted, AES.block_size)
-                except ValueError:
-                    pass
-
-                if decrypted[:1] == TS_SYNC_BYTE:
-                    if segment_index < 3:
-                        logger.info(f"Segment {segment_index}: Decryption successful with {strategy_name}")
-                    return decrypted
-
-            logger.warning(
-                f"Segment {segment_index}: All decryption strategies failed "
-                f"(first byte after zeros IV: {hex(last[0]) if last else 'empty'})"
-            )
-            return last or data
+            # Remove PKCS7 padding (skipped once the stream is known not to use it)
+            if self.decrypt_profile['padding'] == 'none':
+                return decrypted
+            try:
+                decrypted = unpad(decrypted, AES.block_size)
+                self._note_padding(segment_index, True)
+            except ValueError:
+                # Some streams don't use proper padding
+                self._note_padding(segment_index, False)
+            return decrypted
         except Exception as e:
             logger.warning(f"Decryption failed for segment {segment_index}: {e}")
             return data
@@ -377,15 +703,117 @@ class SegmentDownloader:
         
         return strategies
     
-    def _try_download_with_headers(self, url: str, headers: Dict, index: int) -> Optional[bytes]:
-        """Try downloading a segment with specific headers, returns content or None"""
+    def _apply_strategy_headers(self, strategy: Dict) -> Dict:
+        """Return a copy of the base headers with a Referer/Origin strategy applied"""
+        headers = self.headers.copy()
+        if strategy.get('Referer'):
+            headers['Referer'] = strategy['Referer']
+        elif 'Referer' in headers and strategy.get('Referer') is None:
+            del headers['Referer']
+        if strategy.get('Origin'):
+            headers['Origin'] = strategy['Origin']
+        elif 'Origin' in headers and strategy.get('Origin') is None:
+            del headers['Origin']
+        return headers
+
+    def _accept_response_content(self, content: bytes, content_type: str = "") -> Optional[bytes]:
+        """Return content if it looks like a media segment, None if it is a block page"""
+        blocked, _reason = self._is_obviously_blocked_response(content, content_type=content_type)
+        if blocked:
+            return None
+        
+        if len(content) < 188:
+            return None
+        
+        # Check if response is an anti-hotlink image
+        if content[:3] == JPEG_MAGIC or content[:4] == PNG_MAGIC or content[:4] == GIF_MAGIC:
+            return None
+        
+        return content
+
+    @property
+    def segment_hosts(self) -> List[str]:
+        """Distinct hosts serving this playlist's segments"""
+        return sorted({urlparse(segment['url']).netloc for segment in self.segments})
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        """
+        Hold a per-host slot from the shared AdaptiveConcurrencyController (if any),
+        then a lease from the cross-worker HostSemaphore (if any), then a slot from
+        the worker-wide FetchBudget (if any).
+        Yields a dict the caller fills with 'status' and 'ttfb'; errors are recorded here.
+        """
+        outcome = {'status': None, 'ttfb': None}
+        host = urlparse(url).netloc
+        if self.concurrency is None:
+            with self._lease_slot(host), self._budget_slot():
+                yield outcome
+            return
+
+        if not self.concurrency.acquire(host, self._stop_event):
+            raise RuntimeError("Stop requested")
+        error = False
         try:
-            response = self.session.get(
-                url,
-                headers=headers,
-                timeout=self.timeout,
-                stream=False
-            )
+            with self._lease_slot(host), self._budget_slot():
+                yield outcome
+        except Exception:
+            error = outcome['status'] is None
+            raise
+        finally:
+            self.concurrency.release(host, status=outcome['status'], ttfb=outcome['ttfb'], error=error)
+
+    @contextmanager
+    def _lease_slot(self, host: str):
+        """Hold one of host's slots in the cross-worker HostSemaphore while a request is in flight"""
+        if self.host_slots is None:
+            yield
+            return
+        lease = self.host_slots.acquire(host, self._stop_event)
+        if lease is None:
+            raise RuntimeError("Stop requested")
+        try:
+            yield
+        finally:
+            self.host_slots.release(host, lease)
+
+    @contextmanager
+    def _budget_slot(self):
+        """Hold one slot of the worker-wide FetchBudget while a request is in flight"""
+        if self.fetch_budget is None:
+            yield
+            return
+        if not self.fetch_budget.acquire(self._stop_event):
+            raise RuntimeError("Stop requested")
+        try:
+            yield
+        finally:
+            self.fetch_budget.release()
+
+    def _http_get(self, url: str, headers: Dict):
+        """
+        GET a segment URL, holding a per-host slot when adaptive concurrency is enabled
+        and charging the body to the shared bandwidth budget when shaping is enabled.
+        """
+        with self._host_slot(url) as outcome:
+            started = time.monotonic()
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=False)
+            outcome['status'] = response.status_code
+            outcome['ttfb'] = _response_elapsed(response, started)
+
+        # Pay for the body after the slot is released so throttling sleeps don't skew TTFB
+        if self.bandwidth is not None:
+            self.bandwidth.consume(urlparse(url).netloc, len(response.content or b""), self._stop_event)
+        return response
+
+    def _try_download_with_headers(self, url: str, headers: Dict, index: int, probe: bool = False) -> Optional[bytes]:
+        """
+        Try downloading a segment with specific headers, returns content or None.
+        With probe=True only a rejection of the headers (403/474, block page or
+        placeholder) returns None; other errors (timeouts, 5xx, 429, ...) raise.
+        """
+        try:
+            response = self._http_get(url, headers)
             
             # Log response cookies for debugging
             if response.cookies and index == 0:
@@ -396,7 +824,6 @@ class SegmentDownloader:
                 return None
             
             response.raise_for_status()
-            content = response.content
 
             # Early content-type based blocking detection
             content_type = ""
@@ -404,211 +831,499 @@ class SegmentDownloader:
                 content_type = response.headers.get("Content-Type", "")
             except Exception:
                 content_type = ""
-            blocked, _reason = self._is_obviously_blocked_response(content, content_type=content_type)
-            if blocked:
-                return None
-            
-            if len(content) < 188:
-                return None
-            
-            # Check if response is an anti-hotlink image
-            if content[:3] == JPEG_MAGIC or content[:4] == PNG_MAGIC or content[:4] == GIF_MAGIC:
-                return None
-            
-            return content
+            return self._accept_response_content(response.content, content_type=content_type)
             
         except Exception as e:
+            if probe and not _rejects_headers(e):
+                raise
             logger.debug(f"Download attempt failed: {e}")
             return None
-    
-    def download_segment(
-        self, 
-        segment: Dict, 
-        retry_count: int = 0
-    ) -> Optional[str]:
+
+    def _is_encrypted_segment(self, segment: Dict) -> bool:
+        """Whether a segment needs AES-128 decryption (per-segment key or legacy global key)"""
+        segment_key = segment.get("key") if isinstance(segment, dict) else None
+        if segment_key and isinstance(segment_key, dict) and segment_key.get("method") == "AES-128":
+            return True
+        return bool(self.encryption_key)
+
+    def _finalize_segment(self, segment: Dict, content: bytes, output_path: Path) -> int:
         """
-        Download a single segment with multiple Referer strategies
+        Check, decrypt, validate and write a fetched segment body.
+        Shared by the thread and async engines.
         
-        Args:
-            segment: Segment info dict with 'url', 'index'
-            retry_count: Current retry attempt
+        Returns:
+            Number of bytes written
+        
+        Raises:
+            ValueError: if the body is a block page or fails TS validation
+        """
+        index = segment['index']
+
+        # Always check for obvious block/HTML responses BEFORE decryption.
+        # If we decrypt first, block pages become random bytes and may slip through.
+        blocked, reason = self._is_obviously_blocked_response(content)
+        if blocked:
+            raise ValueError(reason)
+        
+        # Decrypt (supports per-segment rotating keys via segment['key'])
+        segment_key = segment.get("key") if isinstance(segment, dict) else None
+        if segment_key and isinstance(segment_key, dict) and segment_key.get("method") == "AES-128":
+            key_url = segment_key.get("uri")
+            if not key_url:
+                raise ValueError("Encrypted segment missing key URI")
+            key_bytes = self._get_key_bytes(key_url)
+            content = self._decrypt_segment_with_key(
+                content,
+                index,
+                key_bytes=key_bytes,
+                iv_bytes=segment_key.get("iv"),
+                sequence_number=segment.get("sequence"),
+            )
+        elif self.encryption_key:
+            content = self._decrypt_segment(content, index)
+        
+        # Validate content is actually a TS file (not an error page)
+        self._check_ts_content(segment, content)
         
+        # Hand validated content to the streaming sink, or write it to file. With a
+        # checkpoint the file is written (and recorded) even when streaming, so a
+        # restarted job can feed the sink from disk instead of downloading again.
+        if self.segment_sink is not None and self.checkpoint is None:
+            self.segment_sink.submit(index, content)
+            with self._stats_lock:
+                self.downloaded_bytes += len(content)
+        else:
+            # Write-then-rename so a crash never leaves a truncated file under the final name
+            tmp_path = output_path.with_name(output_path.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            self._commit_segment_file(index, tmp_path, output_path, len(content), segment_checksum(content))
+        return len(content)
+
+    def _check_ts_content(self, segment: Dict, content: bytes):
+        """
+        Raise SegmentContentError if (decrypted) content is not MPEG-TS.
+        SKIP_TS_VALIDATION=true lets invalid content through with a warning.
+        """
+        is_valid, error_reason = self._is_valid_ts_content(content)
+        if is_valid:
+            return
+        index = segment['index']
+        skip_validation = os.environ.get('SKIP_TS_VALIDATION', 'false').lower() == 'true'
+        
+        # For encrypted streams, do NOT blindly save invalid decrypted bytes.
+        # This usually indicates the key/iv is wrong or the server served a block page.
+        if self._is_encrypted_segment(segment) and not skip_validation:
+            preview = content[:200]
+            logger.error(f"Segment {index}: {error_reason}")
+            logger.error(f"Content preview (first 200 bytes): {preview}")
+            raise SegmentContentError(error_reason)
+        elif skip_validation:
+            logger.warning(f"Segment {index}: {error_reason} - validation skipped")
+        else:
+            preview = content[:200]
+            logger.error(f"Segment {index}: {error_reason}")
+            logger.error(f"Content preview (first 200 bytes): {preview}")
+            raise SegmentContentError(error_reason)
+
+    def _commit_segment_file(self, index: int, tmp_path: Path, output_path: Path, size: int, checksum: str):
+        """Move a fully written .tmp file into place and record it (checkpoint, streaming sink)"""
+        os.replace(tmp_path, output_path)
+        if self.checkpoint is not None:
+            self.checkpoint.record(index, str(output_path), size, checksum)
+        if self.segment_sink is not None:
+            self.segment_sink.submit(index, str(output_path))
+        with self._stats_lock:
+            self.downloaded_bytes += size
+
+    def _segment_key_material(self, segment: Dict):
+        """
+        Key bytes and candidate IVs (in the order the buffered decrypt path tries them).
+
         Returns:
-            Path to downloaded file or None if failed
+            (key_bytes, [(strategy_name, iv), ...]) or None for unencrypted segments
         """
-        # Check if stop was requested before starting
-        if self._stop_event.is_set():
-            logger.debug(f"Segment {segment['index']} skipped - stop requested")
-            return None
+        index = segment['index']
+        segment_key = segment.get("key") if isinstance(segment, dict) else None
+        if segment_key and isinstance(segment_key, dict) and segment_key.get("method") == "AES-128":
+            key_url = segment_key.get("uri")
+            if not key_url:
+                raise ValueError("Encrypted segment missing key URI")
+            key_bytes = self._get_key_bytes(key_url)
+            return key_bytes, self._iv_candidates(index, segment_key.get("iv"), segment.get("sequence"))
+        if self.encryption_key:
+            return self.encryption_key, self._iv_candidates(index, self.encryption_iv, None, legacy=True)
+        return None
+
+    def _stream_decryptor(self, segment: Dict, head: bytes) -> Optional[_CbcStreamDecryptor]:
+        """
+        Pick the IV for a streamed segment from its first cipher block (see _select_iv).
         
-        url = segment['url']
+        Returns:
+            A decryptor, or None if the segment is unencrypted (or already plain TS)
+        """
+        material = self._segment_key_material(segment)
+        if material is None:
+            return None
+        key_bytes, candidates = material
         index = segment['index']
-        output_path = self.output_dir / f"segment_{index:05d}.ts"
+
+        is_ts, _ = self._is_valid_ts_content(head)
+        if is_ts:
+            if index == 0:
+                logger.info("Segment 0: Data already appears to be valid TS, skipping decryption")
+            return None
+        if len(head) < AES.block_size:
+            raise SegmentContentError(f"Encrypted segment too small: {len(head)} bytes")
+
+        strategy_name, iv, matched = self._select_iv(index, key_bytes, candidates, head)
+        if not matched:
+            raise SegmentContentError("All decryption strategies failed (no TS sync byte after decryption)")
+        if index < 3:
+            logger.info(f"Segment {index}: Decryption successful with {strategy_name}")
+        return _CbcStreamDecryptor(key_bytes, iv, strip_padding=self.decrypt_profile['padding'] != 'none')
+
+    def _stream_segment(self, url: str, headers: Dict, segment: Dict, output_path: Path, strict: bool = False) -> Optional[int]:
+        """
+        Fetch a segment with stream=True and write it through _StreamingSegmentWriter.
         
-        try:
-            logger.debug(f"Downloading segment {index}: {url}")
-            
-            # Log headers for first segment
-            if index == 0 and retry_count == 0:
-                logger.info(f"Segment download headers: {self.headers}")
-                logger.info(f"First segment URL: {url}")
-            
-            content = None
-            used_strategy = None
-            
-            # If we already found a working strategy, use it directly
-            if self.working_referer_strategy and retry_count == 0:
-                strategy = self.working_referer_strategy
-                headers = self.headers.copy()
-                if strategy.get('Referer'):
-                    headers['Referer'] = strategy['Referer']
-                elif 'Referer' in headers and strategy.get('Referer') is None:
-                    del headers['Referer']
-                if strategy.get('Origin'):
-                    headers['Origin'] = strategy['Origin']
-                elif 'Origin' in headers and strategy.get('Origin') is None:
-                    del headers['Origin']
-                
-                content = self._try_download_with_headers(url, headers, index)
-                if content:
-                    used_strategy = strategy['name']
-            
-            # If no working strategy yet, or it failed, try all strategies
-            if content is None:
-                strategies = self._get_referer_strategies(url)
-                
-                for strategy in strategies:
-                    # Check if stop was requested between strategy attempts
-                    if self._stop_event.is_set():
-                        logger.debug(f"Segment {index} aborted during strategy attempts - stop requested")
-                        return None
-                    
-                    headers = self.headers.copy()
-                    
-                    # Apply strategy headers
-                    if strategy.get('Referer'):
-                        headers['Referer'] = strategy['Referer']
-                    elif 'Referer' in headers and strategy.get('Referer') is None:
-                        del headers['Referer']
-                    
-                    if strategy.get('Origin'):
-                        headers['Origin'] = strategy['Origin']
-                    elif 'Origin' in headers and strategy.get('Origin') is None:
-                        del headers['Origin']
-                    
-                    if index == 0 and retry_count == 0:
-                        logger.info(f"Trying Referer strategy: {strategy['name']}")
-                    
-                    content = self._try_download_with_headers(url, headers, index)
-                    
-                    if content:
-                        used_strategy = strategy['name']
-                        # Remember this strategy for future segments
-                        if self.working_referer_strategy is None:
-                            logger.info(f"Found working Referer strategy: {strategy['name']}")
-                            self.working_referer_strategy = strategy
-                        break
-            
-            # If all strategies failed, use original headers and let the error handling below deal with it
-            if content is None:
-                response = self.session.get(
-                    url,
-                    headers=self.headers,
-                    timeout=self.timeout,
-                    stream=False
-                )
-                
+        Returns:
+            Bytes written, or None if the response was rejected (non-strict mode only)
+        
+        Raises:
+            SegmentContentError: decryption/validation failed (always)
+            Exception: HTTP or block-page errors (strict mode)
+        """
+        index = segment['index']
+        host = urlparse(url).netloc
+        with self._host_slot(url) as outcome:
+            started = time.monotonic()
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+            writer = None
+            with self._responses_lock:
+                self._open_responses.add(response)
+            try:
+                outcome['status'] = response.status_code
+                outcome['ttfb'] = _response_elapsed(response, started)
                 if response.status_code == 474:
+                    if not strict:
+                        logger.debug(f"Segment {index} got 474 error with current headers")
+                        return None
                     logger.error(f"Segment {index} got 474 error")
                     logger.error(f"Response headers: {dict(response.headers)}")
-                    error_content = response.text[:500] if hasattr(response, 'text') else "No content"
-                    logger.error(f"Error content: {error_content}")
-                
                 response.raise_for_status()
-                content = response.content
 
                 content_type = ""
                 try:
                     content_type = response.headers.get("Content-Type", "")
                 except Exception:
                     content_type = ""
-                blocked, reason = self._is_obviously_blocked_response(content, content_type=content_type)
-                if blocked:
-                    raise ValueError(reason)
-                
-                if len(content) < 188:
-                    raise ValueError(f"Segment too small: {len(content)} bytes")
+                writer = _StreamingSegmentWriter(self, segment, output_path, content_type=content_type, strict=strict)
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if self._stop_event.is_set():
+                        raise RuntimeError("Stop requested")
+                    if not writer.feed(chunk):
+                        return None
+                    if self.bandwidth is not None:
+                        self.bandwidth.consume(host, len(chunk), self._stop_event)
+                return writer.finish()
+            finally:
+                with self._responses_lock:
+                    self._open_responses.discard(response)
+                if writer is not None:
+                    writer.abort()
+                response.close()
 
-            # Always check for obvious block/HTML responses BEFORE decryption.
-            # If we decrypt first, block pages become random bytes and may slip through.
-            blocked, reason = self._is_obviously_blocked_response(content)
-            if blocked:
-                raise ValueError(reason)
-            
-            # Decrypt (supports per-segment rotating keys via segment['key'])
-            segment_key = segment.get("key") if isinstance(segment, dict) else None
-            if segment_key and isinstance(segment_key, dict) and segment_key.get("method") == "AES-128":
-                key_url = segment_key.get("uri")
-                if not key_url:
-                    raise ValueError("Encrypted segment missing key URI")
-                key_bytes = self._get_key_bytes(key_url)
-                content = self._decrypt_segment_with_key(
-                    content,
-                    index,
-                    key_bytes=key_bytes,
-                    iv_bytes=segment_key.get("iv"),
-                    sequence_number=segment.get("sequence"),
-                )
-            elif self.encryption_key:
-                content = self._decrypt_segment(content, index)
-            
-            # Validate content is actually a TS file (not an error page)
-            is_valid, error_reason = self._is_valid_ts_content(content)
-            if not is_valid:
-                skip_validation = os.environ.get('SKIP_TS_VALIDATION', 'false').lower() == 'true'
-                
-                # For encrypted streams, do NOT blindly save invalid decrypted bytes.
-                # This usually indicates the key/iv is wrong or the server served a block page.
-                if (self.encryption_key or (segment_key and isinstance(segment_key, dict) and segment_key.get("method") == "AES-128")) and not skip_validation:
-                    preview = content[:200]
-                    logger.error(f"Segment {index}: {error_reason}")
-                    logger.error(f"Content preview (first 200 bytes): {preview}")
-                    raise ValueError(error_reason)
-                elif skip_validation:
-                    logger.warning(f"Segment {index}: {error_reason} - validation skipped")
-                else:
-                    preview = content[:200]
-                    logger.error(f"Segment {index}: {error_reason}")
-                    logger.error(f"Content preview (first 200 bytes): {preview}")
-                    raise ValueError(error_reason)
-            
-            # Write validated content to file
-            with open(output_path, 'wb') as f:
-                f.write(content)
+    def _try_stream_with_headers(
+        self, url: str, headers: Dict, segment: Dict, output_path: Path, probe: bool = False
+    ) -> Optional[int]:
+        """Streaming counterpart of _try_download_with_headers; content errors still raise"""
+        try:
+            return self._stream_segment(url, headers, segment, output_path)
+        except SegmentContentError:
+            raise
+        except Exception as e:
+            if probe and not _rejects_headers(e):
+                raise
+            logger.debug(f"Download attempt failed: {e}")
+            return None
+    
+    def _run_referer_strategies(self, url: str, index: int, retry_count: int, attempt: Callable[[Dict], object]):
+        """
+        Call attempt(headers) with the remembered Referer strategy, then with every strategy,
+        until one returns a result.
+        
+        Returns:
+            (result, strategy_name), or (None, None) if all failed or stop was requested
+        """
+        # If we already found a working strategy, use it directly
+        remembered = self.working_referer_strategy
+        if remembered and retry_count == 0:
+            result = attempt(self._apply_strategy_headers(remembered))
+            if result:
+                return result, remembered['name']
+        
+        # If no working strategy yet, or it failed, try all strategies
+        for strategy in self._get_referer_strategies(url):
+            # Check if stop was requested between strategy attempts
+            if self._stop_event.is_set():
+                logger.debug(f"Segment {index} aborted during strategy attempts - stop requested")
+                return None, None
             
-            if index == 0 and used_strategy:
-                logger.info(f"Segment {index} downloaded successfully with strategy: {used_strategy}")
-            else:
-                logger.debug(f"Segment {index} downloaded and validated successfully ({len(content)} bytes)")
+            if index == 0 and retry_count == 0:
+                logger.info(f"Trying Referer strategy: {strategy['name']}")
             
-            return str(output_path)
+            result = attempt(self._apply_strategy_headers(strategy))
+            if result:
+                # Remember this strategy for future segments (replacing one that stopped working)
+                if remembered is None or remembered['name'] != strategy['name']:
+                    self._remember_referer_strategy(strategy, url)
+                return result, strategy['name']
+        return None, None
+
+    def _remember_referer_strategy(self, strategy: Dict, url: str):
+        previous = self.working_referer_strategy
+        self.working_referer_strategy = strategy
+        if previous is None:
+            logger.info(f"Found working Referer strategy: {strategy['name']}")
+        elif previous['name'] != strategy['name']:
+            logger.info(f"Referer strategy changed: {previous['name']} -> {strategy['name']}")
+        if self.referer_cache is not None:
+            self.referer_cache.set(urlparse(url).netloc, strategy['name'])
+
+    def _cached_referer_strategy(self, url: str) -> Optional[Dict]:
+        """The strategy the shared cache remembers for this URL's host, if any"""
+        if self.referer_cache is None:
+            return None
+        name = self.referer_cache.get(urlparse(url).netloc)
+        if not name:
+            return None
+        for strategy in self._get_referer_strategies(url):
+            if strategy['name'] == name:
+                return strategy
+        return None
+
+    def _discovery_probes(self, segments: List[Dict]) -> List[Dict]:
+        """First segment, plus the middle and last ones when more probes are configured"""
+        if not segments:
+            return []
+        picks = [0]
+        if self.discovery_probes >= 2:
+            picks.append(len(segments) - 1)
+        if self.discovery_probes >= 3:
+            picks.insert(1, len(segments) // 2)
+        probes = []
+        for i in picks:
+            if segments[i] not in probes:
+                probes.append(segments[i])
+        return probes
+
+    def _probe_segment(self, segment: Dict, strategy: Dict) -> Optional[str]:
+        """
+        Download a segment with exactly one Referer strategy (no fallbacks).
+        
+        Returns:
+            Path on success, None if the server rejected these headers
         
+        Raises:
+            Exception: a transient error (timeout, 5xx, 429, ...) that says nothing about
+                the headers, or the body arrived but failed decryption/validation
+        """
+        url = segment['url']
+        index = segment['index']
+        output_path = self.output_dir / f"segment_{index:05d}.ts"
+        headers = self._apply_strategy_headers(strategy)
+        if self.stream_bodies:
+            size = self._try_stream_with_headers(url, headers, segment, output_path, probe=True)
+        else:
+            content = self._try_download_with_headers(url, headers, index, probe=True)
+            size = None if content is None else self._finalize_segment(segment, content, output_path)
+        return None if size is None else str(output_path)
+
+    def discover_referer_strategy(self, remaining: List[Dict], downloaded_files: List[Optional[str]]) -> List[Dict]:
+        """
+        Find the working Referer strategy before fan-out, instead of every thread walking
+        all strategies at once (a request storm that trips hotlink protection).
+        
+        A strategy cached for the CDN host is used without probing. Otherwise each
+        strategy is tried in turn on the probe segments. Probes are real downloads and
+        count as completed segments.
+        
+        Returns:
+            Segments still to download
+        """
+        if not remaining or self.working_referer_strategy is not None:
+            return remaining
+
+        first_url = remaining[0]['url']
+        cached = self._cached_referer_strategy(first_url)
+        if cached is not None:
+            logger.info(f"Using cached Referer strategy for {urlparse(first_url).netloc}: {cached['name']}")
+            self.working_referer_strategy = cached
+            return remaining
+
+        probes = self._discovery_probes(remaining)
+        done = set()
+        try:
+            for strategy in self._get_referer_strategies(first_url):
+                if self._stop_event.is_set():
+                    break
+                logger.info(f"Probing Referer strategy: {strategy['name']}")
+                working = True
+                for segment in probes:
+                    if segment['index'] in done:
+                        continue
+                    file_path = self._probe_segment(segment, strategy)
+                    if file_path is None:
+                        working = False
+                        break
+                    downloaded_files[segment['index'] - self.first_index] = file_path
+                    self.downloaded_count += 1
+                    done.add(segment['index'])
+                if working:
+                    self._remember_referer_strategy(strategy, first_url)
+                    break
+            else:
+                logger.warning("Referer discovery found no working strategy; segments will try each one")
         except Exception as e:
-            logger.warning(f"Failed to download segment {index} (attempt {retry_count + 1}): {e}")
-            
-            # Check if stop was requested before retrying
+            # Not a header problem (timeout, 5xx, wrong key, ...): nothing is learned or
+            # cached, and the normal retry path takes over
+            logger.warning(f"Referer discovery aborted: {e}")
+        return [segment for segment in remaining if segment['index'] not in done]
+
+    def _fetch_buffered(self, segment: Dict, retry_count: int):
+        """Fetch a whole segment body into memory; returns (content, strategy_name)"""
+        url = segment['url']
+        index = segment['index']
+        content, used_strategy = self._run_referer_strategies(
+            url, index, retry_count,
+            lambda headers: self._try_download_with_headers(url, headers, index),
+        )
+        if content is not None or self._stop_event.is_set():
+            return content, used_strategy
+        
+        # If all strategies failed, use original headers and let the error handling deal with it
+        response = self._http_get(url, self.headers)
+        
+        if response.status_code == 474:
+            logger.error(f"Segment {index} got 474 error")
+            logger.error(f"Response headers: {dict(response.headers)}")
+            error_content = response.text[:500] if hasattr(response, 'text') else "No content"
+            logger.error(f"Error content: {error_content}")
+        
+        response.raise_for_status()
+        content = response.content
+
+        content_type = ""
+        try:
+            content_type = response.headers.get("Content-Type", "")
+        except Exception:
+            content_type = ""
+        blocked, reason = self._is_obviously_blocked_response(content, content_type=content_type)
+        if blocked:
+            raise ValueError(reason)
+        
+        if len(content) < 188:
+            raise ValueError(f"Segment too small: {len(content)} bytes")
+        return content, None
+
+    def _fetch_streaming(self, segment: Dict, output_path: Path, retry_count: int):
+        """Stream a segment body straight to output_path; returns (bytes_written, strategy_name)"""
+        url = segment['url']
+        index = segment['index']
+        size, used_strategy = self._run_referer_strategies(
+            url, index, retry_count,
+            lambda headers: self._try_stream_with_headers(url, headers, segment, output_path),
+        )
+        if size is not None or self._stop_event.is_set():
+            return size, used_strategy
+        
+        # If all strategies failed, use original headers and raise whatever goes wrong
+        return self._stream_segment(url, self.headers, segment, output_path, strict=True), None
+
+    def _attempt_segment(self, segment: Dict, attempt: int = 0) -> Optional[str]:
+        """
+        One download attempt (all Referer strategies, then the original headers)
+        
+        Returns:
+            Path to the downloaded file, or None if stop was requested. With a
+            buffered segment_sink and no checkpoint the path is nominal: the
+            content went to the sink.
+        
+        Raises:
+            Exception: the attempt failed; the caller decides whether to retry
+        """
+        url = segment['url']
+        index = segment['index']
+        output_path = self.output_dir / f"segment_{index:05d}.ts"
+        
+        logger.debug(f"Downloading segment {index}: {url}")
+        
+        # Log headers for first segment
+        if index == 0 and attempt == 0:
+            logger.info(f"Segment download headers: {self.headers}")
+            logger.info(f"First segment URL: {url}")
+        
+        if self.stream_bodies:
+            size, used_strategy = self._fetch_streaming(segment, output_path, attempt)
+        else:
+            content, used_strategy = self._fetch_buffered(segment, attempt)
+            size = None if content is None else self._finalize_segment(segment, content, output_path)
+        if size is None:
+            return None  # stop requested
+        
+        if index == 0 and used_strategy:
+            logger.info(f"Segment {index} downloaded successfully with strategy: {used_strategy}")
+        else:
+            logger.debug(f"Segment {index} downloaded and validated successfully ({size} bytes)")
+        
+        return str(output_path)
+
+    def download_segment(
+        self, 
+        segment: Dict, 
+        retry_count: int = 0
+    ) -> Optional[str]:
+        """
+        Download a single segment, retrying in place with backoff.
+        download_all doesn't use this: it schedules retries without holding a pool thread.
+        
+        Args:
+            segment: Segment info dict with 'url', 'index'
+            retry_count: Attempt to start from
+        
+        Returns:
+            Path to downloaded file or None if failed
+        """
+        index = segment['index']
+        attempt = retry_count
+        while True:
+            # Check if stop was requested before starting
             if self._stop_event.is_set():
-                logger.debug(f"Segment {index} retry cancelled - stop requested")
+                logger.debug(f"Segment {index} skipped - stop requested")
                 return None
-            
-            # Retry logic
-            if retry_count < self.max_retries:
-                time.sleep(2 ** retry_count)  # Exponential backoff
-                return self.download_segment(segment, retry_count + 1)
+            wait_for = self._circuit_wait(segment)
+            if wait_for > 0:
+                self._stop_event.wait(wait_for)
+                continue
+            try:
+                file_path = self._attempt_segment(segment, attempt)
+            except Exception as e:
+                logger.warning(f"Failed to download segment {index} (attempt {attempt + 1}): {e}")
+                if self._stop_event.is_set():
+                    logger.debug(f"Segment {index} retry cancelled - stop requested")
+                    return None
+                code = self._record_failure(segment, e)
+                if attempt >= self.max_retries:
+                    logger.error(f"Segment {index} failed after {self.max_retries} attempts")
+                    self._give_up(segment, e, code)
+                    return None
+                self._stop_event.wait(retry_delay(attempt, e))
+                attempt += 1
             else:
-                logger.error(f"Segment {index} failed after {self.max_retries} attempts")
-                self.failed_segments.append({'segment': segment, 'error': str(e)})
-                return None
+                if file_path:
+                    self._record_success(segment)
+                return file_path
     
     def download_all(
         self, 
@@ -623,78 +1338,251 @@ class SegmentDownloader:
         Returns:
             List of downloaded file paths
         """
-        logger.info(f"Starting download of {self.total_segments} segments with {self.max_workers} workers")
+        pool_size = self.max_workers
+        if self.concurrency is not None:
+            # Threads are cheap to park; the per-host limiter decides how many are in flight
+            pool_size = max(pool_size, self.concurrency.max_limit)
+        logger.info(f"Starting download of {self.total_segments} segments with {pool_size} workers")
+        started_at = time.monotonic()
         
         downloaded_files = [None] * self.total_segments
+        remaining = self._resume_from_checkpoint(downloaded_files)
+        self.prefetch_keys()
+        remaining = self.discover_referer_strategy(remaining, downloaded_files)
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all download tasks
-            future_to_segment = {
-                executor.submit(self.download_segment, segment): segment
-                for segment in self.segments
-            }
+        window = pool_size * SUBMISSION_WINDOW_FACTOR
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            stragglers = self._run_scheduled(
+                executor, remaining, downloaded_files, progress_callback, self.max_retries, window
+            )
             
-            # Process completed downloads
-            try:
-                for future in as_completed(future_to_segment):
-                    # Check if stop was requested before processing more results
-                    if self._stop_event.is_set():
-                        logger.info("Stop event detected in download_all, aborting...")
-                        for f in future_to_segment:
-                            f.cancel()
+            # Final repair pass: one more attempt for segments that exhausted their retries,
+            # now that the rest of the playlist is done and the CDN has had time to recover
+            if stragglers and not self._stop_event.is_set():
+                logger.info(f"Repair pass: re-fetching {len(stragglers)} failed segments")
+                straggler_indices = {segment['index'] for segment in stragglers}
+                self._forget_failed(straggler_indices)
+                stragglers = self._run_scheduled(executor, stragglers, downloaded_files, progress_callback, 0, window)
+            
+            for segment in stragglers:
+                self._skip_in_sink(segment['index'])
+        
+        # Filter out None values (failed downloads)
+        successful_files = [f for f in downloaded_files if f is not None]
+        
+        logger.info(f"Download complete: {len(successful_files)}/{self.total_segments} segments successful")
+        self._log_throughput(started_at)
+        
+        if self.failed_segments:
+            logger.warning(f"Failed segments: {len(self.failed_segments)}")
+        
+        return successful_files
+    
+    def _run_scheduled(
+        self,
+        executor: ThreadPoolExecutor,
+        segments: List[Dict],
+        downloaded_files: List[Optional[str]],
+        progress_callback: Optional[Callable[[int, int], None]],
+        max_retries: int,
+        window: int,
+    ) -> List[Dict]:
+        """
+        Fetch segments on the pool, keeping at most ``window`` futures alive and pulling
+        the rest of the playlist lazily, so memory and cancellation cost stay flat no
+        matter how long the playlist is.
+        
+        A failed attempt goes into a delay heap instead of sleeping in its pool thread,
+        and takes priority over new segments once its backoff expires.
+        
+        Returns:
+            Segments that exhausted max_retries (already recorded in failed_segments)
+        """
+        pending = iter(segments)
+        exhausted = False
+        futures = {}
+        delayed = []  # heap of (due, index, segment, attempt)
+        stragglers = []
+        
+        try:
+            while True:
+                # Check if stop was requested before processing more results
+                if self._stop_event.is_set():
+                    logger.info("Stop event detected in download_all, aborting...")
+                    break
+                
+                # Top up the window: due retries first, then the next segments in playlist order
+                now = time.monotonic()
+                while len(futures) < window:
+                    if delayed and delayed[0][0] <= now:
+                        _, _, segment, attempt = heapq.heappop(delayed)
+                    elif not exhausted:
+                        segment = next(pending, None)
+                        if segment is None:
+                            exhausted = True
+                            continue
+                        attempt = 0
+                    else:
                         break
-                    
-                    segment = future_to_segment[future]
+                    wait_for = self._circuit_wait(segment)
+                    if wait_for > 0:
+                        # Host's circuit is open: hold this one and stop topping up until it may close
+                        heapq.heappush(delayed, (now + wait_for, segment['index'], segment, attempt))
+                        break
+                    futures[executor.submit(self._attempt_segment, segment, attempt)] = (segment, attempt)
+                
+                if not futures:
+                    if not delayed:
+                        break
+                    self._stop_event.wait(delayed[0][0] - now)
+                    continue
+                
+                timeout = max(0.0, delayed[0][0] - now) if delayed else None
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    segment, attempt = futures.pop(future)
                     index = segment['index']
-                    
                     try:
                         file_path = future.result()
-                        if file_path:
-                            downloaded_files[index] = file_path
-                            self.downloaded_count += 1
-                    
                     except Exception as e:
-                        logger.error(f"Unexpected error downloading segment {index}: {e}")
-                        self.failed_segments.append({'segment': segment, 'error': str(e)})
+                        if self._stop_event.is_set():
+                            continue
+                        logger.warning(f"Failed to download segment {index} (attempt {attempt + 1}): {e}")
+                        code = self._record_failure(segment, e)
+                        if attempt < max_retries:
+                            delay = retry_delay(attempt, e)
+                            logger.debug(f"Segment {index} retry in {delay:.1f}s")
+                            heapq.heappush(delayed, (time.monotonic() + delay, index, segment, attempt + 1))
+                            if not self._circuit_open(segment):
+                                continue
+                            # Let the job look at the open circuit now rather than after every retry
+                        else:
+                            logger.error(f"Segment {index} failed after {attempt + 1} attempts")
+                            self._give_up(segment, e, code)
+                            stragglers.append(segment)
+                    else:
+                        if not file_path:
+                            continue  # stop requested
+                        self._record_success(segment)
+                        downloaded_files[index - self.first_index] = file_path
+                        self.downloaded_count += 1
                     
                     # Call progress callback (outside try-except so callback exceptions propagate)
                     if progress_callback:
                         progress_callback(self.downloaded_count, self.total_segments)
-            
-            except Exception as e:
-                # Callback raised an exception (e.g., job cancelled or too many errors)
-                # Signal all threads to stop and cancel pending futures
-                logger.warning("Download aborted, signaling stop and cancelling remaining tasks...")
-                self._stop_event.set()
-                for future in future_to_segment:
-                    future.cancel()
-                # Re-raise the exception
-                raise
         
-        # Filter out None values (failed downloads)
-        successful_files = [f for f in downloaded_files if f is not None]
+        except Exception:
+            # Callback raised an exception (e.g., job cancelled or too many errors)
+            # Signal all threads to stop; the (bounded) pending futures are cancelled below
+            logger.warning("Download aborted, signaling stop and cancelling remaining tasks...")
+            self._stop_event.set()
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
         
-        logger.info(f"Download complete: {len(successful_files)}/{self.total_segments} segments successful")
+        return stragglers
+    
+    def _resume_from_checkpoint(self, downloaded_files: List[Optional[str]]) -> List[Dict]:
+        """
+        Fill in segments already completed in the checkpoint.
         
-        if self.failed_segments:
-            logger.warning(f"Failed segments: {len(self.failed_segments)}")
+        Returns:
+            Segments that still need to be downloaded
+        """
+        if self.checkpoint is None:
+            return list(self.segments)
         
-        return successful_files
+        remaining = []
+        for segment in self.segments:
+            index = segment['index']
+            path = self.checkpoint.completed_path(index)
+            if path:
+                downloaded_files[index - self.first_index] = path
+                self.downloaded_count += 1
+                if self.segment_sink is not None:
+                    self.segment_sink.submit(index, path)
+            else:
+                remaining.append(segment)
+        
+        if self.downloaded_count:
+            logger.info(f"Resuming from checkpoint: {self.downloaded_count}/{self.total_segments} segments already downloaded")
+        return remaining
+    
+    def _skip_in_sink(self, index: int):
+        """Let a streaming sink move past a segment that will never arrive"""
+        if self.segment_sink is not None and not self._stop_event.is_set():
+            self.segment_sink.skip(index)
     
+    def _log_throughput(self, started_at: float):
+        """Log segment and byte throughput so download engines can be compared"""
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        mb = self.downloaded_bytes / (1024 * 1024)
+        logger.info(
+            f"Throughput ({type(self).__name__}): {self.downloaded_count / elapsed:.1f} segments/s, "
+            f"{mb / elapsed:.2f} MB/s ({mb:.1f} MB in {elapsed:.1f}s)"
+        )
+    
+    def _record_failure(self, segment: Dict, error: BaseException) -> str:
+        """Count a failed attempt against its host (and circuit); returns its failure code"""
+        code = classify_failure(error)
+        host = urlparse(segment['url']).netloc
+        self.failure_counts.record_attempt(host, code)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(host, code)
+        return code
+
+    def _record_success(self, segment: Dict):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(urlparse(segment['url']).netloc)
+
+    def _give_up(self, segment: Dict, error: BaseException, code: str):
+        """Record a segment that exhausted its retries"""
+        self.failed_segments.append({'segment': segment, 'error': str(error), 'code': code})
+        self.failure_counts.record_segment(code)
+
+    def _forget_failed(self, indices):
+        """Drop given-up segments that are about to be retried (repair pass)"""
+        kept = []
+        for item in self.failed_segments:
+            if item['segment']['index'] in indices:
+                self.failure_counts.forget_segment(item['code'])
+            else:
+                kept.append(item)
+        self.failed_segments = kept
+
+    def _circuit_wait(self, segment: Dict) -> float:
+        """Seconds to hold a request for segment while its host's circuit is open (0 = go)"""
+        if self.circuit_breaker is None:
+            return 0.0
+        return self.circuit_breaker.retry_after(urlparse(segment['url']).netloc)
+
+    def _circuit_open(self, segment: Dict) -> bool:
+        return self.circuit_breaker is not None and self.circuit_breaker.is_open(urlparse(segment['url']).netloc)
+
+    def circuit_tripped(self) -> Optional[Tuple[str, str]]:
+        """(host, failure code) if a host's circuit opened on a failure that waiting won't fix"""
+        if self.circuit_breaker is None:
+            return None
+        return self.circuit_breaker.tripped()
+
     def get_progress(self) -> Dict:
         """Get download progress information"""
-        return {
+        progress = {
             'downloaded': self.downloaded_count,
             'total': self.total_segments,
             'percentage': int((self.downloaded_count / self.total_segments) * 100),
             'failed': len(self.failed_segments)
         }
+        if self.concurrency is not None:
+            progress['host_concurrency'] = self.concurrency.snapshot(self.segment_hosts)
+        return progress
     
     def cleanup(self):
         """Remove downloaded segment files"""
         try:
             logger.info("Cleaning up segment files")
-            for file in self.output_dir.glob("segment_*.ts"):
+            for file in self.output_dir.glob("segment_*.ts*"):
                 file.unlink()
             
             # Try to remove directory if empty
@@ -0,0 +1,235 @@
+"""
+Segment Failures
+Structured failure codes, O(1) per-host counters and a circuit breaker per CDN host
+"""
+
+import collections
+import logging
+import threading
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Failure codes, recorded once per failed attempt
+BLOCKED = "blocked"            # HTTP 403/474: URL expired or the CDN refuses us
+HOTLINK = "hotlink"            # Image placeholder instead of video (anti-hotlinking)
+RATE_LIMITED = "rate_limited"  # HTTP 429
+SERVER_ERROR = "server_error"  # HTTP 5xx
+HTTP_ERROR = "http_error"      # Any other HTTP error (404, 410, ...)
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+BAD_CONTENT = "bad_content"    # Delivered, but failed decryption / TS validation
+OTHER = "other"
+
+# Failures that say the host is unhealthy or refusing us (count against its breaker)
+HOST_FAILURES = frozenset({BLOCKED, HOTLINK, RATE_LIMITED, SERVER_ERROR, TIMEOUT, CONNECTION})
+# A breaker opened mostly by these won't recover by waiting: the job should fail now
+FATAL_FAILURES = frozenset({BLOCKED, HOTLINK})
+
+
+def _status_of(error) -> Optional[int]:
+    # requests/curl_cffi errors carry .response, aiohttp's ClientResponseError carries .status
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(error, 'status', None)
+    return status if isinstance(status, int) else None
+
+
+def classify_failure(error: BaseException) -> str:
+    """Failure code for an exception raised by a segment attempt"""
+    status = _status_of(error)
+    if status is not None:
+        if status in (403, 474):
+            return BLOCKED
+        if status == 429:
+            return RATE_LIMITED
+        if status >= 500:
+            return SERVER_ERROR
+        return HTTP_ERROR
+    # The TS validator names image placeholders this way
+    if 'anti-hotlinking' in str(error):
+        return HOTLINK
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if any('Timeout' in name for name in names):
+        return TIMEOUT
+    if any('Connection' in name for name in names) or isinstance(error, OSError):
+        return CONNECTION
+    if isinstance(error, ValueError):
+        return BAD_CONTENT
+    return OTHER
+
+
+class FailureCounters:
+    """Failed attempts and exhausted segments by code, overall and per host (thread-safe)"""
+
+    def __init__(self):
+        self.attempts = collections.Counter()
+        self.segments = collections.Counter()
+        self.by_host: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def record_attempt(self, host: str, code: str):
+        with self._lock:
+            self.attempts[code] += 1
+            self.by_host[host][code] += 1
+
+    def record_segment(self, code: str):
+        """A segment gave up with this code (after all its retries)"""
+        with self._lock:
+            self.segments[code] += 1
+
+    def forget_segment(self, code: str):
+        """A segment counted by record_segment was recovered (repair pass)"""
+        with self._lock:
+            if self.segments[code] > 0:
+                self.segments[code] -= 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'attempts': dict(self.attempts),
+                'segments': dict(self.segments),
+                'by_host': {host: dict(codes) for host, codes in self.by_host.items()},
+            }
+
+
+class _Breaker:
+    __slots__ = ("outcomes", "failures", "codes", "opened_at", "open_for", "probing", "trip_code")
+
+    def __init__(self, window: int):
+        self.outcomes: Deque[Optional[str]] = collections.deque(maxlen=window)
+        self.failures = 0
+        self.codes = collections.Counter()
+        self.opened_at: Optional[float] = None
+        self.open_for = 0.0
+        self.probing = False
+        self.trip_code: Optional[str] = None
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker per host over the last ``window`` attempts.
+
+    - Closed: requests flow. Once at least ``min_requests`` attempts are in the
+      window and the share of host failures (HOST_FAILURES) reaches
+      ``threshold``, the breaker opens.
+    - Open: ``retry_after(host)`` reports how long to hold the host's requests.
+    - After ``open_seconds``, it goes half-open and lets a single probe through.
+      A successful probe closes it. A failed probe reopens it for twice as long,
+      up to ``max_open_seconds``.
+
+    ``tripped()`` reports an open breaker whose dominant failure is fatal
+    (FATAL_FAILURES), so the job can stop instead of retrying into a ban.
+    Every call is O(1).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        window: int = 20,
+        min_requests: int = 8,
+        open_seconds: float = 15.0,
+        max_open_seconds: float = 120.0,
+    ):
+        self.threshold = threshold
+        self.window = max(1, int(window))
+        self.min_requests = max(1, min(int(min_requests), self.window))
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self._hosts: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    def _breaker(self, host: str) -> _Breaker:
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            breaker = _Breaker(self.window)
+            self._hosts[host] = breaker
+        return breaker
+
+    def retry_after(self, host: str) -> float:
+        """
+        0 if a request to host may go out now (taking the probe slot when half-open),
+        else seconds to hold it
+        """
+        with self._lock:
+            breaker = self._hosts.get(host)
+            if breaker is None or breaker.opened_at is None:
+                return 0.0
+            remaining = breaker.opened_at + breaker.open_for - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if breaker.probing:
+                return 0.5
+            breaker.probing = True
+            return 0.0
+
+    def record(self, host: str, code: Optional[str] = None):
+        """Outcome of one attempt: None for success, else its failure code"""
+        failed = code in HOST_FAILURES
+        with self._lock:
+            breaker = self._breaker(host)
+            if breaker.probing:
+                breaker.probing = False
+                if failed:
+                    breaker.open_for = min(self.max_open_seconds, breaker.open_for * 2)
+                    breaker.opened_at = time.monotonic()
+                    logger.warning(f"Circuit for {host} stays open for {breaker.open_for:.0f}s (probe failed: {code})")
+                else:
+                    self._close(host, breaker)
+                return
+
+            if len(breaker.outcomes) == breaker.outcomes.maxlen:
+                oldest = breaker.outcomes[0]
+                if oldest is not None:
+                    breaker.failures -= 1
+                    breaker.codes[oldest] -= 1
+            breaker.outcomes.append(code if failed else None)
+            if failed:
+                breaker.failures += 1
+                breaker.codes[code] += 1
+
+            if (
+                breaker.opened_at is None
+                and len(breaker.outcomes) >= self.min_requests
+                and breaker.failures >= self.threshold * len(breaker.outcomes)
+            ):
+                breaker.opened_at = time.monotonic()
+                breaker.open_for = self.open_seconds
+                breaker.trip_code = breaker.codes.most_common(1)[0][0]
+                logger.warning(
+                    f"Circuit for {host} opened: {breaker.failures}/{len(breaker.outcomes)} recent requests "
+                    f"failed (mostly {breaker.trip_code}), holding requests for {breaker.open_for:.0f}s"
+                )
+
+    def _close(self, host: str, breaker: _Breaker):
+        breaker.outcomes.clear()
+        breaker.failures = 0
+        breaker.codes.clear()
+        breaker.opened_at = None
+        breaker.trip_code = None
+        logger.info(f"Circuit for {host} closed")
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            breaker = self._hosts.get(host)
+            return breaker is not None and breaker.opened_at is not None
+
+    def tripped(self) -> Optional[Tuple[str, str]]:
+        """(host, code) of an open breaker tripped by a fatal failure, if any"""
+        with self._lock:
+            for host, breaker in self._hosts.items():
+                if breaker.opened_at is not None and breaker.trip_code in FATAL_FAILURES:
+                    return host, breaker.trip_code
+        return None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                host: {
+                    'state': 'closed' if b.opened_at is None else ('half-open' if b.probing else 'open'),
+                    'failures': b.failures,
+                    'window': len(b.outcomes),
+                }
+                for host, b in self._hosts.items()
+            }
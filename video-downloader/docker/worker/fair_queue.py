@@ -0,0 +1,412 @@
+"""
+Fair Job Queue
+Priority classes with round-robin across source hosts, so one bulk submission from
+a slow CDN doesn't hold every other job behind it for hours
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Highest first; a class is only served while every higher one is empty
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+KEY_PREFIX = "fair_queue:"
+# fair_queue:<priority>:<host>  list of job ids (FIFO per host)
+# fair_queue:hosts:<priority>   zset of hosts with queued jobs, scored by their last turn
+TURN_KEY = KEY_PREFIX + "turn"
+# One token per enqueue; idle workers BLPOP it instead of polling the queue
+WAKEUP_KEY = KEY_PREFIX + "wakeup"
+WAKEUP_BACKLOG = 64
+# fair_queue:processing:<worker>  hash of the jobs a worker has taken: job id -> "<priority> <host>"
+PROCESSING_PREFIX = KEY_PREFIX + "processing:"
+# zset of worker ids scored by their last heartbeat (unix time)
+HEARTBEATS_KEY = KEY_PREFIX + "heartbeats"
+# zset of failed jobs waiting out their backoff: "<job id> <priority> <host>" -> due (unix time)
+RETRY_KEY = KEY_PREFIX + "retry"
+PROMOTE_BATCH = 100
+# fair_queue:owner:<job id>  worker running the job (claimed in process_job, refreshed by its heartbeat)
+OWNER_PREFIX = KEY_PREFIX + "owner:"
+OWNER_TTL_SECONDS = 24 * 3600
+# Plain list jobs were queued on before priorities; workers move its entries into the fair queue
+LEGACY_QUEUE = "download_queue"
+ADOPT_BATCH = 100
+
+# Keep in sync with api/main.py (the API enqueues new jobs with the same script);
+# tests/test_fair_queue.py fails when the two copies differ
+ENQUEUE_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local turn = tonumber(redis.call('GET', KEYS[3]) or '0')
+redis.call('ZADD', KEYS[2], 'NX', turn, ARGV[2])
+redis.call('RPUSH', KEYS[4], '1')
+redis.call('LTRIM', KEYS[4], -tonumber(ARGV[3]), -1)
+return 1
+"""
+
+# Take the head job of the least recently served host in the highest non-empty class;
+# that host then moves to the back of its class. The job is recorded as in flight for
+# the calling worker in the same step, so a crash can't lose it.
+DEQUEUE_SCRIPT = """
+for i = 2, #ARGV do
+    local hosts_key = ARGV[1] .. 'hosts:' .. ARGV[i]
+    while true do
+        local first = redis.call('ZRANGE', hosts_key, 0, 0)
+        if #first == 0 then
+            break
+        end
+        local host = first[1]
+        local list_key = ARGV[1] .. ARGV[i] .. ':' .. host
+        local job_id = redis.call('LPOP', list_key)
+        if redis.call('LLEN', list_key) == 0 then
+            redis.call('ZREM', hosts_key, host)
+        else
+            redis.call('ZADD', hosts_key, redis.call('INCR', KEYS[1]), host)
+        end
+        if job_id then
+            redis.call('HSET', KEYS[2], job_id, ARGV[i] .. ' ' .. host)
+            return {job_id, ARGV[i], host}
+        end
+    end
+end
+return nil
+"""
+
+# Put every in-flight job of a (dead) worker back at the head of its host's list
+REQUEUE_SCRIPT = """
+local entries = redis.call('HGETALL', KEYS[1])
+local requeued = {}
+for i = 1, #entries, 2 do
+    local job_id = entries[i]
+    local priority, host = string.match(entries[i + 1], '^(%S+) (.+)$')
+    redis.call('LPUSH', ARGV[1] .. priority .. ':' .. host, job_id)
+    local turn = tonumber(redis.call('GET', KEYS[3]) or '0')
+    redis.call('ZADD', ARGV[1] .. 'hosts:' .. priority, 'NX', turn, host)
+    redis.call('RPUSH', KEYS[4], '1')
+    table.insert(requeued, job_id)
+end
+redis.call('LTRIM', KEYS[4], -tonumber(ARGV[3]), -1)
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[2])
+return requeued
+"""
+
+# Move retries that are due onto the back of their host's list; safe to run from every worker
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, entry in ipairs(due) do
+    local job_id, priority, host = string.match(entry, '^(%S+) (%S+) (.+)$')
+    redis.call('ZREM', KEYS[1], entry)
+    redis.call('RPUSH', ARGV[1] .. priority .. ':' .. host, job_id)
+    local turn = tonumber(redis.call('GET', KEYS[2]) or '0')
+    redis.call('ZADD', ARGV[1] .. 'hosts:' .. priority, 'NX', turn, host)
+    redis.call('RPUSH', KEYS[3], '1')
+end
+redis.call('LTRIM', KEYS[3], -tonumber(ARGV[4]), -1)
+return #due
+"""
+
+
+# Move one job from the legacy list onto the back of its host's list. A no-op if another
+# worker adopted it first, and the job is never in neither place.
+ADOPT_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+local turn = tonumber(redis.call('GET', KEYS[4]) or '0')
+redis.call('ZADD', KEYS[3], 'NX', turn, ARGV[2])
+redis.call('RPUSH', KEYS[5], '1')
+redis.call('LTRIM', KEYS[5], -tonumber(ARGV[3]), -1)
+return 1
+"""
+
+# Become the owner of a job before running it, unless another worker that is still
+# heartbeating owns it (it was requeued while that worker was only slow). In that
+# case the job moves back into the owner's in-flight record and the owner is returned.
+# KEYS: owner key, heartbeats, this worker's processing hash
+# ARGV: worker id, heartbeats older than this are dead, owner TTL, job id, processing prefix
+CLAIM_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    local beat = redis.call('ZSCORE', KEYS[2], owner)
+    if beat and tonumber(beat) >= tonumber(ARGV[2]) then
+        local entry = redis.call('HGET', KEYS[3], ARGV[4])
+        if entry then
+            redis.call('HDEL', KEYS[3], ARGV[4])
+            redis.call('HSET', ARGV[5] .. owner, ARGV[4], entry)
+        end
+        return owner
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[3]))
+return false
+"""
+
+# Move a job that could not start from the in-flight record to the retry zset
+DEFER_SCRIPT = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if not entry then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[2]), ARGV[1] .. ' ' .. entry)
+return 1
+"""
+
+# Drop a job from the in-flight record and give up its ownership (if still ours)
+DONE_SCRIPT = """
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('GET', KEYS[2]) == ARGV[2] then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+def retry_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff before retry number ``attempt`` (1-based): exponential, capped, then
+    jittered down by up to half so jobs that failed together don't return together"""
+    delay = min(cap, base * (2 ** max(0, attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def job_host(url: str) -> str:
+    """Fairness key of a job: the host its playlist / file is fetched from"""
+    try:
+        return (urlparse(url).hostname or "unknown").lower()
+    except ValueError:
+        return "unknown"
+
+
+def normalize_priority(priority: Optional[str]) -> str:
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+
+class FairQueue:
+    """
+    Worker side of the job queue (the API only enqueues).
+
+    Popped jobs stay in this worker's processing hash until ``done``. Workers
+    heartbeat; the in-flight jobs of one that stops (OOM kill, crash, lost host)
+    are put back by ``requeue_worker``, and a restarted worker requeues its own
+    leftovers on start. Checkpointed segments make the next attempt a resume.
+    Failed jobs wait out their backoff in a retry zset (``schedule_retry``) until
+    ``promote_due`` moves them back into the queue.
+
+    A worker that is only slow can be requeued too. Before running a job, the
+    worker ``claim``s it: the claim fails while a worker that heartbeats again
+    owns the job. If the job was claimed elsewhere while this worker was silent,
+    ``lost_jobs`` reports it, so this worker can abort its copy.
+    """
+
+    def __init__(self, redis_client, worker_id: str = "worker"):
+        self.redis = redis_client
+        self.worker_id = worker_id
+        self.processing_key = PROCESSING_PREFIX + worker_id
+        self._enqueue = redis_client.register_script(ENQUEUE_SCRIPT)
+        self._dequeue = redis_client.register_script(DEQUEUE_SCRIPT)
+        self._requeue = redis_client.register_script(REQUEUE_SCRIPT)
+        self._promote = redis_client.register_script(PROMOTE_SCRIPT)
+        self._adopt = redis_client.register_script(ADOPT_SCRIPT)
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+        self._done = redis_client.register_script(DONE_SCRIPT)
+        self._defer = redis_client.register_script(DEFER_SCRIPT)
+        # Jobs this process claimed and still runs, and those claimed away from it since
+        self._claimed = set()
+        self._lost = set()
+        self._claims_lock = threading.Lock()
+
+    def push(self, job_id: str, url: str, priority: Optional[str] = None):
+        """Queue a job (retries and hand-backs go to the back of their host's list)"""
+        priority = normalize_priority(priority)
+        host = job_host(url)
+        self._enqueue(
+            keys=[f"{KEY_PREFIX}{priority}:{host}", f"{KEY_PREFIX}hosts:{priority}", TURN_KEY, WAKEUP_KEY],
+            args=[job_id, host, WAKEUP_BACKLOG],
+        )
+
+    def pop(self) -> Optional[str]:
+        """Next job id, or None if nothing is queued"""
+        result = self._dequeue(keys=[TURN_KEY, self.processing_key], args=[KEY_PREFIX, *PRIORITIES])
+        if not result:
+            return None
+        job_id, priority, host = result
+        logger.debug(f"Dequeued job {job_id} ({priority}, {host})")
+        return job_id
+
+    def schedule_retry(self, job_id: str, url: str, priority: Optional[str], delay: float):
+        """Queue a failed job again once ``delay`` seconds have passed"""
+        entry = f"{job_id} {normalize_priority(priority)} {job_host(url)}"
+        self.redis.zadd(RETRY_KEY, {entry: time.time() + delay})
+
+    def defer(self, job_id: str, delay: float) -> bool:
+        """
+        Put an in-flight job back in the queue after ``delay`` seconds (it couldn't be
+        started here, e.g. its row couldn't be read); returns False if it wasn't in flight
+        """
+        return bool(self._defer(keys=[self.processing_key, RETRY_KEY], args=[job_id, time.time() + delay]))
+
+    def promote_due(self) -> int:
+        """Move every retry whose backoff has elapsed into the queue; returns how many"""
+        return int(self._promote(
+            keys=[RETRY_KEY, TURN_KEY, WAKEUP_KEY],
+            args=[KEY_PREFIX, time.time(), PROMOTE_BATCH, WAKEUP_BACKLOG],
+        ) or 0)
+
+    def adopt_legacy(self, lookup: Callable[[str], Optional[Tuple[str, Optional[str]]]]) -> int:
+        """
+        Move jobs queued on the legacy download_queue into the fair queue.
+
+        Args:
+            lookup: job id -> (url, priority), or None if the job no longer exists
+
+        Returns:
+            How many jobs this call moved
+        """
+        adopted = 0
+        for job_id in self.redis.lrange(LEGACY_QUEUE, 0, ADOPT_BATCH - 1):
+            details = lookup(job_id)
+            if details is None:
+                self.redis.lrem(LEGACY_QUEUE, 1, job_id)
+                continue
+            url, priority = details
+            priority = normalize_priority(priority)
+            host = job_host(url)
+            adopted += int(self._adopt(
+                keys=[LEGACY_QUEUE, f"{KEY_PREFIX}{priority}:{host}", f"{KEY_PREFIX}hosts:{priority}", TURN_KEY, WAKEUP_KEY],
+                args=[job_id, host, WAKEUP_BACKLOG],
+            ) or 0)
+        return adopted
+
+    def claim(self, job_id: str, timeout: float) -> Optional[str]:
+        """
+        Take ownership of a job about to run here.
+
+        Returns:
+            None if this worker now owns it, else the id of the live worker
+            (heartbeat newer than timeout) that already runs it
+        """
+        owner = self._claim(
+            keys=[OWNER_PREFIX + job_id, HEARTBEATS_KEY, self.processing_key],
+            args=[self.worker_id, time.time() - timeout, OWNER_TTL_SECONDS, job_id, PROCESSING_PREFIX],
+        )
+        if owner:
+            return owner
+        with self._claims_lock:
+            self._claimed.add(job_id)
+            self._lost.discard(job_id)
+        return None
+
+    def lost_jobs(self) -> List[str]:
+        """
+        Claimed jobs another worker has claimed since (this one was presumed dead).
+        Ownership of the others is extended.
+        """
+        with self._claims_lock:
+            job_ids = sorted(self._claimed)
+        if not job_ids:
+            return []
+        owners = self.redis.mget([OWNER_PREFIX + job_id for job_id in job_ids])
+        lost = [job_id for job_id, owner in zip(job_ids, owners) if owner != self.worker_id]
+        pipe = self.redis.pipeline()
+        for job_id, owner in zip(job_ids, owners):
+            if owner == self.worker_id:
+                pipe.expire(OWNER_PREFIX + job_id, OWNER_TTL_SECONDS)
+        pipe.execute()
+        with self._claims_lock:
+            for job_id in lost:
+                if job_id in self._claimed:
+                    self._claimed.discard(job_id)
+                    self._lost.add(job_id)
+        return lost
+
+    def taken_over(self, job_id: str) -> bool:
+        """Whether lost_jobs reported this job (its run here should leave it alone)"""
+        with self._claims_lock:
+            return job_id in self._lost
+
+    def done(self, job_id: str):
+        """The job finished, failed or was handed back; it's no longer in flight here"""
+        self._done(keys=[self.processing_key, OWNER_PREFIX + job_id], args=[job_id, self.worker_id])
+        with self._claims_lock:
+            self._claimed.discard(job_id)
+            self._lost.discard(job_id)
+
+    def heartbeat(self):
+        self.redis.zadd(HEARTBEATS_KEY, {self.worker_id: time.time()})
+
+    def dead_workers(self, timeout: float) -> List[str]:
+        """Workers (other than this one) whose last heartbeat is older than timeout"""
+        stale = self.redis.zrangebyscore(HEARTBEATS_KEY, "-inf", time.time() - timeout)
+        return [worker_id for worker_id in stale if worker_id != self.worker_id]
+
+    def requeue_worker(self, worker_id: str) -> List[str]:
+        """Put a worker's in-flight jobs back in the queue and forget it; returns their ids"""
+        return list(self._requeue(
+            keys=[PROCESSING_PREFIX + worker_id, HEARTBEATS_KEY, TURN_KEY, WAKEUP_KEY],
+            args=[KEY_PREFIX, worker_id, WAKEUP_BACKLOG],
+        ) or [])
+
+
+class QueueHeartbeat(threading.Thread):
+    """
+    Daemon thread: heartbeats for this worker, reports jobs other workers took
+    over from it, requeues the jobs of workers that stopped, promotes retries
+    whose backoff has elapsed and adopts jobs left on the legacy list
+    """
+
+    def __init__(
+        self,
+        queue: FairQueue,
+        interval: float,
+        timeout: float,
+        on_requeued: Optional[Callable[[List[str]], None]] = None,
+        on_lost: Optional[Callable[[List[str]], None]] = None,
+        legacy_lookup: Optional[Callable[[str], Optional[Tuple[str, Optional[str]]]]] = None,
+    ):
+        super().__init__(name="queue-heartbeat", daemon=True)
+        self.queue = queue
+        self.interval = interval
+        self.timeout = timeout
+        self.on_requeued = on_requeued
+        self.on_lost = on_lost
+        self.legacy_lookup = legacy_lookup
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def beat(self):
+        """One heartbeat, ownership check, reaper pass, retry promotion and legacy adoption"""
+        self.queue.heartbeat()
+        lost = self.queue.lost_jobs()
+        if lost:
+            logger.warning(f"Jobs taken over by another worker while this one was silent: {', '.join(lost)}")
+            if self.on_lost is not None:
+                self.on_lost(lost)
+        self.queue.promote_due()
+        if self.legacy_lookup is not None:
+            adopted = self.queue.adopt_legacy(self.legacy_lookup)
+            if adopted:
+                logger.info(f"Moved {adopted} job(s) from {LEGACY_QUEUE} into the fair queue")
+        for worker_id in self.queue.dead_workers(self.timeout):
+            job_ids = self.queue.requeue_worker(worker_id)
+            if job_ids:
+                logger.warning(f"Worker {worker_id} stopped heartbeating; requeued its jobs: {', '.join(job_ids)}")
+                if self.on_requeued is not None:
+                    self.on_requeued(job_ids)
+
+    def run(self):
+        while True:
+            try:
+                self.beat()
+            except Exception as e:
+                logger.warning(f"Queue heartbeat failed: {e}")
+            if self._stopped.wait(self.interval):
+                return
@@ -6,8 +6,12 @@ Merge video segments into final MP4 file
 import logging
 import subprocess
 import os
+import threading
+import time
+import uuid
+from collections import deque
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
 import shutil
 
 logger = logging.getLogger(__name__)
@@ -21,12 +25,18 @@ class FFmpegMerger:
         segment_files: List[str],
         output_file: str,
         threads: int = 4,
-        concat_dir: Optional[str] = None
+        concat_dir: Optional[str] = None,
+        stop_event: Optional[threading.Event] = None
     ):
         self.segment_files = segment_files
         self.output_file = output_file
         self.threads = threads
         self.concat_dir = concat_dir or str(Path(output_file).parent)
+        # Unique per merger: concurrent jobs may share concat_dir (e.g. the output folder)
+        self.concat_file = Path(self.concat_dir) / f"concat_list_{uuid.uuid4().hex[:12]}.txt"
+        # Set (e.g. on job cancellation) to kill a running FFmpeg and drop its output
+        self.stop_event = stop_event
+        self.stopped = False
         self.ffmpeg_path: Optional[str] = None
         
         # Verify FFmpeg is available
@@ -48,6 +58,35 @@ class FFmpegMerger:
                 escaped_path = abs_path.replace("'", "'\\''")
                 f.write(f"file '{escaped_path}'\n")
     
+    def _run_ffmpeg(self, command: List[str], timeout: int) -> subprocess.CompletedProcess:
+        """
+        Run FFmpeg like subprocess.run, but kill it as soon as stop_event is set
+
+        Raises:
+            subprocess.TimeoutExpired: FFmpeg ran longer than timeout (process is killed)
+        """
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=0.5)
+                return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                stop = self.stop_event is not None and self.stop_event.is_set()
+                if not stop and time.monotonic() < deadline:
+                    continue
+                process.kill()
+                stdout, stderr = process.communicate()
+                if not stop:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                logger.info("FFmpeg killed: stop requested")
+                self.stopped = True
+                try:
+                    Path(self.output_file).unlink(missing_ok=True)
+                except OSError:
+                    pass
+                return subprocess.CompletedProcess(command, process.returncode, stdout, "stopped")
+
     def merge(self) -> bool:
         """
         Merge segments into final video file
@@ -62,7 +101,7 @@ class FFmpegMerger:
         logger.info(f"Merging {len(self.segment_files)} segments into {self.output_file}")
         
         # Create temporary concat file in designated directory
-        concat_file = Path(self.concat_dir) / "concat_list.txt"
+        concat_file = self.concat_file
         
         try:
             # Create concat file
@@ -84,13 +123,7 @@ class FFmpegMerger:
             logger.debug(f"FFmpeg command: {' '.join(command)}")
             
             # Run FFmpeg
-            process = subprocess.run(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=600  # 10 minutes timeout
-            )
+            process = self._run_ffmpeg(command, timeout=600)  # 10 minutes timeout
             
             if process.returncode == 0:
                 logger.info(f"Merge successful: {self.output_file}")
@@ -128,7 +161,7 @@ class FFmpegMerger:
         logger.info("Attempting merge with re-encoding (slower)")
         
         # Use same concat file location as merge()
-        concat_file = Path(self.concat_dir) / "concat_list.txt"
+        concat_file = self.concat_file
         
         try:
             self._create_concat_file(str(concat_file))
@@ -151,13 +184,7 @@ class FFmpegMerger:
             
             logger.debug(f"FFmpeg re-encode command: {' '.join(command)}")
             
-            process = subprocess.run(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=1800  # 30 minutes for re-encoding
-            )
+            process = self._run_ffmpeg(command, timeout=1800)  # 30 minutes for re-encoding
             
             if process.returncode == 0:
                 logger.info("Re-encode successful")
@@ -171,12 +198,258 @@ class FFmpegMerger:
             return False
 
 
+class FFmpegStreamMerger:
+    """
+    Merge segments by piping them into FFmpeg's stdin (MPEG-TS input) as they arrive.
+
+    Segments may be submitted out of order from any download thread. They are
+    written to FFmpeg strictly by index, by the merger's own writer thread, so a
+    download thread never waits on the pipe. Early arrivals wait in a reorder
+    buffer of at most ``max_buffered`` in-memory segments. Anything beyond that
+    is spilled to ``spill_dir`` so a slow segment can never block the downloaders.
+    """
+
+    _STDERR_TAIL_LINES = 50
+
+    def __init__(
+        self,
+        output_file: str,
+        total_segments: int,
+        threads: int = 4,
+        max_buffered: int = 64,
+        spill_dir: Optional[str] = None
+    ):
+        self.output_file = output_file
+        self.total_segments = total_segments
+        self.threads = threads
+        self.max_buffered = max(1, max_buffered)
+        self.spill_dir = Path(spill_dir or Path(output_file).parent)
+        # Write to a temporary name so a half-merged file never shows up as completed
+        self.partial_file = f"{output_file}.part"
+        self.ffmpeg_path: Optional[str] = shutil.which('ffmpeg')
+        if self.ffmpeg_path is None:
+            raise RuntimeError("FFmpeg not found in system PATH")
+
+        self.process: Optional[subprocess.Popen] = None
+        self.error: Optional[str] = None
+        self.written_segments = 0
+        self.skipped_segments = 0
+
+        self._lock = threading.Lock()
+        # Signalled when a segment is buffered or no more will come
+        self._ready = threading.Condition(self._lock)
+        self._buffer = {}  # index -> bytes | Path (spilled) | None (skipped)
+        self._in_memory = 0
+        self._next_index = 0
+        self._closed = False
+        self._aborted = False
+        self._writer_thread: Optional[threading.Thread] = None
+        self._stderr_tail = deque(maxlen=self._STDERR_TAIL_LINES)
+        self._stderr_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the FFmpeg process reading MPEG-TS from stdin"""
+        command = [
+            self.ffmpeg_path,
+            '-f', 'mpegts',            # Raw TS segments are concatenated on stdin
+            '-i', 'pipe:0',
+            '-c', 'copy',
+            '-bsf:a', 'aac_adtstoasc',
+            '-threads', str(self.threads),
+            '-f', 'mp4',               # Output name ends in .part, so set the muxer explicitly
+            '-y',
+            self.partial_file
+        ]
+        logger.debug(f"FFmpeg stream command: {' '.join(command)}")
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        # Drain stderr continuously; a full stderr pipe would stall FFmpeg (and us).
+        self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._writer_thread = threading.Thread(target=self._write_loop, name="ffmpeg-stream-writer", daemon=True)
+        self._writer_thread.start()
+        logger.info(f"Streaming merge started: {self.output_file}")
+
+    def _read_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    def submit(self, index: int, data: Optional[Union[bytes, str, Path]]):
+        """
+        Hand over a finished segment (bytes or a file path), or None to skip it.
+        Thread-safe; returns once the segment is buffered (or spilled).
+        """
+        if self.error:
+            return
+
+        spill_path = None
+        with self._lock:
+            if index < self._next_index or index in self._buffer:
+                return
+            if (
+                isinstance(data, bytes)
+                and index != self._next_index
+                and self._in_memory >= self.max_buffered
+            ):
+                spill_path = self.spill_dir / f"spill_{index:05d}.ts"
+            else:
+                self._buffer[index] = data
+                if isinstance(data, bytes):
+                    self._in_memory += 1
+                self._ready.notify()
+
+        if spill_path is not None:
+            with open(spill_path, 'wb') as f:
+                f.write(data)
+            with self._lock:
+                self._buffer[index] = spill_path
+                self._ready.notify()
+
+    def skip(self, index: int):
+        """Mark a segment as permanently failed so the stream can move past it"""
+        self.submit(index, None)
+
+    def _write_loop(self):
+        # Writer thread: feed the pipe in index order until closed and nothing in order is left
+        while True:
+            with self._ready:
+                while self._next_index not in self._buffer and not self._closed:
+                    self._ready.wait()
+                if self._next_index not in self._buffer:
+                    return
+                item = self._buffer.pop(self._next_index)
+                if isinstance(item, bytes):
+                    self._in_memory -= 1
+                self._next_index += 1
+
+            try:
+                self._write_item(item)
+            except Exception as e:
+                if not self._aborted:
+                    self.error = f"FFmpeg stream write failed: {e}"
+                    logger.error(self.error)
+                return
+
+    def _write_item(self, item: Optional[Union[bytes, str, Path]]):
+        if item is None:
+            self.skipped_segments += 1
+            return
+        if self.error:
+            return
+        if isinstance(item, bytes):
+            self.process.stdin.write(item)
+        else:
+            with open(item, 'rb') as f:
+                shutil.copyfileobj(f, self.process.stdin, length=1024 * 1024)
+            if Path(item).parent == self.spill_dir and Path(item).name.startswith("spill_"):
+                Path(item).unlink(missing_ok=True)
+        self.written_segments += 1
+
+    @property
+    def pending_segments(self) -> int:
+        """Segments not yet written or skipped"""
+        return self.total_segments - self._next_index
+
+    def finish(self, timeout: int = 600) -> bool:
+        """
+        Close stdin, wait for FFmpeg and move the output into place
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if self.process is None:
+            return False
+        # Let the writer flush every segment that is in order, then stop it
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+        if self._writer_thread is not None:
+            self._writer_thread.join(timeout=timeout)
+            if self._writer_thread.is_alive():
+                logger.error("FFmpeg stream writer timed out")
+                self.abort()
+                return False
+        if self.pending_segments > 0 and not self.error:
+            self.error = f"{self.pending_segments} segments never reached the stream"
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+
+        try:
+            returncode = self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("FFmpeg stream process timed out")
+            self.abort()
+            return False
+        if self._stderr_thread:
+            self._stderr_thread.join(timeout=5)
+
+        if self.error:
+            logger.error(self.error)
+            self._remove_partial()
+            return False
+        if returncode != 0:
+            logger.error(f"FFmpeg failed with return code {returncode}")
+            logger.error("FFmpeg stderr: " + "\n".join(self._stderr_tail))
+            self._remove_partial()
+            return False
+
+        partial = Path(self.partial_file)
+        if not partial.exists() or partial.stat().st_size == 0:
+            logger.error("Output file is empty or doesn't exist")
+            self._remove_partial()
+            return False
+
+        os.replace(self.partial_file, self.output_file)
+        file_size_mb = Path(self.output_file).stat().st_size / (1024 * 1024)
+        logger.info(
+            f"Streaming merge successful: {self.output_file} ({file_size_mb:.2f} MB, "
+            f"{self.written_segments} segments, {self.skipped_segments} skipped)"
+        )
+        return True
+
+    def abort(self):
+        """Kill FFmpeg and discard partial output and spilled segments"""
+        with self._ready:
+            self._closed = True
+            self._aborted = True
+            self._ready.notify_all()
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.kill()
+                self.process.wait(timeout=10)
+            except Exception as e:
+                logger.warning(f"Failed to kill FFmpeg stream process: {e}")
+        # Killing FFmpeg breaks the pipe under a blocked write
+        if self._writer_thread is not None and self._writer_thread is not threading.current_thread():
+            self._writer_thread.join(timeout=10)
+        self._remove_partial()
+        with self._lock:
+            for item in self._buffer.values():
+                if isinstance(item, Path):
+                    item.unlink(missing_ok=True)
+            self._buffer.clear()
+            self._in_memory = 0
+
+    def _remove_partial(self):
+        try:
+            Path(self.partial_file).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Failed to remove partial output: {e}")
+
+
 def merge_segments(
     segment_files: List[str],
     output_file: str,
     threads: int = 4,
     try_re_encode: bool = True,
-    concat_dir: Optional[str] = None
+    concat_dir: Optional[str] = None,
+    stop_event: Optional[threading.Event] = None
 ) -> bool:
     """
     Convenience function to merge segments
@@ -187,19 +460,20 @@ def merge_segments(
         threads: Number of FFmpeg threads
         try_re_encode: Try re-encoding if copy mode fails
         concat_dir: Directory to store temporary concat file (defaults to output_file parent)
+        stop_event: Kill FFmpeg (and skip the re-encode fallback) once this is set
     
     Returns:
         True if successful
     """
-    merger = FFmpegMerger(segment_files, output_file, threads, concat_dir)
-    concat_file = Path(concat_dir or Path(output_file).parent) / "concat_list.txt"
+    merger = FFmpegMerger(segment_files, output_file, threads, concat_dir, stop_event=stop_event)
+    concat_file = merger.concat_file
     
     try:
         # Try copy mode first (fast)
         success = merger.merge()
         
         # If failed and re-encode is enabled, try re-encoding
-        if not success and try_re_encode:
+        if not success and try_re_encode and not merger.stopped:
             logger.info("Copy mode failed, attempting re-encode")
             success = merger.merge_with_re_encode()
         
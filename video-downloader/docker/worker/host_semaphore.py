@@ -0,0 +1,202 @@
+"""
+Host Semaphore
+Redis-backed cap on requests in flight per source host, across every worker and job
+"""
+
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEY = "host_slots:config"
+CONFIG_REFRESH_SECONDS = 5.0
+# host_slots:<host>  zset of lease ids scored by their expiry (Redis server time)
+KEY_PREFIX = "host_slots:"
+
+# Take a lease if fewer than ARGV[2] unexpired leases are held on the host.
+# Expired leases (a worker that died mid-request) are dropped first.
+# ARGV: lease id, limit, lease seconds.
+ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 1)
+return 1
+"""
+
+# Push back the expiry of leases that are still held (requests streaming long bodies).
+# KEYS/ARGV: one host key per lease id, then lease seconds last.
+RENEW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local lease = tonumber(ARGV[#ARGV])
+for i, key in ipairs(KEYS) do
+  redis.call('ZADD', key, 'XX', now + lease, ARGV[i])
+  redis.call('EXPIRE', key, math.ceil(lease) + 1)
+end
+return #KEYS
+"""
+
+
+class HostSemaphore:
+    """
+    Distributed counting semaphore per source host.
+
+    Each request holds a lease in ``host_slots:<host>`` while it is in flight,
+    so the cap holds across all jobs and workers, not just within one job.
+    Leases expire after ``lease_seconds`` unless renewed. Renewal is done by a
+    daemon thread while the request runs, so a worker that dies only blocks its
+    slots until then.
+
+    Limits (0 = unlimited) come from the constructor default (env) and can be
+    changed at runtime in the ``host_slots:config`` hash:
+
+        HSET host_slots:config default 8                # every host
+        HSET host_slots:config host:cdn.example.com 4
+
+    If Redis is unavailable, requests go ahead unlimited rather than failing.
+    """
+
+    def __init__(self, redis_client, worker_id: str, limit: int = 0, lease_seconds: float = 30.0):
+        self.redis = redis_client
+        self.worker_id = worker_id
+        self.default_limit = max(0, int(limit))
+        self.lease_seconds = max(1.0, float(lease_seconds))
+        self._overrides: Dict[str, int] = {}
+        self._config_expires = 0.0
+        self._config_lock = threading.Lock()
+        self._acquire_script = None
+        self._renew_script = None
+        self._ids = itertools.count(1)
+        # Lease ids restart with the process; the nonce keeps them apart from leases a
+        # previous process with the same worker id may still hold until they expire
+        self._nonce = uuid.uuid4().hex[:8]
+        # lease id -> host of the leases this process holds
+        self._held: Dict[str, str] = {}
+        self._held_lock = threading.Lock()
+        self._renewer: Optional[threading.Thread] = None
+        self._warned = False
+
+    def _refresh_config(self):
+        now = time.monotonic()
+        if now < self._config_expires:
+            return
+        with self._config_lock:
+            if now < self._config_expires:
+                return
+            self._config_expires = now + CONFIG_REFRESH_SECONDS
+            try:
+                raw = self.redis.hgetall(CONFIG_KEY) or {}
+            except Exception:
+                return
+            overrides = {}
+            for key, value in raw.items():
+                try:
+                    overrides[str(key)] = max(0, int(value))
+                except (TypeError, ValueError):
+                    logger.warning(f"Invalid host slot limit {key}={value!r}, ignoring")
+            if overrides != self._overrides:
+                logger.info(f"Host slot limits updated from Redis: {overrides or 'defaults'}")
+            self._overrides = overrides
+
+    def limit_for(self, host: str) -> int:
+        self._refresh_config()
+        if f"host:{host}" in self._overrides:
+            return self._overrides[f"host:{host}"]
+        return self._overrides.get("default", self.default_limit)
+
+    def try_acquire(self, host: str) -> Optional[str]:
+        """
+        Take a slot on host without waiting.
+
+        Returns:
+            A lease id to pass to release ("" when no limit applies), or None
+            if the host is at its cap
+        """
+        limit = self.limit_for(host)
+        if limit <= 0:
+            return ""
+        lease = f"{self.worker_id}:{self._nonce}:{next(self._ids)}"
+        try:
+            if self._acquire_script is None:
+                self._acquire_script = self.redis.register_script(ACQUIRE_LUA)
+            granted = self._acquire_script(keys=[KEY_PREFIX + host], args=[lease, limit, self.lease_seconds])
+        except Exception as e:
+            if not self._warned:
+                logger.warning(f"Host slot limiter unavailable, not limiting: {e}")
+                self._warned = True
+            return ""
+        self._warned = False
+        if not granted:
+            return None
+        with self._held_lock:
+            self._held[lease] = host
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name="host-slot-renewer", daemon=True)
+                self._renewer.start()
+        return lease
+
+    def acquire(self, host: str, stop_event: Optional[threading.Event] = None) -> Optional[str]:
+        """
+        Block until a slot on host is free (polling with jittered backoff)
+
+        Returns:
+            The lease id, or None if stop_event was set while waiting
+        """
+        delay = 0.02
+        while True:
+            lease = self.try_acquire(host)
+            if lease is not None:
+                return lease
+            wait = random.uniform(delay / 2, delay)
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return None
+            else:
+                time.sleep(wait)
+            delay = min(0.5, delay * 2)
+
+    def release(self, host: str, lease: Optional[str]):
+        if not lease:
+            return
+        with self._held_lock:
+            self._held.pop(lease, None)
+        try:
+            self.redis.zrem(KEY_PREFIX + host, lease)
+        except Exception as e:
+            # The lease expires on its own
+            logger.debug(f"Failed to release host slot on {host}: {e}")
+
+    def held(self) -> int:
+        with self._held_lock:
+            return len(self._held)
+
+    def renew(self):
+        """Extend every lease this process holds by lease_seconds from now"""
+        with self._held_lock:
+            leases = list(self._held.items())
+        if not leases:
+            return
+        if self._renew_script is None:
+            self._renew_script = self.redis.register_script(RENEW_LUA)
+        self._renew_script(
+            keys=[KEY_PREFIX + host for _, host in leases],
+            args=[lease for lease, _ in leases] + [self.lease_seconds],
+        )
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                self.renew()
+            except Exception as e:
+                logger.debug(f"Failed to renew host slots: {e}")
@@ -0,0 +1,143 @@
+"""
+Job Scheduler
+Runs up to N queued download jobs at once inside one worker process
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import redis
+
+from fair_queue import WAKEUP_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class JobScheduler:
+    """
+    Pull job ids from a Redis list and run each on its own thread.
+
+    A job is only popped once a slot is free, so jobs the container can't start
+    yet stay in Redis for other workers. ``run_job(job_id)`` owns everything
+    per-job (DB session, temp dir, downloader); the scheduler only bounds how
+    many run at once. On stop, no new jobs are taken and in-flight ones are
+    waited for (they see the shutdown flag and hand themselves back).
+
+    ``extra_queues`` maps further lists to their own handlers (e.g. shards of a
+    sharded job). They are popped before ``queue`` so work on jobs that are
+    already running finishes first.
+
+    With ``fair_queue`` (a FairQueue), new jobs come from its priority/per-host
+    lists and idle workers block on its wake-up list instead of polling. ``queue``
+    is then not popped here: jobs queued on it before the upgrade are moved into
+    the fair queue atomically (``FairQueue.adopt_legacy``), never held in between.
+    Jobs stay in the fair queue's in-flight record for this worker until their
+    handler returns, so a worker that dies mid-job doesn't lose them.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        run_job: Callable[[str], None],
+        max_jobs: int = 1,
+        queue: str = "download_queue",
+        poll_timeout: int = 5,
+        extra_queues: Optional[Dict[str, Callable[[str], None]]] = None,
+        fair_queue=None,
+    ):
+        self.redis = redis_client
+        self.run_job = run_job
+        self.max_jobs = max(1, int(max_jobs))
+        self.queue = queue
+        self.handlers = dict(extra_queues or {})
+        self.handlers[queue] = run_job
+        self.fair_queue = fair_queue
+        self.poll_timeout = poll_timeout
+        self._slots = threading.Semaphore(self.max_jobs)
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    @property
+    def active_jobs(self):
+        with self._active_lock:
+            return sorted(self._active)
+
+    def _next_job(self):
+        """(queue, job_id) of the next job to run, or None after an idle poll"""
+        if self.fair_queue is not None:
+            for queue in self.handlers:
+                if queue == self.queue:
+                    break
+                job_id = self.redis.lpop(queue)
+                if job_id:
+                    return queue, job_id
+            job_id = self.fair_queue.pop()
+            if job_id:
+                return self.queue, job_id
+            keys = [queue for queue in self.handlers if queue != self.queue] + [WAKEUP_KEY]
+        else:
+            keys = list(self.handlers)
+        
+        result = self.redis.blpop(keys, timeout=self.poll_timeout)
+        if not result or result[0] not in self.handlers:
+            return None  # timeout or wake-up token: look again
+        return result
+
+    def _run_slot(self, handler: Callable[[str], None], job_id: str, label: str, queue: str):
+        try:
+            handler(job_id)
+        except Exception as e:
+            logger.error(f"Unexpected error processing job {job_id}: {e}")
+        finally:
+            if queue == self.queue and self.fair_queue is not None:
+                try:
+                    self.fair_queue.done(job_id)
+                except Exception as e:
+                    logger.warning(f"Failed to clear in-flight record of job {job_id}: {e}")
+            with self._active_lock:
+                self._active.discard(label)
+            self._slots.release()
+
+    def run(self, should_stop: Callable[[], bool]):
+        """Main loop: blocks until should_stop() returns True and running jobs have finished"""
+        logger.info(f"Worker started and waiting for jobs (up to {self.max_jobs} at once)...")
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="job") as executor:
+            while not should_stop():
+                # Wait for a free slot before taking a job off the queue
+                if not self._slots.acquire(timeout=0.5):
+                    continue
+                if should_stop():
+                    self._slots.release()
+                    break
+                try:
+                    # Blocks on Redis while nothing is queued
+                    result = self._next_job()
+                except redis.exceptions.ConnectionError as e:
+                    self._slots.release()
+                    logger.error(f"Redis connection error: {e}")
+                    time.sleep(5)  # Wait before retrying
+                    continue
+                except Exception as e:
+                    self._slots.release()
+                    logger.error(f"Unexpected error in worker loop: {e}")
+                    time.sleep(1)
+                    continue
+
+                if not result:
+                    self._slots.release()
+                    continue
+
+                queue, job_id = result
+                label = job_id if queue == self.queue else f"{queue}:{job_id}"
+                with self._active_lock:
+                    self._active.add(label)
+                logger.info(f"Received {'job' if queue == self.queue else queue}: {job_id} ({len(self._active)}/{self.max_jobs} running)")
+                executor.submit(self._run_slot, self.handlers[queue], job_id, label, queue)
+
+            active = self.active_jobs
+            if active:
+                logger.info(f"Waiting for {len(active)} running job(s) to hand back: {', '.join(active)}")
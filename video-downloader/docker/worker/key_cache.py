@@ -0,0 +1,159 @@
+"""
+Key Cache
+Single-flight AES-128 key resolution with a short-TTL cache shared through Redis
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "hls_key:"
+AES_KEY_LENGTH = 16
+# In-memory entries live this long when Redis sharing is disabled (ttl=0)
+LOCAL_TTL_SECONDS = 600
+# Expired in-memory entries are swept once the cache grows past this many keys
+LOCAL_SWEEP_THRESHOLD = 1024
+
+
+def distinct_key_uris(segments: List[Dict]) -> List[str]:
+    """AES-128 key URIs used by a playlist's segments, in first-use order"""
+    uris = []
+    seen = set()
+    for segment in segments:
+        key = segment.get('key') if isinstance(segment, dict) else None
+        if isinstance(key, dict) and key.get('method') == "AES-128" and key.get('uri'):
+            if key['uri'] not in seen:
+                seen.add(key['uri'])
+                uris.append(key['uri'])
+    return uris
+
+
+class _Flight:
+    __slots__ = ("done", "key", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.key: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class KeyCache:
+    """
+    Resolve AES-128 keys once per URI.
+
+    Concurrent callers for the same URI wait for a single fetch instead of each
+    issuing a GET. Resolved keys are kept in memory and, when a Redis client is
+    given, in Redis (hex, ``ttl`` seconds) so job retries and parallel jobs on
+    the same stream reuse them. Failed fetches are never cached.
+
+    Thread-safe; one instance is meant to be shared by every download in the
+    worker process.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = 600):
+        self.redis = redis_client
+        # Redis TTL; 0 disables Redis sharing
+        self.ttl = max(0, int(ttl))
+        self._local_ttl = self.ttl or LOCAL_TTL_SECONDS
+        self._local: Dict[str, Tuple[bytes, float]] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _redis_key(uri: str) -> str:
+        # Key URIs can be long and carry tokens; hash them for the Redis key name
+        return REDIS_KEY_PREFIX + hashlib.sha1(uri.encode('utf-8')).hexdigest()
+
+    def peek(self, uri: str) -> Optional[bytes]:
+        """Key from the in-memory cache, without touching Redis or the network"""
+        with self._lock:
+            entry = self._local.get(uri)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._local[uri]
+                return None
+            return entry[0]
+
+    def lookup(self, uri: str) -> Optional[bytes]:
+        """Key from memory or Redis (no network fetch)"""
+        key = self.peek(uri)
+        if key is not None or self.redis is None or not self.ttl:
+            return key
+        try:
+            value = self.redis.get(self._redis_key(uri))
+        except Exception as e:
+            logger.debug(f"Key cache lookup failed: {e}")
+            return None
+        if not value:
+            return None
+        try:
+            key = bytes.fromhex(value)
+        except ValueError:
+            return None
+        if len(key) != AES_KEY_LENGTH:
+            return None
+        self._remember(uri, key)
+        return key
+
+    def _remember(self, uri: str, key: bytes):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._local) >= LOCAL_SWEEP_THRESHOLD:
+                self._local = {u: e for u, e in self._local.items() if e[1] >= now}
+            self._local[uri] = (key, now + self._local_ttl)
+
+    def put(self, uri: str, key: bytes):
+        """Store a freshly fetched key in memory and Redis"""
+        if len(key) != AES_KEY_LENGTH:
+            raise ValueError(f"Unexpected AES-128 key length: {len(key)} bytes (expected {AES_KEY_LENGTH})")
+        self._remember(uri, key)
+        if self.redis is None or not self.ttl:
+            return
+        try:
+            self.redis.set(self._redis_key(uri), key.hex(), ex=self.ttl)
+        except Exception as e:
+            logger.debug(f"Key cache store failed: {e}")
+
+    def get(self, uri: str, fetch: Callable[[str], bytes]) -> bytes:
+        """
+        Return the key for uri, calling fetch(uri) at most once across concurrent callers
+
+        Raises:
+            Whatever fetch raised (to every caller waiting on that fetch)
+        """
+        key = self.peek(uri)
+        if key is not None:
+            return key
+
+        with self._lock:
+            flight = self._flights.get(uri)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[uri] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.key
+
+        try:
+            key = self.lookup(uri)
+            if key is None:
+                key = fetch(uri) or b""
+                self.put(uri, key)
+            flight.key = key
+            return key
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(uri, None)
+            flight.done.set()
@@ -0,0 +1,176 @@
+"""
+Job Progress
+Per-segment progress and cancellation checks kept in memory and Redis; Postgres is
+only written on a coarse interval
+"""
+
+import json
+import logging
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Read by the API (live progress of active jobs)
+PROGRESS_KEY_PREFIX = "job_progress:"
+# Set by the API when a job is cancelled
+CANCEL_KEY_PREFIX = "job_cancel:"
+PROGRESS_TTL_SECONDS = 3600
+# Job state/progress deltas, relayed by the API to GET /api/jobs/stream clients
+JOB_EVENTS_CHANNEL = "job_events"
+# ETag versions read by the API. A job change bumps its own version (job detail ETags)
+# and one of the list versions: JOBS_VERSION_KEY when the change is stored in Postgres,
+# JOBS_LIVE_VERSION_KEY when it only went to Redis (live progress), so lists that can't
+# show running jobs stay cacheable while jobs download.
+JOBS_VERSION_KEY = "jobs_version"
+JOBS_LIVE_VERSION_KEY = "jobs_version:live"
+# job_version:<job id>
+JOB_VERSION_PREFIX = "job_version:"
+JOB_VERSION_TTL_SECONDS = 86400
+
+
+def _bump_version(pipe, key: str, ttl: Optional[int] = None):
+    # A missing counter (new or flushed Redis, expired job version) starts from the
+    # current time in ms, so it never returns to a value an ETag was already built from
+    pipe.set(key, int(time.time() * 1000), nx=True)
+    pipe.incr(key)
+    if ttl:
+        pipe.expire(key, ttl)
+
+
+def bump_jobs_version(pipe, job_id: str, live: bool = False):
+    """
+    Queue the ETag version bumps for a change of one job on a pipeline.
+    ``live`` marks a change only kept in Redis (progress between database writes).
+    """
+    _bump_version(pipe, JOB_VERSION_PREFIX + job_id, JOB_VERSION_TTL_SECONDS)
+    _bump_version(pipe, JOBS_LIVE_VERSION_KEY if live else JOBS_VERSION_KEY)
+
+
+def _job_event(job_id: str, fields: dict) -> str:
+    return json.dumps({'id': job_id, **{k: v for k, v in fields.items() if v is not None}})
+
+
+def publish_job_event(redis_client, job_id: str, **fields):
+    """Broadcast a job delta (status, error_message, ...) to live clients (best effort)"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.publish(JOB_EVENTS_CHANNEL, _job_event(job_id, fields))
+        bump_jobs_version(pipe, job_id)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to publish job event: {e}")
+
+
+def publish_progress(redis_client, job_id: str, status: str, progress: int, live: bool = False, **extra):
+    """
+    Write a job's live progress hash and broadcast the delta (best effort).
+    ``live``: the progress was not written to Postgres (see bump_jobs_version).
+    """
+    fields = {'status': status, 'progress': int(progress), 'updated_at': f"{time.time():.3f}"}
+    fields.update({k: v for k, v in extra.items() if v is not None})
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(PROGRESS_KEY_PREFIX + job_id, mapping=fields)
+        pipe.expire(PROGRESS_KEY_PREFIX + job_id, PROGRESS_TTL_SECONDS)
+        pipe.publish(JOB_EVENTS_CHANNEL, _job_event(job_id, fields))
+        bump_jobs_version(pipe, job_id, live=live)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to publish progress: {e}")
+
+
+class JobProgressTracker:
+    """
+    Cheap per-segment progress reporting and cancellation polling for one job.
+
+    ``update`` and ``cancelled`` only touch memory on most calls. Progress goes to
+    the Redis hash at most every ``publish_interval`` seconds and to Postgres (via
+    ``persist(status, progress)``) at most every ``persist_interval`` seconds. The
+    Redis cancel flag is checked every ``cancel_check_interval`` seconds; the
+    database (``check_db_cancelled()``) is consulted on the slow interval too, so
+    a cancellation that only reached Postgres is still noticed.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        job_id: str,
+        persist: Callable[[str, int], None],
+        check_db_cancelled: Callable[[], bool],
+        publish_interval: float = 0.5,
+        persist_interval: float = 15.0,
+        cancel_check_interval: float = 0.5,
+    ):
+        self.redis = redis_client
+        self.job_id = job_id
+        self.persist = persist
+        self.check_db_cancelled = check_db_cancelled
+        self.publish_interval = publish_interval
+        self.persist_interval = persist_interval
+        self.cancel_check_interval = cancel_check_interval
+
+        self.status: Optional[str] = None
+        self.progress = 0
+        self.extra = {}
+        self._published: Optional[tuple] = None
+        self._persisted: Optional[tuple] = None
+        self._next_publish = 0.0
+        # The caller has just written the starting state to Postgres
+        self._next_persist = time.monotonic() + persist_interval
+        self._next_cancel_check = 0.0
+        self._next_db_cancel_check = time.monotonic() + persist_interval
+        self._cancelled = False
+
+    def update(self, status: str, progress: int, **extra):
+        """Record progress; flushed to Redis/Postgres only when their interval is due"""
+        self.status = status
+        self.progress = progress
+        self.extra = extra
+        now = time.monotonic()
+        if now >= self._next_publish:
+            self._publish(now)
+        if now >= self._next_persist:
+            self._persist(now)
+
+    def _publish(self, now: float):
+        self._next_publish = now + self.publish_interval
+        state = (self.status, self.progress)
+        if state == self._published or self.status is None:
+            return
+        publish_progress(self.redis, self.job_id, self.status, self.progress, live=True, **self.extra)
+        self._published = state
+
+    def _persist(self, now: float):
+        self._next_persist = now + self.persist_interval
+        state = (self.status, self.progress)
+        if state == self._persisted or self.status is None:
+            return
+        try:
+            self.persist(self.status, self.progress)
+            self._persisted = state
+        except Exception as e:
+            logger.warning(f"Failed to persist progress for job {self.job_id}: {e}")
+
+    def flush(self):
+        """Write the latest progress to Redis and Postgres now (e.g. before a state transition)"""
+        now = time.monotonic()
+        self._publish(now)
+        self._persist(now)
+
+    def cancelled(self) -> bool:
+        if self._cancelled:
+            return True
+        now = time.monotonic()
+        if now >= self._next_cancel_check:
+            self._next_cancel_check = now + self.cancel_check_interval
+            try:
+                self._cancelled = bool(self.redis.exists(CANCEL_KEY_PREFIX + self.job_id))
+            except Exception as e:
+                logger.debug(f"Cancel flag check failed: {e}")
+                # Redis is unavailable: fall back to the database right away
+                self._next_db_cancel_check = now
+        if not self._cancelled and now >= self._next_db_cancel_check:
+            self._next_db_cancel_check = now + self.persist_interval
+            self._cancelled = bool(self.check_db_cancelled())
+        return self._cancelled
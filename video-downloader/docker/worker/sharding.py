@@ -0,0 +1,417 @@
+"""
+Sharded Downloads
+Split one large HLS job into segment ranges that any worker can claim through Redis
+"""
+
+import json
+import logging
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from checkpoint import SegmentCheckpoint, playlist_fingerprint
+from failures import OTHER, FailureCounters
+
+logger = logging.getLogger(__name__)
+
+# Workers BLPOP this list next to download_queue; each entry is a job id with one
+# unclaimed shard (the shard number itself is taken from the job's pending list)
+SHARD_QUEUE = "shard_queue"
+KEY_PREFIX = "shard:"
+# Redis state of a sharded job expires if its coordinator disappears
+SHARD_STATE_TTL_SECONDS = 86400
+HEARTBEAT_INTERVAL = 2.0
+POLL_INTERVAL = 1.0
+
+# run_shard(spec, segments, output_dir, progress_callback) -> (segment files, failed_segments)
+ShardRunner = Callable[[Dict, List[Dict], str, Optional[Callable[[int, int], None]]], Tuple[List[str], List[Dict]]]
+
+
+class ShardInterrupted(Exception):
+    """A shard download stopped before finishing (shutdown, or the job is no longer sharded)"""
+
+
+def plan_shards(total: int, shard_size: int) -> List[Tuple[int, int]]:
+    """Split range(total) into [start, end) ranges of at most shard_size segments"""
+    shard_size = max(1, int(shard_size))
+    return [(start, min(start + shard_size, total)) for start in range(0, total, shard_size)]
+
+
+def encode_segments(segments: List[Dict]) -> str:
+    """JSON for segment dicts; AES IVs (bytes) are stored as hex"""
+    out = []
+    for segment in segments:
+        item = dict(segment)
+        key = item.get('key')
+        if isinstance(key, dict) and isinstance(key.get('iv'), (bytes, bytearray)):
+            item['key'] = dict(key, iv=key['iv'].hex())
+        out.append(item)
+    return json.dumps(out, separators=(',', ':'))
+
+
+def decode_segments(text: str) -> List[Dict]:
+    segments = json.loads(text)
+    for segment in segments:
+        key = segment.get('key')
+        if isinstance(key, dict) and isinstance(key.get('iv'), str):
+            key['iv'] = bytes.fromhex(key['iv'])
+    return segments
+
+
+def shard_dir(staging_dir: str, shard_no: int) -> str:
+    return str(Path(staging_dir) / f"shard_{shard_no:04d}")
+
+
+class ShardBoard:
+    """
+    Redis state of one sharded job.
+
+    - ``shard:<job>:spec``     JSON: playlist URL, headers, segments, ranges, staging dir
+    - ``shard:<job>:pending``  shard numbers nobody has claimed yet
+    - ``shard:<job>:claimed``  shard numbers being downloaded (LMOVE from pending, so a
+      claim is never lost between the pop and the bookkeeping)
+    - ``shard:<job>:beats``    shard -> JSON {worker, ts, downloaded} heartbeat
+    - ``shard:<job>:done``     shard -> JSON {worker, files, failed}
+    - ``shard:<job>:attempts`` shard -> times a worker gave it back after an error
+    """
+
+    def __init__(self, redis_client, job_id: str, ttl: int = SHARD_STATE_TTL_SECONDS):
+        self.redis = redis_client
+        self.job_id = job_id
+        self.ttl = ttl
+        base = f"{KEY_PREFIX}{job_id}:"
+        self.spec_key = base + "spec"
+        self.pending_key = base + "pending"
+        self.claimed_key = base + "claimed"
+        self.beats_key = base + "beats"
+        self.done_key = base + "done"
+        self.attempts_key = base + "attempts"
+
+    @property
+    def _keys(self) -> List[str]:
+        return [self.spec_key, self.pending_key, self.claimed_key, self.beats_key, self.done_key, self.attempts_key]
+
+    def publish(self, spec: Dict, shard_count: int):
+        """(Re)start the job's shard state and announce every shard on SHARD_QUEUE"""
+        pipe = self.redis.pipeline()
+        pipe.delete(*self._keys)
+        pipe.set(self.spec_key, json.dumps(spec, separators=(',', ':')), ex=self.ttl)
+        pipe.rpush(self.pending_key, *range(shard_count))
+        pipe.rpush(SHARD_QUEUE, *([self.job_id] * shard_count))
+        for key in self._keys[1:]:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def load_spec(self) -> Optional[Dict]:
+        raw = self.redis.get(self.spec_key)
+        return json.loads(raw) if raw else None
+
+    def claim(self, worker_id: str) -> Optional[int]:
+        """Take the next unclaimed shard, if any"""
+        shard = self.redis.lmove(self.pending_key, self.claimed_key, "LEFT", "RIGHT")
+        if shard is None:
+            return None
+        shard_no = int(shard)
+        self.heartbeat(shard_no, worker_id, 0)
+        return shard_no
+
+    def heartbeat(self, shard_no: int, worker_id: str, downloaded: int) -> bool:
+        """
+        Refresh a claim and publish its progress
+
+        Returns:
+            False if the job's shard state is gone (finished, failed or cancelled)
+        """
+        beat = json.dumps({'worker': worker_id, 'ts': time.time(), 'downloaded': downloaded})
+        pipe = self.redis.pipeline()
+        pipe.exists(self.spec_key)
+        pipe.hset(self.beats_key, shard_no, beat)
+        pipe.expire(self.beats_key, self.ttl)
+        alive = pipe.execute()[0]
+        return bool(alive)
+
+    def complete(self, shard_no: int, worker_id: str, files: int, failed: List[Dict]):
+        """Record a finished shard; failed lists {'index', 'error'} for segments that gave up"""
+        result = json.dumps({'worker': worker_id, 'files': files, 'failed': failed})
+        pipe = self.redis.pipeline()
+        pipe.hset(self.done_key, shard_no, result)
+        pipe.expire(self.done_key, self.ttl)
+        pipe.lrem(self.claimed_key, 0, shard_no)
+        pipe.hdel(self.beats_key, shard_no)
+        pipe.execute()
+
+    def release(self, shard_no: int, error: BaseException, max_attempts: int = 3) -> bool:
+        """
+        Hand a shard back after an error. Shutdowns don't count as attempts; after
+        max_attempts other errors the shard is recorded as done with every segment failed.
+
+        Returns:
+            True if the shard went back to pending
+        """
+        if not self.redis.lrem(self.claimed_key, 1, shard_no):
+            return False  # already requeued (stale) or completed by someone else
+        self.redis.hdel(self.beats_key, shard_no)
+        if not isinstance(error, ShardInterrupted):
+            attempts = self.redis.hincrby(self.attempts_key, shard_no, 1)
+            self.redis.expire(self.attempts_key, self.ttl)
+            if attempts >= max_attempts:
+                spec = self.load_spec()
+                if spec is not None:
+                    start, end = spec['ranges'][shard_no]
+                    failed = [{'index': index, 'error': str(error)} for index in range(start, end)]
+                    self.redis.hset(self.done_key, shard_no, json.dumps({'worker': None, 'files': 0, 'failed': failed}))
+                return False
+        self._requeue(shard_no)
+        return True
+
+    def _requeue(self, shard_no: int):
+        pipe = self.redis.pipeline()
+        pipe.rpush(self.pending_key, shard_no)
+        pipe.rpush(SHARD_QUEUE, self.job_id)
+        pipe.execute()
+
+    def requeue_stale(self, timeout: float, unbeaten_since: Dict[int, float]) -> List[int]:
+        """
+        Put claimed shards whose worker stopped heartbeating back to pending.
+        unbeaten_since is caller-owned state: when a claimed shard was first seen
+        without any heartbeat (its claimer died right after LMOVE).
+        """
+        now = time.time()
+        beats = self.redis.hgetall(self.beats_key)
+        requeued = []
+        for raw in self.redis.lrange(self.claimed_key, 0, -1):
+            shard_no = int(raw)
+            beat = beats.get(raw) or beats.get(str(shard_no))
+            if beat:
+                unbeaten_since.pop(shard_no, None)
+                last = json.loads(beat).get('ts', now)
+            else:
+                last = unbeaten_since.setdefault(shard_no, now)
+            if now - last < timeout:
+                continue
+            if self.redis.lrem(self.claimed_key, 1, shard_no):
+                self.redis.hdel(self.beats_key, shard_no)
+                unbeaten_since.pop(shard_no, None)
+                self._requeue(shard_no)
+                requeued.append(shard_no)
+        return requeued
+
+    def snapshot(self) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+        """(heartbeats, finished shards) keyed by shard number"""
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self.beats_key)
+        pipe.hgetall(self.done_key)
+        beats, done = pipe.execute()
+        return (
+            {int(k): json.loads(v) for k, v in beats.items()},
+            {int(k): json.loads(v) for k, v in done.items()},
+        )
+
+    def discard(self):
+        """Drop the job's shard state; workers still holding a shard stop at their next heartbeat"""
+        pipe = self.redis.pipeline()
+        pipe.delete(*self._keys)
+        pipe.lrem(SHARD_QUEUE, 0, self.job_id)
+        pipe.execute()
+
+
+def run_claimed_shard(
+    board: ShardBoard,
+    worker_id: str,
+    run_shard: ShardRunner,
+    should_stop: Callable[[], bool] = lambda: False,
+    max_attempts: int = 3,
+) -> bool:
+    """
+    Claim one shard of board's job and download it (called by any worker that popped
+    the job id from SHARD_QUEUE).
+
+    Returns:
+        True if a shard was downloaded and reported
+    """
+    shard_no = board.claim(worker_id)
+    if shard_no is None:
+        return False  # the coordinator or another worker got there first
+    spec = board.load_spec()
+    if spec is None:
+        return False
+
+    start, end = spec['ranges'][shard_no]
+    segments = decode_segments(spec['segments'])[start:end]
+    logger.info(f"Claimed shard {shard_no} of job {board.job_id} (segments {start}-{end - 1})")
+
+    next_beat = 0.0
+
+    def _progress(completed, total):
+        nonlocal next_beat
+        if should_stop():
+            raise ShardInterrupted("Worker shutting down, shard handed back")
+        if time.monotonic() >= next_beat:
+            next_beat = time.monotonic() + HEARTBEAT_INTERVAL
+            if not board.heartbeat(shard_no, worker_id, completed):
+                raise ShardInterrupted(f"Job {board.job_id} is no longer sharded")
+
+    try:
+        files, failed = run_shard(spec, segments, shard_dir(spec['staging_dir'], shard_no), _progress)
+    except Exception as e:
+        if isinstance(e, ShardInterrupted):
+            logger.info(f"Shard {shard_no} of job {board.job_id} interrupted: {e}")
+        else:
+            logger.error(f"Shard {shard_no} of job {board.job_id} failed: {e}")
+        board.release(shard_no, e, max_attempts)
+        return False
+
+    board.complete(shard_no, worker_id, len(files), _failed_entries(failed))
+    logger.info(f"Finished shard {shard_no} of job {board.job_id}: {len(files)}/{len(segments)} segments")
+    return True
+
+
+def _failed_entries(failed_segments: List[Dict]) -> List[Dict]:
+    return [
+        {'index': item['segment']['index'], 'error': item['error'], 'code': item.get('code', OTHER)}
+        for item in failed_segments
+    ]
+
+
+class ShardedDownload:
+    """
+    Coordinator side of a sharded job, with the SegmentDownloader interface the worker
+    already drives (download_all / failed_segments / failure_counts / get_progress / cleanup).
+
+    download_all publishes the shards, downloads shards itself while any are unclaimed
+    (so a job never waits on a busy cluster), then waits for shards claimed by other
+    workers, re-queueing any whose worker stops heartbeating. Segment files end up in
+    per-shard directories under the shared staging dir; each shard keeps its own
+    checkpoint so a requeued shard resumes instead of starting over.
+    """
+
+    def __init__(
+        self,
+        board: ShardBoard,
+        segments: List[Dict],
+        spec: Dict,
+        run_shard: ShardRunner,
+        worker_id: str,
+        shard_size: int,
+        claim_timeout: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        self.board = board
+        self.segments = segments
+        self.run_shard = run_shard
+        self.worker_id = worker_id
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.ranges = plan_shards(len(segments), shard_size)
+        self.staging_dir = spec['staging_dir']
+        self.spec = dict(spec, segments=encode_segments(segments), ranges=self.ranges)
+
+        self.total_segments = len(segments)
+        self.downloaded_count = 0
+        self.failed_segments: List[Dict] = []
+        self.failure_counts = FailureCounters()
+        self._stop_event = threading.Event()
+
+    def request_stop(self):
+        self._stop_event.set()
+
+    def _shard_segments(self, shard_no: int) -> List[Dict]:
+        start, end = self.ranges[shard_no]
+        return self.segments[start:end]
+
+    def _update(self, beats: Dict[int, Dict], done: Dict[int, Dict], local: int = 0):
+        by_index = {segment['index']: segment for segment in self.segments}
+        self.failed_segments = [
+            {'segment': by_index[item['index']], 'error': item['error'], 'code': item.get('code', OTHER)}
+            for result in done.values() for item in result['failed'] if item['index'] in by_index
+        ]
+        counts = FailureCounters()
+        for item in self.failed_segments:
+            counts.record_segment(item['code'])
+        self.failure_counts = counts
+        self.downloaded_count = (
+            sum(result['files'] for result in done.values())
+            + sum(beat.get('downloaded', 0) for shard_no, beat in beats.items() if shard_no not in done)
+            + local
+        )
+
+    def _run_local(self, shard_no: int, progress_callback):
+        segments = self._shard_segments(shard_no)
+        beats, done = self.board.snapshot()
+        beats.pop(shard_no, None)
+        next_beat = 0.0
+
+        def _progress(completed, total):
+            nonlocal next_beat
+            if time.monotonic() >= next_beat:
+                next_beat = time.monotonic() + HEARTBEAT_INTERVAL
+                self.board.heartbeat(shard_no, self.worker_id, completed)
+            self._update(beats, done, completed)
+            if progress_callback:
+                progress_callback(self.downloaded_count, self.total_segments)
+
+        logger.info(f"Downloading shard {shard_no} locally ({len(segments)} segments)")
+        files, failed = self.run_shard(self.spec, segments, shard_dir(self.staging_dir, shard_no), _progress)
+        self.board.complete(shard_no, self.worker_id, len(files), _failed_entries(failed))
+
+    def download_all(self, progress_callback=None) -> List[str]:
+        logger.info(f"Sharding {self.total_segments} segments into {len(self.ranges)} shards")
+        self.board.publish(self.spec, len(self.ranges))
+        unbeaten_since: Dict[int, float] = {}
+        done: Dict[int, Dict] = {}
+        try:
+            while not self._stop_event.is_set():
+                shard_no = self.board.claim(self.worker_id)
+                if shard_no is not None:
+                    self._run_local(shard_no, progress_callback)
+                    continue
+
+                beats, done = self.board.snapshot()
+                self._update(beats, done)
+                if len(done) >= len(self.ranges):
+                    break
+                for stale in self.board.requeue_stale(self.claim_timeout, unbeaten_since):
+                    logger.warning(f"Shard {stale} stopped heartbeating, requeued")
+                if progress_callback:
+                    progress_callback(self.downloaded_count, self.total_segments)
+                self._stop_event.wait(POLL_INTERVAL)
+
+            helpers = sorted({r['worker'] for r in done.values() if r.get('worker')} - {self.worker_id})
+            if helpers:
+                logger.info(f"Shards downloaded with help from: {', '.join(helpers)}")
+            return self._collect()
+        finally:
+            self.board.discard()
+
+    def _collect(self) -> List[str]:
+        """Segment files in playlist order, read back from each shard's checkpoint"""
+        files = []
+        for shard_no in range(len(self.ranges)):
+            segments = self._shard_segments(shard_no)
+            checkpoint = SegmentCheckpoint(shard_dir(self.staging_dir, shard_no), playlist_fingerprint(segments))
+            for segment in segments:
+                path = checkpoint.completed_path(segment['index'])
+                if path:
+                    files.append(path)
+        self.downloaded_count = len(files)
+        logger.info(f"Download complete: {len(files)}/{self.total_segments} segments successful")
+        return files
+
+    def circuit_tripped(self) -> Optional[Tuple[str, str]]:
+        # Each shard's own downloader stops on its circuit; the coordinator only sees shard results
+        return None
+
+    def get_progress(self) -> Dict:
+        return {
+            'downloaded': self.downloaded_count,
+            'total': self.total_segments,
+            'percentage': int((self.downloaded_count / self.total_segments) * 100) if self.total_segments else 0,
+            'failed': len(self.failed_segments),
+        }
+
+    def cleanup(self):
+        """Remove the shard directories"""
+        for shard_no in range(len(self.ranges)):
+            shutil.rmtree(shard_dir(self.staging_dir, shard_no), ignore_errors=True)
@@ -0,0 +1,46 @@
+"""
+Referer Strategy Cache
+Remembers which Referer/Origin strategy each CDN host accepts, shared through Redis
+"""
+
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "referer_strategy:"
+
+
+class RefererStrategyCache:
+    """
+    Host -> Referer strategy name (see SegmentDownloader._get_referer_strategies).
+
+    Only the name is stored: the actual headers depend on the job's source page and
+    playlist URL and are rebuilt per job. Redis errors are ignored, so a cache
+    outage only costs a discovery probe.
+    """
+
+    def __init__(self, redis_client, ttl: int = 86400):
+        self.redis = redis_client
+        self.ttl = max(0, int(ttl))
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis is not None and self.ttl > 0
+
+    def get(self, host: str) -> Optional[str]:
+        if not self.enabled or not host:
+            return None
+        try:
+            return self.redis.get(REDIS_KEY_PREFIX + host) or None
+        except Exception as e:
+            logger.debug(f"Referer strategy lookup failed: {e}")
+            return None
+
+    def set(self, host: str, strategy_name: str):
+        if not self.enabled or not host:
+            return
+        try:
+            self.redis.set(REDIS_KEY_PREFIX + host, strategy_name, ex=self.ttl)
+        except Exception as e:
+            logger.debug(f"Referer strategy store failed: {e}")
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from async_downloader import AsyncSegmentDownloader
+from downloader import TS_PACKET_SIZE, TS_SYNC_BYTE
+
+KEY = bytes.fromhex("00112233445566778899aabbccddeeff")
+
+
+def _ts_payload(index: int, packet_count: int = 4) -> bytes:
+    data = bytearray(TS_PACKET_SIZE * packet_count)
+    for i in range(packet_count):
+        data[i * TS_PACKET_SIZE] = TS_SYNC_BYTE[0]
+    data[1] = index % 256
+    return bytes(data)
+
+
+@pytest.fixture
+def segment_server():
+    """Serve /seg/<n>.ts (plain), /enc/<n>.ts (AES-128, sequence IV) and /key on localhost."""
+    hits = {"key": 0}
+
+    async def plain(request):
+        return web.Response(body=_ts_payload(int(request.match_info["n"])), content_type="video/mp2t")
+
+    async def encrypted(request):
+        n = int(request.match_info["n"])
+        cipher = AES.new(KEY, AES.MODE_CBC, n.to_bytes(16, "big"))
+        return web.Response(body=cipher.encrypt(pad(_ts_payload(n), AES.block_size)), content_type="video/mp2t")
+
+    async def trickle(request):
+        # A body that arrives a piece at a time (a server pacing its output)
+        body = _ts_payload(int(request.match_info["n"]), packet_count=1400)
+        response = web.StreamResponse(headers={"Content-Type": "video/mp2t"})
+        response.content_length = len(body)
+        await response.prepare(request)
+        for start in range(0, len(body), 64 * 1024):
+            await response.write(body[start:start + 64 * 1024])
+            await asyncio.sleep(0.3)
+        await response.write_eof()
+        return response
+
+    async def key(request):
+        hits["key"] += 1
+        return web.Response(body=KEY)
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.add_routes([web.get("/seg/{n}.ts", plain), web.get("/enc/{n}.ts", encrypted),
+                    web.get("/trickle/{n}.ts", trickle), web.get("/key", key)])
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{port}", hits
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+def test_async_engine_downloads_all_segments_in_order(tmp_path, segment_server):
+    base, _ = segment_server
+    segments = [{"url": f"{base}/seg/{i}.ts", "index": i, "sequence": i, "key": None} for i in range(30)]
+    progress = []
+
+    d = AsyncSegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object(), max_connections=8)
+    files = d.download_all(lambda done, total: progress.append((done, total)))
+
+    assert files == [str(tmp_path / f"segment_{i:05d}.ts") for i in range(30)]
+    assert (tmp_path / "segment_00007.ts").read_bytes() == _ts_payload(7)
+    assert progress[-1] == (30, 30)
+    assert d.failed_segments == []
+
+
+def test_async_engine_decrypts_with_single_key_fetch(tmp_path, segment_server):
+    base, hits = segment_server
+    key_info = {"method": "AES-128", "uri": f"{base}/key", "iv": None}
+    segments = [{"url": f"{base}/enc/{i}.ts", "index": i, "sequence": i, "key": key_info} for i in range(12)]
+
+    d = AsyncSegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object(), max_connections=12)
+    files = d.download_all()
+
+    assert len(files) == 12
+    assert (tmp_path / "segment_00005.ts").read_bytes() == _ts_payload(5)
+    assert hits["key"] == 1
+
+
+def test_async_engine_stops_when_progress_callback_raises(tmp_path, segment_server):
+    base, _ = segment_server
+    segments = [{"url": f"{base}/seg/{i}.ts", "index": i, "sequence": i, "key": None} for i in range(50)]
+
+    def _cancel(done, total):
+        if done >= 3:
+            raise Exception("Job cancelled by user")
+
+    d = AsyncSegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object(), max_connections=2)
+    with pytest.raises(Exception, match="cancelled by user"):
+        d.download_all(_cancel)
+    assert d.is_stop_requested()
+    assert d.downloaded_count < 50
+
+
+def test_async_engine_streams_encrypted_bodies(tmp_path, segment_server):
+    base, hits = segment_server
+    key_info = {"method": "AES-128", "uri": f"{base}/key", "iv": None}
+    segments = [{"url": f"{base}/enc/{i}.ts", "index": i, "sequence": i, "key": key_info} for i in range(6)]
+
+    d = AsyncSegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object(),
+                               max_connections=3, stream_bodies=True)
+    files = d.download_all()
+
+    assert len(files) == 6
+    assert (tmp_path / "segment_00004.ts").read_bytes() == _ts_payload(4)
+    assert not list(tmp_path.glob("*.tmp"))
+    assert hits["key"] == 1
+
+
+def test_async_engine_throttled_stream_may_outlast_the_timeout(tmp_path, segment_server):
+    base, _ = segment_server
+    segments = [{"url": f"{base}/trickle/{i}.ts", "index": i, "sequence": i, "key": None} for i in range(2)]
+
+    class _SlowBandwidth:
+        """Shaping that holds every chunk back, so a segment takes ~2 s against a 1 s timeout"""
+
+        def reserve(self, host, nbytes):
+            return 0.1
+
+    d = AsyncSegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object(), timeout=1,
+                               max_retries=0, max_connections=2, stream_bodies=True, bandwidth=_SlowBandwidth())
+    files = d.download_all()
+
+    assert files == [str(tmp_path / f"segment_{i:05d}.ts") for i in range(2)]
+    assert (tmp_path / "segment_00001.ts").read_bytes() == _ts_payload(1, packet_count=1400)
+    assert d.failed_segments == []
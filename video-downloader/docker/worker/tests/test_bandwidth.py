@@ -0,0 +1,42 @@
+import pytest
+
+from bandwidth import BandwidthLimiter, CONFIG_KEY, parse_rate
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [("0", 0), ("", 0), ("800K", 800 * 1024), ("12M", 12 * 1024 ** 2), ("1.5GB/s", int(1.5 * 1024 ** 3)), ("4096", 4096), ("fast", 0)],
+)
+def test_parse_rate(raw, expected):
+    assert parse_rate(raw) == expected
+
+
+def _limiter(**rates):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    return client, BandwidthLimiter(client, worker_id="w1", **rates)
+
+
+def test_unlimited_by_default_does_not_touch_buckets():
+    client, limiter = _limiter()
+    assert limiter.reserve("cdn.example.com", 10 * 1024 * 1024) == 0.0
+    assert client.keys("bw:*") == []
+
+
+def test_debt_beyond_burst_turns_into_wait_time_across_all_buckets():
+    client, limiter = _limiter(global_rate=1000, host_rate=500)
+    # First 500 bytes fit the host burst; the next 500 put the host bucket 500 bytes in debt.
+    assert limiter.reserve("cdn.example.com", 500) == 0.0
+    wait = limiter.reserve("cdn.example.com", 500)
+    assert 0.9 <= wait <= 1.01
+    assert set(client.keys("bw:*")) == {"bw:global", "bw:host:cdn.example.com"}
+
+
+def test_runtime_overrides_from_redis_config_hash():
+    client, limiter = _limiter(global_rate=0)
+    client.hset(CONFIG_KEY, mapping={"global": "1K", "host:slow.example.com": "100", "worker:w1": "0"})
+    limiter._config_expires = 0.0
+
+    assert limiter.limits_for("slow.example.com") == {"bw:global": 1024, "bw:host:slow.example.com": 100}
+    assert limiter.limits_for("other.example.com") == {"bw:global": 1024}
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelListener, CancelRegistry, CancelToken
+from downloader import SegmentDownloader
+
+
+def test_token_runs_callbacks_once_and_late_ones_immediately():
+    token = CancelToken("job")
+    calls = []
+    token.add_callback(lambda: calls.append("a"))
+    removed = lambda: calls.append("removed")
+    token.add_callback(removed)
+    token.remove_callback(removed)
+
+    token.cancel()
+    token.cancel()
+    assert calls == ["a"]
+
+    token.add_callback(lambda: calls.append("late"))
+    assert calls == ["a", "late"]
+
+
+def test_registry_cancels_every_task_of_a_job():
+    registry = CancelRegistry()
+    job = registry.register("a")
+    shard = registry.register("a")
+    other = registry.register("b")
+
+    assert registry.cancel("a") is True
+    assert job.is_set() and shard.is_set() and not other.is_set()
+
+    registry.unregister(job)
+    registry.unregister(shard)
+    assert registry.cancel("a") is False
+
+
+def test_listener_cancels_on_published_message():
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis(decode_responses=True)
+    registry = CancelRegistry()
+    token = registry.register("job-1")
+
+    listener = CancelListener(r, registry)
+    listener.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not token.is_set() and time.monotonic() < deadline:
+            r.publish("job_cancel", "job-1")
+            token.event.wait(0.1)
+        assert token.is_set()
+    finally:
+        listener.stop()
+        listener.join(timeout=5)
+
+
+def test_request_stop_closes_streaming_responses(tmp_path):
+    release = threading.Event()
+
+    class _Response:
+        status_code = 200
+        headers = {}
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, chunk_size=None):
+            yield b"\x47" + b"\x00" * 187
+            # Blocks like a stalled socket read until the response is closed
+            release.wait(10)
+            raise ConnectionError("connection closed")
+
+        def close(self):
+            release.set()
+
+    class _Session:
+        def get(self, *args, **kwargs):
+            return _Response()
+
+    segments = [{"url": "https://cdn.example.com/seg0.ts", "index": 0, "sequence": 0, "key": None}]
+    d = SegmentDownloader(
+        segments=segments, output_dir=str(tmp_path), session=_Session(), max_retries=0, stream_bodies=True
+    )
+    threading.Timer(0.2, d.request_stop).start()
+
+    started = time.monotonic()
+    d.download_all()
+    assert time.monotonic() - started < 5
+    assert release.is_set()
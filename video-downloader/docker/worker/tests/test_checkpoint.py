@@ -0,0 +1,119 @@
+from checkpoint import SegmentCheckpoint, playlist_fingerprint, segment_checksum
+from downloader import SegmentDownloader, TS_PACKET_SIZE, TS_SYNC_BYTE
+
+
+def _ts_payload(tag: int) -> bytes:
+    data = bytearray(TS_PACKET_SIZE * 3)
+    for i in range(3):
+        data[i * TS_PACKET_SIZE] = TS_SYNC_BYTE[0]
+    data[1] = tag
+    return bytes(data)
+
+
+def _segments(count: int, token: str = "abc"):
+    return [
+        {"url": f"https://cdn.example.com/v/seg{i}.ts?token={token}", "index": i, "sequence": 100 + i, "key": None}
+        for i in range(count)
+    ]
+
+
+def test_fingerprint_ignores_query_tokens_but_not_paths():
+    assert playlist_fingerprint(_segments(3, token="a")) == playlist_fingerprint(_segments(3, token="b"))
+    assert playlist_fingerprint(_segments(3)) != playlist_fingerprint(_segments(4))
+
+
+def test_checkpoint_survives_reopen_and_torn_last_line(tmp_path):
+    segments = _segments(3)
+    cp = SegmentCheckpoint.for_job("job-1", segments, root=str(tmp_path))
+    seg = cp.staging_dir / "segment_00001.ts"
+    seg.write_bytes(_ts_payload(1))
+    cp.record(1, str(seg), seg.stat().st_size, segment_checksum(seg.read_bytes()))
+    with open(cp.manifest_path, "a") as f:
+        f.write('{"index": 2, "fi')  # crash mid-append
+
+    reopened = SegmentCheckpoint.for_job("job-1", _segments(3, token="refreshed"), root=str(tmp_path))
+    assert reopened.completed_count == 1
+    assert reopened.completed_path(1) == str(seg)
+    assert reopened.completed_path(2) is None
+
+
+def test_checkpoint_rejects_truncated_files_and_resets_on_new_playlist(tmp_path):
+    cp = SegmentCheckpoint.for_job("job-2", _segments(2), root=str(tmp_path))
+    seg = cp.staging_dir / "segment_00000.ts"
+    seg.write_bytes(_ts_payload(0))
+    cp.record(0, str(seg), seg.stat().st_size, segment_checksum(seg.read_bytes()))
+
+    seg.write_bytes(b"short")
+    assert cp.completed_path(0) is None
+
+    other = SegmentCheckpoint.for_job("job-2", _segments(5), root=str(tmp_path))
+    assert other.completed_count == 0
+    assert not seg.exists()
+
+
+def test_downloader_only_fetches_segments_missing_from_checkpoint(tmp_path, monkeypatch):
+    fetched = []
+
+    def _fake_fetch(self, url, headers, index, probe=False):
+        fetched.append(index)
+        return _ts_payload(index)
+
+    monkeypatch.setattr(SegmentDownloader, "_try_download_with_headers", _fake_fetch)
+
+    segments = _segments(4)
+    cp = SegmentCheckpoint.for_job("job-3", segments, root=str(tmp_path))
+    first = SegmentDownloader(segments=segments, output_dir=str(cp.staging_dir), session=object(), checkpoint=cp)
+    first.download_segment(segments[0])
+    first.download_segment(segments[2])
+    fetched.clear()
+
+    resumed_cp = SegmentCheckpoint.for_job("job-3", segments, root=str(tmp_path))
+    resumed = SegmentDownloader(segments=segments, output_dir=str(resumed_cp.staging_dir), session=object(), checkpoint=resumed_cp)
+    files = resumed.download_all()
+
+    assert sorted(fetched) == [1, 3]
+    assert len(files) == 4
+    assert resumed.downloaded_count == 4
+    assert resumed_cp.completed_count == 4
+
+
+def test_streamed_segments_are_checkpointed_and_replayed_into_the_sink(tmp_path, monkeypatch):
+    fetched = []
+
+    def _fake_fetch(self, url, headers, index, probe=False):
+        fetched.append(index)
+        return _ts_payload(index)
+
+    class _Sink:
+        def __init__(self):
+            self.items = {}
+
+        def submit(self, index, data):
+            self.items[index] = data
+
+        def skip(self, index):
+            self.items[index] = None
+
+    monkeypatch.setattr(SegmentDownloader, "_try_download_with_headers", _fake_fetch)
+    segments = _segments(3)
+
+    # A streamed job crashes after two segments reached FFmpeg
+    cp = SegmentCheckpoint.for_job("job-4", segments, root=str(tmp_path))
+    first = SegmentDownloader(
+        segments=segments, output_dir=str(cp.staging_dir), session=object(), checkpoint=cp, segment_sink=_Sink()
+    )
+    first.download_segment(segments[0])
+    first.download_segment(segments[1])
+    fetched.clear()
+
+    # The restarted job feeds them to its new FFmpeg from disk and only downloads the last one
+    sink = _Sink()
+    resumed_cp = SegmentCheckpoint.for_job("job-4", segments, root=str(tmp_path))
+    resumed = SegmentDownloader(
+        segments=segments, output_dir=str(resumed_cp.staging_dir), session=object(), checkpoint=resumed_cp, segment_sink=sink
+    )
+    resumed.download_all()
+
+    assert fetched == [2]
+    assert sorted(sink.items) == [0, 1, 2]
+    assert open(sink.items[0], "rb").read() == _ts_payload(0)
@@ -0,0 +1,49 @@
+import threading
+
+from concurrency import AdaptiveConcurrencyController
+
+
+def test_limit_grows_after_a_window_of_healthy_responses():
+    c = AdaptiveConcurrencyController(initial_limit=4, max_limit=6)
+    for _ in range(4):
+        assert c.acquire("cdn.example.com")
+        c.release("cdn.example.com", status=200, ttfb=0.05)
+    assert c.limit_for("cdn.example.com") == 5
+
+    for _ in range(50):
+        c.acquire("cdn.example.com")
+        c.release("cdn.example.com", status=200, ttfb=0.05)
+    assert c.limit_for("cdn.example.com") == 6  # capped at max_limit
+
+
+def test_throttling_halves_limit_once_per_cooldown_and_hosts_are_independent():
+    c = AdaptiveConcurrencyController(initial_limit=20, min_limit=2, cooldown=60)
+    for status in (474, 429, 503):
+        c.acquire("a.example.com")
+        c.release("a.example.com", status=status)
+    assert c.limit_for("a.example.com") == 10
+    assert c.limit_for("b.example.com") == 20
+
+
+def test_rising_ttfb_counts_as_congestion():
+    c = AdaptiveConcurrencyController(initial_limit=40, max_limit=40, cooldown=0)
+    for _ in range(20):
+        c.acquire("cdn")
+        c.release("cdn", status=200, ttfb=0.05)
+    for _ in range(10):
+        c.acquire("cdn")
+        c.release("cdn", status=200, ttfb=1.0)
+    assert c.limit_for("cdn") < 40
+
+
+def test_acquire_blocks_at_limit_and_respects_stop_event():
+    c = AdaptiveConcurrencyController(initial_limit=1)
+    assert c.try_acquire("cdn")
+    assert not c.try_acquire("cdn")
+
+    stop = threading.Event()
+    stop.set()
+    assert c.acquire("cdn", stop_event=stop) is False
+
+    c.release("cdn", status=200, ttfb=0.01)
+    assert c.snapshot() == {"cdn": {"limit": 2, "in_flight": 0, "ttfb_ms": 10}}
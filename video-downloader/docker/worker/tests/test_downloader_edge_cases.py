@@ -91,3 +91,60 @@ def test_decrypt_segment_with_key_prefers_provided_iv(tmp_path):
         sequence_number=123,
     )
     assert out == plaintext
+
+
+class _CountingAES:
+    """Stand-in for Crypto.Cipher.AES that counts full CBC decrypt contexts"""
+    MODE_CBC = AES.MODE_CBC
+    MODE_ECB = AES.MODE_ECB
+    block_size = AES.block_size
+
+    def __init__(self):
+        self.cbc = 0
+
+    def new(self, key, mode, *args):
+        if mode == AES.MODE_CBC:
+            self.cbc += 1
+        return AES.new(key, mode, *args)
+
+
+def test_decryption_profile_is_learned_and_rediscovered(tmp_path, monkeypatch):
+    import downloader
+
+    counting = _CountingAES()
+    monkeypatch.setattr(downloader, "AES", counting)
+    d = SegmentDownloader(segments=[], output_dir=str(tmp_path), session=object())
+    key = bytes.fromhex("00112233445566778899aabbccddeeff")
+    plain = _make_valid_ts_sample(packet_count=4)
+
+    declared_iv = bytes([0xAA]) + bytes(15)
+
+    for index in range(5):
+        # Playlist declares an IV, but the CDN actually encrypts with the HLS sequence default
+        ciphertext = AES.new(key, AES.MODE_CBC, (1000 + index).to_bytes(16, "big")).encrypt(pad(plain, AES.block_size))
+        out = d._decrypt_segment_with_key(ciphertext, index, key_bytes=key, iv_bytes=declared_iv, sequence_number=1000 + index)
+        assert out == plain
+    assert counting.cbc == 5  # one full decrypt per segment, no brute force
+    assert d.decrypt_profile == {"iv": "sequence IV", "padding": "pkcs7"}
+
+    # Declared IV becomes correct mid-stream: rediscovered from the first block
+    ciphertext = AES.new(key, AES.MODE_CBC, declared_iv).encrypt(pad(plain, AES.block_size))
+    assert d._decrypt_segment_with_key(ciphertext, 5, key_bytes=key, iv_bytes=declared_iv, sequence_number=1005) == plain
+    assert d.decrypt_profile["iv"] == "provided IV"
+
+
+def test_unpadded_stream_stops_stripping_padding_lookalikes(tmp_path):
+    d = SegmentDownloader(segments=[], output_dir=str(tmp_path), session=object())
+    key = bytes.fromhex("00112233445566778899aabbccddeeff")
+    iv = bytes(range(16))
+    plain = bytearray(_make_valid_ts_sample(packet_count=8))  # 1504 bytes, block aligned
+    plain[-1] = 0x20  # not valid PKCS#7
+
+    for index in range(3):
+        ciphertext = AES.new(key, AES.MODE_CBC, iv).encrypt(bytes(plain))
+        assert d._decrypt_segment_with_key(ciphertext, index, key, iv, index) == bytes(plain)
+    assert d.decrypt_profile["padding"] == "none"
+
+    plain[-1] = 0x01  # would be "valid" padding by accident
+    ciphertext = AES.new(key, AES.MODE_CBC, iv).encrypt(bytes(plain))
+    assert d._decrypt_segment_with_key(ciphertext, 3, key, iv, 3) == bytes(plain)
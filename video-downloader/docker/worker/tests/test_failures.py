@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import downloader
+import failures
+from downloader import SegmentContentError, SegmentDownloader
+from failures import BLOCKED, CircuitBreaker, classify_failure
+
+
+class _HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"{status} Error")
+        self.response = type("Response", (), {"status_code": status, "headers": {}})()
+
+
+class ReadTimeout(OSError):
+    pass
+
+
+def _segments(count):
+    return [{"url": f"https://cdn.example.com/seg{i}.ts", "index": i, "sequence": i, "key": None} for i in range(count)]
+
+
+@pytest.mark.parametrize(
+    "error, code",
+    [
+        (_HTTPError(474), failures.BLOCKED),
+        (_HTTPError(403), failures.BLOCKED),
+        (_HTTPError(429), failures.RATE_LIMITED),
+        (_HTTPError(503), failures.SERVER_ERROR),
+        (_HTTPError(404), failures.HTTP_ERROR),
+        (SegmentContentError("Server returned PNG image (anti-hotlinking protection)"), failures.HOTLINK),
+        (SegmentContentError("Invalid TS format (no sync bytes found)"), failures.BAD_CONTENT),
+        (ReadTimeout("read timed out"), failures.TIMEOUT),
+        (asyncio.TimeoutError(), failures.TIMEOUT),
+        (ConnectionResetError("reset"), failures.CONNECTION),
+        (RuntimeError("boom"), failures.OTHER),
+    ],
+)
+def test_classify_failure(error, code):
+    assert classify_failure(error) == code
+
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(failures.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=0.5, window=10, min_requests=4, open_seconds=10, max_open_seconds=30)
+
+    # 404s don't count against the host; 503s do
+    for code in (None, failures.HTTP_ERROR, failures.SERVER_ERROR):
+        breaker.record("cdn", code)
+    assert breaker.retry_after("cdn") == 0
+    breaker.record("cdn", failures.SERVER_ERROR)
+    assert breaker.is_open("cdn")
+    assert breaker.retry_after("cdn") == 10
+    # Waiting fixes 5xx, so the job isn't failed for it
+    assert breaker.tripped() is None
+
+    # Half-open: one probe goes out, everyone else keeps waiting
+    now[0] += 10
+    assert breaker.retry_after("cdn") == 0
+    assert breaker.retry_after("cdn") > 0
+    breaker.record("cdn", failures.TIMEOUT)
+    assert breaker.retry_after("cdn") == 20
+
+    now[0] += 20
+    assert breaker.retry_after("cdn") == 0
+    breaker.record("cdn")
+    assert not breaker.is_open("cdn")
+    assert breaker.snapshot()["cdn"] == {"state": "closed", "failures": 0, "window": 0}
+
+
+def test_ban_fails_the_job_within_a_few_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "retry_delay", lambda attempt, error=None: 0.05)
+    attempts = []
+    lock = threading.Lock()
+
+    def _attempt(self, segment, attempt=0):
+        with lock:
+            attempts.append(segment["index"])
+        if segment["index"] < 2:
+            return f"segment_{segment['index']}.ts"
+        raise _HTTPError(474)
+
+    monkeypatch.setattr(SegmentDownloader, "_attempt_segment", _attempt)
+    d = SegmentDownloader(
+        segments=_segments(200),
+        output_dir=str(tmp_path),
+        session=object(),
+        max_workers=4,
+        max_retries=5,
+        circuit_breaker=CircuitBreaker(min_requests=8),
+    )
+
+    def _progress(completed, total):
+        if d.circuit_tripped():
+            raise RuntimeError("banned")
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="banned"):
+        d.download_all(_progress)
+
+    assert time.monotonic() - started < 3
+    assert d.circuit_tripped() == ("cdn.example.com", BLOCKED)
+    # Stopped after roughly one window, not 198 segments x 6 attempts
+    assert len(attempts) < 40
+    assert d.failure_counts.attempts[BLOCKED] >= 4
+    assert d.failure_counts.by_host["cdn.example.com"][BLOCKED] == d.failure_counts.attempts[BLOCKED]
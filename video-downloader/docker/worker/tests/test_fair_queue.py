@@ -0,0 +1,226 @@
+import ast
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import fair_queue
+from fair_queue import (
+    HEARTBEATS_KEY,
+    LEGACY_QUEUE,
+    OWNER_PREFIX,
+    RETRY_KEY,
+    FairQueue,
+    QueueHeartbeat,
+    WAKEUP_BACKLOG,
+    WAKEUP_KEY,
+    retry_delay,
+)
+from job_scheduler import JobScheduler
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def test_hosts_take_turns_and_higher_priority_goes_first():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    queue = FairQueue(r)
+
+    # A bulk series from one slow host, then a single quick job from another
+    for i in range(1, 6):
+        queue.push(f"a{i}", f"https://a.example.com/show/ep{i}.m3u8")
+    queue.push("b1", "https://B.example.com/clip.mp4")
+    queue.push("urgent", "https://c.example.com/live.m3u8", priority="high")
+    queue.push("later", "https://a.example.com/extra.mp4", priority="low")
+
+    order = []
+    while (job_id := queue.pop()) is not None:
+        order.append(job_id)
+
+    assert order == ["urgent", "a1", "b1", "a2", "a3", "a4", "a5", "later"]
+    # Drained hosts leave their class; nothing is left behind
+    assert r.keys("fair_queue:hosts:*") == []
+    assert r.llen(WAKEUP_KEY) == 8
+
+
+def test_wakeup_tokens_are_bounded():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    queue = FairQueue(r)
+    for i in range(WAKEUP_BACKLOG + 10):
+        queue.push(f"job-{i}", "https://a.example.com/v.mp4", priority="bogus")
+
+    assert r.llen(WAKEUP_KEY) == WAKEUP_BACKLOG
+    assert r.llen("fair_queue:normal:a.example.com") == WAKEUP_BACKLOG + 10
+
+
+def test_scheduler_runs_fair_and_legacy_jobs():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    queue = FairQueue(r)
+    queue.push("a1", "https://a.example.com/1.m3u8")
+    queue.push("b1", "https://b.example.com/1.m3u8")
+    r.rpush(LEGACY_QUEUE, "legacy")
+    QueueHeartbeat(queue, interval=1, timeout=15, legacy_lookup=lambda job_id: ("https://c.example.com/1.mp4", None)).beat()
+
+    finished = []
+    lock = threading.Lock()
+
+    def _run_job(job_id):
+        with lock:
+            finished.append(job_id)
+
+    scheduler = JobScheduler(r, _run_job, max_jobs=1, poll_timeout=1, fair_queue=queue)
+    scheduler.run(lambda: len(finished) == 3)
+
+    assert finished == ["a1", "b1", "legacy"]
+    assert r.llen(LEGACY_QUEUE) == 0
+    # Every job was cleared from the in-flight record once its handler returned
+    assert r.hlen(queue.processing_key) == 0
+
+
+def test_jobs_of_a_dead_worker_go_back_to_the_front():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    dead = FairQueue(r, worker_id="worker-1")
+    alive = FairQueue(r, worker_id="worker-2")
+    for i in range(1, 4):
+        dead.push(f"a{i}", f"https://a.example.com/{i}.m3u8")
+    dead.push("b1", "https://b.example.com/1.m3u8", priority="high")
+
+    assert dead.pop() == "b1"
+    assert dead.pop() == "a1"
+    dead.done("b1")
+    assert r.hgetall(dead.processing_key) == {"a1": "normal a.example.com"}
+
+    # worker-1 beat a minute ago and went silent; worker-2 is alive
+    r.zadd(HEARTBEATS_KEY, {"worker-1": time.time() - 60})
+    requeued = []
+    QueueHeartbeat(alive, interval=1, timeout=15, on_requeued=requeued.extend).beat()
+
+    assert requeued == ["a1"]
+    assert r.exists(dead.processing_key) == 0
+    assert r.zrange(HEARTBEATS_KEY, 0, -1) == ["worker-2"]
+    # The interrupted job runs next, ahead of the ones that never started
+    assert [alive.pop(), alive.pop(), alive.pop()] == ["a1", "a2", "a3"]
+    assert alive.pop() is None
+
+
+def test_legacy_jobs_are_adopted_under_their_host():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    first = FairQueue(r, worker_id="worker-1")
+    second = FairQueue(r, worker_id="worker-2")
+    r.rpush(LEGACY_QUEUE, "old-a", "gone", "old-b")
+    jobs = {"old-a": ("https://a.example.com/1.m3u8", None), "old-b": ("https://b.example.com/1.m3u8", "high")}
+
+    # worker-2 adopts everything while worker-1 is still looking up its first entry:
+    # worker-1 then finds nothing left to move, and no job is queued twice
+    raced = []
+
+    def _lookup_while_racing(job_id):
+        if not raced:
+            raced.append(second.adopt_legacy(jobs.get))
+        return jobs.get(job_id)
+
+    assert first.adopt_legacy(_lookup_while_racing) == 0
+    assert raced == [2]
+    assert r.llen(LEGACY_QUEUE) == 0
+
+    assert r.lrange("fair_queue:normal:a.example.com", 0, -1) == ["old-a"]
+    assert second.pop() == "old-b"
+    assert r.hgetall(second.processing_key) == {"old-b": "high b.example.com"}
+
+
+def test_live_owner_keeps_a_requeued_job_and_a_takeover_is_reported():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    slow = FairQueue(r, worker_id="worker-1")
+    other = FairQueue(r, worker_id="worker-2")
+    slow.push("a1", "https://a.example.com/1.m3u8")
+    slow.heartbeat()
+    assert slow.pop() == "a1"
+    assert slow.claim("a1", timeout=15) is None
+
+    # The reaper requeued it during a pause, but worker-1 heartbeats again before worker-2 starts it
+    slow.requeue_worker("worker-1")
+    slow.heartbeat()
+    assert other.pop() == "a1"
+    assert other.claim("a1", timeout=15) == "worker-1"
+    other.done("a1")
+    # Still tracked as worker-1's, so it is requeued if worker-1 does die
+    assert r.hgetall(slow.processing_key) == {"a1": "normal a.example.com"}
+    assert r.get(OWNER_PREFIX + "a1") == "worker-1"
+    assert slow.lost_jobs() == []
+
+    # worker-1 really goes silent: worker-2 takes the job and worker-1 learns it lost it
+    r.zadd(HEARTBEATS_KEY, {"worker-1": time.time() - 60})
+    lost = []
+    QueueHeartbeat(other, interval=1, timeout=15).beat()
+    assert other.pop() == "a1"
+    assert other.claim("a1", timeout=15) is None
+    QueueHeartbeat(slow, interval=1, timeout=15, on_lost=lost.extend).beat()
+    assert lost == ["a1"]
+    assert slow.taken_over("a1")
+
+    # worker-1's copy finishing doesn't release worker-2's claim
+    slow.done("a1")
+    assert r.get(OWNER_PREFIX + "a1") == "worker-2"
+    other.done("a1")
+    assert r.exists(OWNER_PREFIX + "a1") == 0
+
+
+def test_retries_wait_for_their_backoff():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    queue = FairQueue(r)
+    queue.schedule_retry("soon", "https://a.example.com/1.m3u8", "high", delay=-1)
+    queue.schedule_retry("later", "https://a.example.com/2.m3u8", None, delay=300)
+
+    assert queue.pop() is None
+    assert queue.promote_due() == 1
+    assert queue.pop() == "soon"
+    assert queue.pop() is None
+    assert r.zrange(RETRY_KEY, 0, -1) == ["later normal a.example.com"]
+
+
+def test_job_that_cannot_start_is_deferred_not_dropped():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    queue = FairQueue(r)
+    queue.push("a1", "https://a.example.com/1.m3u8", priority="high")
+    assert queue.pop() == "a1"
+
+    # e.g. its row couldn't be read (schema not upgraded yet)
+    assert queue.defer("a1", delay=-1)
+    queue.done("a1")
+    assert r.hlen(queue.processing_key) == 0
+    assert r.zrange(RETRY_KEY, 0, -1) == ["a1 high a.example.com"]
+    assert queue.promote_due() == 1
+    assert queue.pop() == "a1"
+    assert not queue.defer("unknown", delay=10)
+
+
+def test_retry_delay_grows_and_is_capped():
+    for attempt, full in ((1, 10), (2, 20), (3, 40), (10, 600)):
+        delays = [retry_delay(attempt, base=10, cap=600) for _ in range(50)]
+        assert all(full / 2 <= d <= full for d in delays)
+
+
+def test_api_enqueues_with_the_same_script_and_keys():
+    # The API and worker images are built separately, so api/main.py carries its own copy
+    api_main = Path(__file__).resolve().parents[2] / "api" / "main.py"
+    if not api_main.exists():
+        pytest.skip("api/main.py is not part of this checkout")
+    constants = {}
+    for node in ast.parse(api_main.read_text(encoding="utf-8")).body:
+        if isinstance(node, ast.Assign):
+            try:
+                value = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    constants[target.id] = value
+
+    assert constants["FAIR_ENQUEUE_SCRIPT"] == fair_queue.ENQUEUE_SCRIPT
+    assert constants["JOB_PRIORITIES"] == fair_queue.PRIORITIES
+    assert constants["FAIR_QUEUE_PREFIX"] == fair_queue.KEY_PREFIX
+    assert constants["FAIR_QUEUE_TURN_KEY"] == fair_queue.TURN_KEY
+    assert constants["FAIR_QUEUE_WAKEUP_KEY"] == WAKEUP_KEY
+    assert constants["FAIR_QUEUE_WAKEUP_BACKLOG"] == WAKEUP_BACKLOG
+    assert constants["FAIR_QUEUE_RETRY_KEY"] == RETRY_KEY
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import threading
+import time
 from pathlib import Path
 
 import ffmpeg_wrapper
-from ffmpeg_wrapper import FFmpegMerger, merge_segments
+from ffmpeg_wrapper import FFmpegMerger, FFmpegStreamMerger, merge_segments
 
 
 def test_create_concat_file_escapes_single_quotes(tmp_path, monkeypatch):
@@ -35,19 +37,177 @@ def test_merge_segments_cleans_up_concat_file(tmp_path, monkeypatch):
 
     output = tmp_path / "out.mp4"
 
-    def _fake_run(command, stdout=None, stderr=None, text=None, timeout=None):
-        # Simulate ffmpeg success by writing a non-empty output file.
-        Path(command[-1]).write_bytes(b"mp4")
+    class _FakeMergePopen:
+        def __init__(self, command, stdout=None, stderr=None, text=None):
+            self.returncode = None
+            # Simulate ffmpeg success by writing a non-empty output file.
+            Path(command[-1]).write_bytes(b"mp4")
 
-        class _P:
-            returncode = 0
-            stderr = ""
+        def communicate(self, timeout=None):
+            self.returncode = 0
+            return "", ""
 
-        return _P()
-
-    monkeypatch.setattr(ffmpeg_wrapper.subprocess, "run", _fake_run)
+    monkeypatch.setattr(ffmpeg_wrapper.subprocess, "Popen", _FakeMergePopen)
 
     ok = merge_segments([str(seg1), str(seg2)], str(output), concat_dir=str(tmp_path), try_re_encode=False)
     assert ok is True
     assert output.exists() and output.stat().st_size > 0
-    assert not (tmp_path / "concat_list.txt").exists()
+    assert not list(tmp_path.glob("concat_list*.txt"))
+
+
+class _FakeStdin:
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class _FakePopen:
+    def __init__(self, command, stdin=None, stdout=None, stderr=None):
+        import io
+
+        self.command = command
+        self.stdin = _FakeStdin()
+        self.stderr = io.BytesIO(b"")
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        # Simulate ffmpeg writing everything it read from stdin to the output file.
+        Path(self.command[-1]).write_bytes(b"".join(self.stdin.chunks))
+        self.returncode = 0
+        return 0
+
+    def kill(self):
+        self.returncode = -9
+
+
+def _stream_merger(tmp_path, monkeypatch, total, max_buffered=64):
+    monkeypatch.setattr(ffmpeg_wrapper.shutil, "which", lambda name: "ffmpeg" if name == "ffmpeg" else None)
+    monkeypatch.setattr(ffmpeg_wrapper.subprocess, "Popen", _FakePopen)
+    merger = FFmpegStreamMerger(
+        output_file=str(tmp_path / "out.mp4"),
+        total_segments=total,
+        max_buffered=max_buffered,
+        spill_dir=str(tmp_path),
+    )
+    merger.start()
+    return merger
+
+
+def test_stream_merger_writes_out_of_order_segments_in_index_order(tmp_path, monkeypatch):
+    merger = _stream_merger(tmp_path, monkeypatch, total=4)
+
+    merger.submit(2, b"C")
+    merger.submit(1, b"B")
+    assert merger.process.stdin.chunks == []
+    merger.submit(0, b"A")
+    merger.skip(3)
+
+    assert merger.finish() is True
+    assert (tmp_path / "out.mp4").read_bytes() == b"ABC"
+    assert not (tmp_path / "out.mp4.part").exists()
+    assert merger.skipped_segments == 1
+    assert "pipe:0" in merger.process.command
+
+
+def test_stream_merger_spills_when_reorder_buffer_is_full(tmp_path, monkeypatch):
+    merger = _stream_merger(tmp_path, monkeypatch, total=4, max_buffered=1)
+
+    merger.submit(1, b"B")
+    merger.submit(2, b"C")  # buffer full -> spilled to disk
+    assert (tmp_path / "spill_00002.ts").exists()
+
+    merger.submit(3, b"D")
+    merger.submit(0, b"A")
+
+    assert merger.finish() is True
+    assert (tmp_path / "out.mp4").read_bytes() == b"ABCD"
+    assert not list(tmp_path.glob("spill_*.ts"))
+
+
+def test_stream_merger_fails_when_segments_never_arrive(tmp_path, monkeypatch):
+    merger = _stream_merger(tmp_path, monkeypatch, total=3)
+    merger.submit(0, b"A")
+
+    assert merger.finish() is False
+    assert not (tmp_path / "out.mp4").exists()
+    assert not (tmp_path / "out.mp4.part").exists()
+
+
+def test_concat_files_are_unique_per_merger(tmp_path, monkeypatch):
+    monkeypatch.setattr(ffmpeg_wrapper.shutil, "which", lambda name: "ffmpeg" if name == "ffmpeg" else None)
+
+    # Two jobs merging into the same folder must not share a concat list
+    a = FFmpegMerger(segment_files=["a.ts"], output_file=str(tmp_path / "a.mp4"))
+    b = FFmpegMerger(segment_files=["b.ts"], output_file=str(tmp_path / "b.mp4"))
+    assert a.concat_file != b.concat_file
+    assert a.concat_file.parent == b.concat_file.parent == tmp_path
+
+
+def test_merge_is_killed_when_stop_event_is_set(tmp_path, monkeypatch):
+    import subprocess
+
+    monkeypatch.setattr(ffmpeg_wrapper.shutil, "which", lambda name: "ffmpeg" if name == "ffmpeg" else None)
+    seg = tmp_path / "segment_00000.ts"
+    seg.write_bytes(b"a")
+    output = tmp_path / "out.mp4"
+    procs = []
+
+    class _HangingPopen:
+        """FFmpeg that never finishes on its own (e.g. a slow re-encode)"""
+
+        def __init__(self, command, stdout=None, stderr=None, text=None):
+            self.command = command
+            self.returncode = None
+            Path(command[-1]).write_bytes(b"partial")
+            procs.append(self)
+
+        def communicate(self, timeout=None):
+            if self.returncode is None:
+                raise subprocess.TimeoutExpired(self.command, timeout)
+            return "", ""
+
+        def kill(self):
+            self.returncode = -9
+
+    monkeypatch.setattr(ffmpeg_wrapper.subprocess, "Popen", _HangingPopen)
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+
+    ok = merge_segments([str(seg)], str(output), concat_dir=str(tmp_path), stop_event=stop)
+
+    assert ok is False
+    assert len(procs) == 1  # no re-encode attempt after a cancel
+    assert procs[0].returncode == -9
+    assert not output.exists()
+
+
+def test_stream_merger_submit_does_not_wait_for_a_slow_pipe(tmp_path, monkeypatch):
+    merger = _stream_merger(tmp_path, monkeypatch, total=2)
+    release = threading.Event()
+    write = merger.process.stdin.write
+
+    def _slow_write(data):
+        release.wait(5)
+        return write(data)
+
+    merger.process.stdin.write = _slow_write
+    started = time.monotonic()
+    merger.submit(0, b"A")
+    merger.submit(1, b"B")
+    # Both calls returned while the writer thread is still stuck on segment 0
+    assert time.monotonic() - started < 1
+    assert merger.process.stdin.chunks == []
+
+    release.set()
+    assert merger.finish() is True
+    assert (tmp_path / "out.mp4").read_bytes() == b"AB"
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from downloader import SegmentDownloader, TS_PACKET_SIZE, TS_SYNC_BYTE
+from host_semaphore import CONFIG_KEY, HostSemaphore
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def test_cap_is_shared_between_workers_and_released():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    w1 = HostSemaphore(r, worker_id="w1", limit=2)
+    w2 = HostSemaphore(r, worker_id="w2", limit=2)
+
+    first = w1.try_acquire("cdn.example.com")
+    second = w2.try_acquire("cdn.example.com")
+    assert first and second
+    assert w1.try_acquire("cdn.example.com") is None
+    assert w2.try_acquire("other.example.com")
+
+    w1.release("cdn.example.com", first)
+    assert w2.try_acquire("cdn.example.com")
+
+
+def test_dead_workers_leases_expire_and_overrides_apply():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    r.hset(CONFIG_KEY, mapping={"default": 0, "host:cdn.example.com": 1})
+    dead = HostSemaphore(r, worker_id="dead", lease_seconds=1)
+    alive = HostSemaphore(r, worker_id="alive", lease_seconds=1)
+
+    # No cap for hosts without an override
+    assert alive.try_acquire("free.example.com") == ""
+
+    # A lease that is never released or renewed (its worker died) frees the slot on its own
+    r.zadd("host_slots:cdn.example.com", {"dead:1": time.time() - 1})
+    assert dead.limit_for("cdn.example.com") == 1
+    assert alive.acquire("cdn.example.com", threading.Event())
+
+
+def test_acquire_gives_up_when_stopped():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    semaphore = HostSemaphore(r, worker_id="w1", limit=1)
+    assert semaphore.try_acquire("cdn.example.com")
+
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+    assert semaphore.acquire("cdn.example.com", stop) is None
+
+
+def test_downloader_holds_a_lease_per_request(tmp_path):
+    r = fakeredis.FakeRedis(decode_responses=True)
+    semaphore = HostSemaphore(r, worker_id="w1", limit=2)
+    peak = []
+    lock = threading.Lock()
+
+    class _Response:
+        status_code = 200
+        headers = {}
+        content = (TS_SYNC_BYTE + bytes(TS_PACKET_SIZE - 1)) * 3
+
+        def raise_for_status(self):
+            pass
+
+    class _Session:
+        def get(self, *args, **kwargs):
+            with lock:
+                peak.append(r.zcard("host_slots:cdn.example.com"))
+            time.sleep(0.05)
+            return _Response()
+
+    segments = [{"url": f"https://cdn.example.com/seg{i}.ts", "index": i, "sequence": i, "key": None} for i in range(8)]
+    d = SegmentDownloader(
+        segments=segments, output_dir=str(tmp_path), session=_Session(), max_workers=6, host_slots=semaphore
+    )
+    files = d.download_all()
+
+    assert len([f for f in files if f]) == 8
+    assert 1 <= max(peak) <= 2
+    assert r.zcard("host_slots:cdn.example.com") == 0
+    assert semaphore.held() == 0
+
+
+def test_restarted_worker_does_not_reuse_its_previous_leases():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    before = HostSemaphore(r, worker_id="w1", limit=2)
+    orphan = before.try_acquire("cdn.example.com")
+
+    # Same WORKER_ID (hostname) after a restart: its first lease must not alias the orphan
+    after = HostSemaphore(r, worker_id="w1", limit=2)
+    lease = after.try_acquire("cdn.example.com")
+    assert lease != orphan
+    after.release("cdn.example.com", lease)
+    assert r.zrange("host_slots:cdn.example.com", 0, -1) == [orphan]
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from concurrency import FetchBudget
+from downloader import SegmentDownloader
+from job_scheduler import JobScheduler
+
+
+class _Queue:
+    """blpop over a fixed list of job ids"""
+
+    def __init__(self, job_ids):
+        self.items = list(job_ids)
+        self.lock = threading.Lock()
+
+    def blpop(self, keys, timeout=0):
+        with self.lock:
+            if self.items:
+                return keys[-1], self.items.pop(0)
+        time.sleep(0.01)
+        return None
+
+
+def test_scheduler_runs_jobs_in_parallel_up_to_the_limit():
+    stats = {"running": 0, "peak": 0}
+    finished = []
+    lock = threading.Lock()
+
+    def _run_job(job_id):
+        with lock:
+            stats["running"] += 1
+            stats["peak"] = max(stats["peak"], stats["running"])
+        time.sleep(0.05)
+        with lock:
+            stats["running"] -= 1
+            finished.append(job_id)
+
+    queue = _Queue([f"job-{i}" for i in range(7)])
+    scheduler = JobScheduler(queue, _run_job, max_jobs=3, poll_timeout=0)
+    scheduler.run(lambda: len(finished) + len(scheduler.active_jobs) == 7 and not queue.items)
+
+    assert sorted(finished) == sorted(f"job-{i}" for i in range(7))
+    assert stats["peak"] == 3
+
+
+def test_scheduler_leaves_jobs_queued_while_slots_are_busy():
+    release = threading.Event()
+    started = []
+
+    def _run_job(job_id):
+        started.append(job_id)
+        release.wait(5)
+
+    queue = _Queue(["a", "b", "c"])
+    scheduler = JobScheduler(queue, _run_job, max_jobs=1, poll_timeout=0)
+    stop = threading.Event()
+    runner = threading.Thread(target=scheduler.run, args=(stop.is_set,))
+    runner.start()
+    time.sleep(0.2)
+
+    # Only one job was taken; the others are still in Redis for other workers
+    assert started == ["a"]
+    assert queue.items == ["b", "c"]
+
+    stop.set()
+    release.set()
+    runner.join(5)
+    assert not runner.is_alive()
+    assert started == ["a"]
+
+
+def test_fetch_budget_bounds_requests_across_downloaders(tmp_path):
+    budget = FetchBudget(3)
+    stats = {"in_flight": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class _Session:
+        def get(self, url, headers=None, timeout=None, stream=False):
+            with lock:
+                stats["in_flight"] += 1
+                stats["peak"] = max(stats["peak"], stats["in_flight"])
+            time.sleep(0.02)
+            with lock:
+                stats["in_flight"] -= 1
+            return type("Response", (), {"status_code": 200, "content": b"x"})()
+
+    # Two "jobs" with 4 fetch threads each, one shared budget of 3
+    downloaders = [
+        SegmentDownloader(segments=[], output_dir=str(tmp_path), session=_Session(), fetch_budget=budget)
+        for _ in range(2)
+    ]
+    threads = [
+        threading.Thread(target=lambda d=d: [d._http_get(f"https://cdn.example.com/{i}.ts", {}) for i in range(5)])
+        for d in downloaders for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert stats["peak"] == 3
+    assert budget.in_flight == 0
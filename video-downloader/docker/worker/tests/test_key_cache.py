@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from downloader import SegmentDownloader
+from key_cache import KeyCache, distinct_key_uris
+
+KEY = bytes(range(16))
+
+
+def test_concurrent_callers_share_one_fetch():
+    cache = KeyCache()
+    calls = []
+    barrier = threading.Barrier(10)
+    results = []
+
+    def _fetch(uri):
+        calls.append(uri)
+        time.sleep(0.1)
+        return KEY
+
+    def _caller():
+        barrier.wait()
+        results.append(cache.get("https://k.example.com/key1", _fetch))
+
+    threads = [threading.Thread(target=_caller) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == ["https://k.example.com/key1"]
+    assert results == [KEY] * 10
+
+
+def test_failed_fetch_is_not_cached():
+    cache = KeyCache()
+
+    def _broken(uri):
+        raise IOError("key server down")
+
+    with pytest.raises(IOError):
+        cache.get("https://k.example.com/key", _broken)
+    with pytest.raises(ValueError, match="key length"):
+        cache.get("https://k.example.com/key", lambda uri: b"<html>")
+    assert cache.get("https://k.example.com/key", lambda uri: KEY) == KEY
+
+
+def test_keys_are_shared_between_workers_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    first = KeyCache(fakeredis.FakeRedis(server=server, decode_responses=True), ttl=60)
+    second = KeyCache(fakeredis.FakeRedis(server=server, decode_responses=True), ttl=60)
+
+    first.get("https://k.example.com/key", lambda uri: KEY)
+
+    def _should_not_fetch(uri):
+        raise AssertionError("key should come from Redis")
+
+    assert second.get("https://k.example.com/key", _should_not_fetch) == KEY
+
+
+def test_downloader_prefetches_each_distinct_key_once(tmp_path, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(SegmentDownloader, "_fetch_key", lambda self, uri: fetched.append(uri) or KEY)
+    segments = [
+        {"url": f"https://cdn.example.com/{i}.ts", "index": i, "sequence": i,
+         "key": {"method": "AES-128", "uri": f"https://k.example.com/key{i // 4}", "iv": None}}
+        for i in range(12)
+    ]
+    assert distinct_key_uris(segments) == [f"https://k.example.com/key{n}" for n in range(3)]
+
+    d = SegmentDownloader(segments=segments, output_dir=str(tmp_path), session=object())
+    d.prefetch_keys()
+    d.prefetch_keys()
+
+    assert sorted(fetched) == [f"https://k.example.com/key{n}" for n in range(3)]
+    assert d._get_key_bytes("https://k.example.com/key1") == KEY
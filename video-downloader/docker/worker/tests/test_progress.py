@@ -0,0 +1,101 @@
+import json
+import time
+
+import pytest
+
+from progress import (
+    CANCEL_KEY_PREFIX, JOB_EVENTS_CHANNEL, JOB_VERSION_PREFIX, JOBS_LIVE_VERSION_KEY, JOBS_VERSION_KEY,
+    PROGRESS_KEY_PREFIX,
+    JobProgressTracker, publish_job_event, publish_progress,
+)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_per_segment_updates_stay_in_memory_between_flushes():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    persisted = []
+    tracker = JobProgressTracker(
+        r, "job-1",
+        persist=lambda status, progress: persisted.append(progress),
+        check_db_cancelled=lambda: pytest.fail("database polled on the fast path"),
+        publish_interval=60, persist_interval=60,
+    )
+
+    started = time.perf_counter()
+    for done in range(1, 5001):
+        tracker.update("downloading", int(5 + done / 5000 * 80), segments_done=done, segments_total=5000)
+        assert not tracker.cancelled()
+    per_segment = (time.perf_counter() - started) / 5000
+
+    # Only the first update reached Redis; Postgres was not written at all
+    assert r.hget(PROGRESS_KEY_PREFIX + "job-1", "progress") == "5"
+    assert persisted == []
+    assert per_segment < 100e-6
+
+    tracker.flush()
+    assert r.hgetall(PROGRESS_KEY_PREFIX + "job-1")["segments_done"] == "5000"
+    assert persisted == [85]
+
+
+def test_cancel_flag_in_redis_is_seen_without_the_database():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    tracker = JobProgressTracker(
+        r, "job-2", persist=lambda *a: None, check_db_cancelled=lambda: False, cancel_check_interval=0,
+    )
+    assert not tracker.cancelled()
+    r.set(CANCEL_KEY_PREFIX + "job-2", "1")
+    assert tracker.cancelled()
+
+
+def test_database_is_polled_when_redis_is_down():
+    class _DownRedis:
+        def exists(self, key):
+            raise ConnectionError("redis down")
+
+    polls = []
+    tracker = JobProgressTracker(
+        _DownRedis(), "job-3", persist=lambda *a: None,
+        check_db_cancelled=lambda: polls.append(1) or len(polls) > 1,
+        cancel_check_interval=0,
+    )
+    assert not tracker.cancelled()
+    assert tracker.cancelled()
+    assert len(polls) == 2
+
+
+def test_published_progress_is_broadcast_to_stream_clients():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(JOB_EVENTS_CHANNEL)
+
+    publish_progress(r, "job-1", "downloading", 42, segments_done=10, segments_total=20, file_path=None)
+
+    message = None
+    deadline = time.monotonic() + 5
+    while message is None and time.monotonic() < deadline:
+        message = pubsub.get_message(timeout=0.1)
+    event = json.loads(message["data"])
+    assert event["id"] == "job-1"
+    assert (event["status"], event["progress"], event["segments_done"]) == ("downloading", 42, 10)
+    assert "file_path" not in event
+
+
+def test_job_changes_bump_the_etag_version():
+    r = fakeredis.FakeRedis(decode_responses=True)
+
+    publish_job_event(r, "job-1", status="pending")
+    seeded = int(r.get(JOBS_VERSION_KEY))
+    # A fresh counter starts at the wall clock, not 1, so old ETags can't match again
+    assert seeded > time.time() * 1000 - 60_000
+
+    publish_progress(r, "job-1", "downloading", 10)
+    assert int(r.get(JOBS_VERSION_KEY)) == seeded + 1
+
+    # Progress only kept in Redis leaves the stored-state version alone
+    job_version = int(r.get(JOB_VERSION_PREFIX + "job-1"))
+    publish_progress(r, "job-1", "downloading", 11, live=True)
+    assert int(r.get(JOBS_VERSION_KEY)) == seeded + 1
+    assert int(r.get(JOB_VERSION_PREFIX + "job-1")) == job_version + 1
+    assert r.get(JOBS_LIVE_VERSION_KEY) is not None
+    assert r.get(JOB_VERSION_PREFIX + "job-2") is None
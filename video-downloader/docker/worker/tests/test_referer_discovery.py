@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from downloader import SegmentDownloader, TS_PACKET_SIZE, TS_SYNC_BYTE
+from strategy_cache import RefererStrategyCache
+
+
+def _ts_payload() -> bytes:
+    data = bytearray(TS_PACKET_SIZE * 3)
+    for i in range(3):
+        data[i * TS_PACKET_SIZE] = TS_SYNC_BYTE[0]
+    return bytes(data)
+
+
+def _segments(count):
+    return [{"url": f"https://cdn.example.com/v/{i}.ts", "index": i, "sequence": i, "key": None} for i in range(count)]
+
+
+@pytest.fixture
+def cdn(monkeypatch):
+    """CDN that only accepts its own origin as Referer; records (index, referer) per request"""
+    requests = []
+    lock = threading.Lock()
+
+    def _fetch(self, url, headers, index, probe=False):
+        with lock:
+            requests.append((index, headers.get("Referer")))
+        return _ts_payload() if headers.get("Referer") == "https://cdn.example.com/" else None
+
+    monkeypatch.setattr(SegmentDownloader, "_try_download_with_headers", _fetch)
+    return requests
+
+
+def _downloader(tmp_path, name, **kwargs):
+    return SegmentDownloader(
+        segments=_segments(20), output_dir=str(tmp_path / name), session=object(), max_workers=8,
+        headers={"Referer": "https://page.example.org/watch"}, **kwargs,
+    )
+
+
+def test_discovery_finds_strategy_before_fan_out(tmp_path, cdn):
+    d = _downloader(tmp_path, "a")
+    files = d.download_all()
+
+    assert len(files) == 20
+    assert d.working_referer_strategy["name"] == "segment_domain"
+    # One rejected probe, then every segment fetched once with the right headers
+    assert len(cdn) == 21
+    assert [index for index, referer in cdn if referer != "https://cdn.example.com/"] == [0]
+
+
+def test_discovery_probes_middle_and_last_segments(tmp_path, cdn):
+    d = _downloader(tmp_path, "a", discovery_probes=3)
+    d.download_all()
+    probed = [index for index, _ in cdn[:4]]
+    assert probed == [0, 0, 10, 19]
+
+
+def test_cached_strategy_skips_discovery_for_later_jobs(tmp_path, cdn):
+    fakeredis = pytest.importorskip("fakeredis")
+    cache = RefererStrategyCache(fakeredis.FakeRedis(decode_responses=True), ttl=60)
+
+    _downloader(tmp_path, "first", referer_cache=cache).download_all()
+    assert cache.get("cdn.example.com") == "segment_domain"
+    cdn.clear()
+
+    second = _downloader(tmp_path, "second", referer_cache=cache)
+    assert len(second.download_all()) == 20
+    assert len(cdn) == 20
+
+
+class _ReadTimeout(OSError):
+    pass
+
+
+def test_transient_probe_error_does_not_cache_a_wrong_strategy(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    cache = RefererStrategyCache(fakeredis.FakeRedis(decode_responses=True), ttl=60)
+    calls = []
+
+    class _Response:
+        cookies = {}
+        headers = {}
+
+        def __init__(self, status):
+            self.status_code = status
+            self.content = _ts_payload()
+
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise RuntimeError(f"{self.status_code} Error")
+
+    def _http_get(self, url, headers):
+        calls.append(headers.get("Referer"))
+        if len(calls) == 1:
+            # The very first probe (source page Referer, which is the right one) times out
+            raise _ReadTimeout("Read timed out")
+        # Source page or no Referer are both accepted; the CDN's own origin is not
+        return _Response(474 if headers.get("Referer") == "https://cdn.example.com/" else 200)
+
+    monkeypatch.setattr(SegmentDownloader, "_http_get", _http_get)
+    d = _downloader(tmp_path, "a", referer_cache=cache)
+
+    assert len(d.download_all()) == 20
+    # Discovery stopped on the timeout instead of walking on to (and caching) no_referer
+    assert d.working_referer_strategy["name"] == "source_page"
+    assert cache.get("cdn.example.com") == "source_page"
@@ -0,0 +1,110 @@
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import downloader
+from downloader import SegmentDownloader, retry_delay
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, headers):
+        super().__init__(f"{status} Error")
+        self.response = type("Response", (), {"status_code": status, "headers": headers})()
+
+
+def _segments(count):
+    return [{"url": f"https://cdn.example.com/seg{i}.ts", "index": i, "sequence": i, "key": None} for i in range(count)]
+
+
+def test_retry_delay_is_jittered_and_honors_retry_after():
+    delays = [retry_delay(2) for _ in range(50)]
+    assert all(2.0 <= d <= 4.0 for d in delays)
+    assert len(set(delays)) > 1
+
+    assert retry_delay(0, _HTTPError(429, {"Retry-After": "7"})) == 7.0
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=20), usegmt=True)
+    assert 15 < retry_delay(0, _HTTPError(503, {"Retry-After": future})) <= 20
+    assert retry_delay(0, _HTTPError(429, {"Retry-After": "86400"})) == downloader.RETRY_AFTER_MAX
+
+
+def test_backoff_does_not_hold_a_pool_thread(tmp_path, monkeypatch):
+    attempts = []
+    lock = threading.Lock()
+
+    def _attempt(self, segment, attempt=0):
+        with lock:
+            attempts.append((segment["index"], attempt))
+        if segment["index"] == 0 and attempt == 0:
+            raise _HTTPError(429, {"Retry-After": "0.3"})
+        return f"segment_{segment['index']}.ts"
+
+    monkeypatch.setattr(SegmentDownloader, "_attempt_segment", _attempt)
+    d = SegmentDownloader(segments=_segments(5), output_dir=str(tmp_path), session=object(), max_workers=1)
+    files = d.download_all()
+
+    # With a single pool thread, every other segment was fetched while segment 0 backed off
+    assert attempts[-1] == (0, 1)
+    assert len(files) == 5
+    assert d.failed_segments == []
+
+
+def test_repair_pass_refetches_stragglers(tmp_path, monkeypatch):
+    calls = {"n": 0}
+    monkeypatch.setattr(downloader, "retry_delay", lambda attempt, error=None: 0.0)
+
+    def _attempt(self, segment, attempt=0):
+        if segment["index"] == 2:
+            calls["n"] += 1
+            if calls["n"] <= self.max_retries + 1:
+                raise ValueError("Invalid TS format (no sync bytes found)")
+        return f"segment_{segment['index']}.ts"
+
+    monkeypatch.setattr(SegmentDownloader, "_attempt_segment", _attempt)
+    progress = []
+    d = SegmentDownloader(segments=_segments(4), output_dir=str(tmp_path), session=object(), max_retries=2)
+    files = d.download_all(lambda done, total: progress.append((done, total, len(d.failed_segments))))
+
+    assert calls["n"] == 4  # 3 scheduled attempts + 1 in the repair pass
+    assert len(files) == 4
+    assert d.failed_segments == []
+    # The exhausted segment counted as failed (for hotlink/403 heuristics) until repaired
+    assert any(failed == 1 for _, _, failed in progress)
+    assert progress[-1] == (4, 4, 0)
+
+
+def test_submission_window_stays_bounded_for_long_playlists(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats = {"outstanding": 0, "peak": 0, "submitted": 0}
+    lock = threading.Lock()
+
+    class _CountingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            with lock:
+                stats["outstanding"] += 1
+                stats["submitted"] += 1
+                stats["peak"] = max(stats["peak"], stats["outstanding"])
+            future = super().submit(fn, *args, **kwargs)
+            future.add_done_callback(lambda _: _done())
+            return future
+
+    def _done():
+        with lock:
+            stats["outstanding"] -= 1
+
+    monkeypatch.setattr(downloader, "ThreadPoolExecutor", _CountingExecutor)
+    monkeypatch.setattr(SegmentDownloader, "_attempt_segment", lambda self, segment, attempt=0: "x.ts")
+
+    def _cancel(done, total):
+        if done == 1500:
+            raise RuntimeError("Job cancelled by user")
+
+    d = SegmentDownloader(segments=_segments(5000), output_dir=str(tmp_path), session=object(), max_workers=4)
+    try:
+        d.download_all(_cancel)
+    except RuntimeError:
+        pass
+
+    assert stats["peak"] <= 4 * downloader.SUBMISSION_WINDOW_FACTOR
+    # Cancellation only had the window to unwind, not the rest of the playlist
+    assert stats["submitted"] < 1500 + 4 * downloader.SUBMISSION_WINDOW_FACTOR + 1
@@ -0,0 +1,114 @@
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from checkpoint import SegmentCheckpoint, segment_checksum
+from downloader import SegmentDownloader, TS_PACKET_SIZE, TS_SYNC_BYTE
+
+KEY = bytes.fromhex("00112233445566778899aabbccddeeff")
+
+
+def _ts_payload(tag: int, packet_count: int) -> bytes:
+    data = bytearray(TS_PACKET_SIZE * packet_count)
+    for i in range(packet_count):
+        data[i * TS_PACKET_SIZE] = TS_SYNC_BYTE[0]
+        data[i * TS_PACKET_SIZE + 1] = (tag + i) % 256
+    return bytes(data)
+
+
+class _StreamResponse:
+    def __init__(self, body: bytes, content_type: str = "video/mp2t", chunk: int = 1000):
+        self.status_code = 200
+        self.headers = {"Content-Type": content_type}
+        self.cookies = {}
+        self._body = body
+        self._chunk = chunk
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=None):
+        # Odd chunk size on purpose: never aligned to AES blocks or TS packets
+        for i in range(0, len(self._body), self._chunk):
+            yield self._body[i:i + self._chunk]
+
+    @property
+    def content(self):
+        raise AssertionError("streaming path must not buffer response.content")
+
+    def close(self):
+        self.closed = True
+
+
+class _KeyResponse:
+    status_code = 200
+    content = KEY
+
+    def raise_for_status(self):
+        pass
+
+
+class _Session:
+    def __init__(self, bodies, content_type="video/mp2t"):
+        self.bodies = bodies
+        self.content_type = content_type
+        self.responses = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        if url.endswith("/key"):
+            return _KeyResponse()
+        assert stream, "segment bodies should be requested with stream=True"
+        resp = _StreamResponse(self.bodies[url], content_type=self.content_type)
+        self.responses.append(resp)
+        return resp
+
+
+def test_streamed_encrypted_segment_is_decrypted_chunk_by_chunk(tmp_path):
+    plain = _ts_payload(3, packet_count=500)  # ~94 KB, spans many chunks
+    url = "https://cdn.example.com/enc/7.ts"
+    cipher = AES.new(KEY, AES.MODE_CBC, (107).to_bytes(16, "big"))
+    session = _Session({url: cipher.encrypt(pad(plain, AES.block_size))})
+    segments = [{"url": url, "index": 0, "sequence": 107, "key": {"method": "AES-128", "uri": "https://cdn.example.com/key", "iv": None}}]
+    cp = SegmentCheckpoint.for_job("job-s", segments, root=str(tmp_path))
+
+    d = SegmentDownloader(segments=segments, output_dir=str(cp.staging_dir), session=session,
+                          checkpoint=cp, stream_bodies=True)
+    path = d.download_segment(segments[0])
+
+    assert path == str(cp.staging_dir / "segment_00000.ts")
+    assert (cp.staging_dir / "segment_00000.ts").read_bytes() == plain
+    assert cp.completed_path(0) == path
+    assert cp._entries[0]["crc32"] == segment_checksum(plain)
+    assert d.downloaded_bytes == len(plain)
+    assert all(r.closed for r in session.responses)
+
+
+def test_streamed_block_page_is_rejected_without_leaving_files(tmp_path):
+    url = "https://cdn.example.com/seg/0.ts"
+    session = _Session({url: b"<html><body>Access denied</body></html>" + b" " * 2000}, content_type="text/html")
+    segments = [{"url": url, "index": 0, "sequence": 0, "key": None}]
+
+    d = SegmentDownloader(segments=segments, output_dir=str(tmp_path), session=session,
+                          max_retries=0, stream_bodies=True)
+    assert d.download_segment(segments[0]) is None
+
+    assert len(d.failed_segments) == 1
+    assert "text/html" in d.failed_segments[0]["error"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_streamed_segment_with_wrong_key_fails_validation_once(tmp_path):
+    plain = _ts_payload(0, packet_count=50)
+    url = "https://cdn.example.com/enc/0.ts"
+    cipher = AES.new(bytes(16), AES.MODE_CBC, bytes(16))  # not the key the playlist points to
+    session = _Session({url: cipher.encrypt(pad(plain, AES.block_size))})
+    segments = [{"url": url, "index": 0, "sequence": 0, "key": {"method": "AES-128", "uri": "https://cdn.example.com/key", "iv": None}}]
+
+    d = SegmentDownloader(segments=segments, output_dir=str(tmp_path), session=session,
+                          max_retries=0, stream_bodies=True)
+    assert d.download_segment(segments[0]) is None
+
+    # A content error is not a Referer problem: other strategies are not tried
+    assert len(session.responses) == 1
+    assert "decryption" in d.failed_segments[0]["error"]
+    assert not list(tmp_path.glob("segment_*"))
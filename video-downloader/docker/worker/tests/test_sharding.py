@@ -0,0 +1,120 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from checkpoint import SegmentCheckpoint, playlist_fingerprint, segment_checksum
+from sharding import (
+    SHARD_QUEUE,
+    ShardBoard,
+    ShardedDownload,
+    decode_segments,
+    encode_segments,
+    plan_shards,
+    run_claimed_shard,
+)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _segments(count):
+    return [{"url": f"https://cdn.example.com/seg{i}.ts", "index": i, "sequence": i, "key": None} for i in range(count)]
+
+
+def _fake_runner(worker, seen, delay=0.0):
+    """Writes one-byte segment files and checkpoints them like SegmentDownloader does"""
+    def run(spec, segments, output_dir, progress_callback=None):
+        checkpoint = SegmentCheckpoint(output_dir, playlist_fingerprint(segments))
+        files = []
+        for i, segment in enumerate(segments):
+            path = Path(output_dir) / f"segment_{segment['index']:05d}.ts"
+            path.write_bytes(b"x")
+            checkpoint.record(segment['index'], str(path), 1, segment_checksum(b"x"))
+            files.append(str(path))
+            if progress_callback:
+                progress_callback(i + 1, len(segments))
+            time.sleep(delay)
+        seen.append((worker, segments[0]['index']))
+        return files, []
+    return run
+
+
+def test_plan_and_segment_encoding_round_trip():
+    assert plan_shards(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    segments = [{"url": "u", "index": 0, "sequence": 5, "key": {"method": "AES-128", "uri": "k", "iv": b"\x01" * 16}}]
+    assert decode_segments(encode_segments(segments)) == segments
+
+
+def test_idle_worker_claims_shards_and_coordinator_merges_in_order(tmp_path):
+    r = fakeredis.FakeRedis(decode_responses=True)
+    seen = []
+    segments = _segments(40)
+    board = ShardBoard(r, "job-1")
+    download = ShardedDownload(
+        board, segments, spec={"m3u8_url": "m", "headers": {}, "staging_dir": str(tmp_path)},
+        run_shard=_fake_runner("coordinator", seen, delay=0.01), worker_id="coordinator", shard_size=10,
+    )
+
+    def _helper():
+        # Another container: pop announcements from SHARD_QUEUE and work on them
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            item = r.blpop([SHARD_QUEUE], timeout=1)
+            if item:
+                run_claimed_shard(ShardBoard(r, item[1]), "helper", _fake_runner("helper", seen, delay=0.01))
+            elif not r.exists(board.spec_key) and seen:
+                return
+
+    helper = threading.Thread(target=_helper)
+    helper.start()
+    progress = []
+    files = download.download_all(lambda done, total: progress.append((done, total)))
+    helper.join(10)
+
+    assert [Path(f).name for f in files] == [f"segment_{i:05d}.ts" for i in range(40)]
+    assert {worker for worker, _ in seen} == {"coordinator", "helper"}
+    assert sorted(start for _, start in seen) == [0, 10, 20, 30]
+    assert download.failed_segments == []
+    assert progress and progress[-1][1] == 40
+    # Shard state is dropped once the coordinator is done
+    assert not r.keys("shard:job-1:*")
+    assert r.llen(SHARD_QUEUE) == 0
+
+
+def test_shard_of_a_dead_worker_is_requeued(tmp_path, monkeypatch):
+    import sharding
+
+    monkeypatch.setattr(sharding, "POLL_INTERVAL", 0.05)
+    r = fakeredis.FakeRedis(decode_responses=True)
+    seen = []
+    segments = _segments(20)
+    board = ShardBoard(r, "job-2")
+    download = ShardedDownload(
+        board, segments, spec={"m3u8_url": "m", "headers": {}, "staging_dir": str(tmp_path)},
+        run_shard=_fake_runner("coordinator", seen), worker_id="coordinator", shard_size=10, claim_timeout=0.3,
+    )
+
+    original_publish = board.publish
+
+    def _publish_and_lose_one(spec, shard_count):
+        original_publish(spec, shard_count)
+        # A worker claims shard 0 and dies before its first heartbeat
+        r.lmove(board.pending_key, board.claimed_key, "LEFT", "RIGHT")
+
+    monkeypatch.setattr(board, "publish", _publish_and_lose_one)
+    files = download.download_all()
+
+    assert len(files) == 20
+    assert sorted(start for _, start in seen) == [0, 10]
+
+
+def test_segment_downloader_accepts_a_playlist_slice(tmp_path, monkeypatch):
+    from downloader import SegmentDownloader
+
+    monkeypatch.setattr(SegmentDownloader, "_attempt_segment", lambda self, segment, attempt=0: f"segment_{segment['index']:05d}.ts")
+    d = SegmentDownloader(segments=_segments(30)[20:], output_dir=str(tmp_path), session=object())
+    files = d.download_all()
+
+    # Playlist indexes are kept (segment file names, IVs); results start at slot 0
+    assert files == [f"segment_{i:05d}.ts" for i in range(20, 30)]
@@ -18,6 +18,7 @@ from urllib.parse import urlparse
 import signal
 import ipaddress
 import socket
+import threading
 
 # Configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/m3u8_db")
@@ -25,6 +26,80 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 MAX_RETRY_ATTEMPTS = int(os.getenv("MAX_RETRY_ATTEMPTS", "3"))
 SSRF_GUARD_ENABLED = os.getenv("SSRF_GUARD", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+# Segment download engine: "thread" (ThreadPoolExecutor + curl_cffi) or "async" (asyncio + aiohttp)
+DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "thread").strip().lower()
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "100"))
+# Merge mode for m3u8 jobs: "concat" (segment files + concat list) or "stream" (pipe into FFmpeg stdin)
+MERGE_MODE = os.getenv("MERGE_MODE", "concat").strip().lower()
+STREAM_REORDER_BUFFER = int(os.getenv("STREAM_REORDER_BUFFER", "64"))
+# Stream segment bodies to disk with chunked AES decryption instead of buffering whole
+# responses (bounds memory per segment; useful for large 4K segments on small hosts)
+STREAM_SEGMENT_BODIES = os.getenv("STREAM_SEGMENT_BODIES", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+# Resumable HLS jobs: completed segments are checkpointed under STAGING_DIR/<job_id>.
+# Unset: on, except in stream mode, where it would write every segment to disk again
+# (a streamed job's partial output can't be resumed, only its segment files can)
+_SEGMENT_CHECKPOINTS_RAW = os.getenv("SEGMENT_CHECKPOINTS", "").strip().lower()
+SEGMENT_CHECKPOINTS = (
+    _SEGMENT_CHECKPOINTS_RAW in ("1", "true", "yes", "y", "on")
+    if _SEGMENT_CHECKPOINTS_RAW
+    else MERGE_MODE != "stream"
+)
+STAGING_DIR = os.getenv("STAGING_DIR", "/downloads/.staging")
+CHECKPOINT_VERIFY = os.getenv("CHECKPOINT_VERIFY", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv("CHECKPOINT_MAX_AGE_HOURS", "48"))
+# Adaptive per-host concurrency (AIMD) for segment fetches; MAX_DOWNLOAD_WORKERS is the starting limit
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+ADAPTIVE_MIN_CONCURRENCY = int(os.getenv("ADAPTIVE_MIN_CONCURRENCY", "2"))
+ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("ADAPTIVE_MAX_CONCURRENCY", "64"))
+# How often per-host limits are published to Redis for the API (seconds)
+HOST_LIMITS_PUBLISH_INTERVAL = 2.0
+HOST_LIMITS_TTL_SECONDS = 3600
+# Bandwidth shaping (bytes/s with K/M/G suffixes, 0 = unlimited). Shared through Redis
+# token buckets and adjustable at runtime via the "bandwidth:config" hash (see bandwidth.py).
+BANDWIDTH_LIMIT_GLOBAL = os.getenv("BANDWIDTH_LIMIT_GLOBAL", "0")
+BANDWIDTH_LIMIT_PER_WORKER = os.getenv("BANDWIDTH_LIMIT_PER_WORKER", "0")
+BANDWIDTH_LIMIT_PER_HOST = os.getenv("BANDWIDTH_LIMIT_PER_HOST", "0")
+WORKER_ID = os.getenv("WORKER_ID") or socket.gethostname()
+# AES-128 keys are shared through Redis for this long (seconds) so retries and parallel
+# jobs on the same stream don't refetch them; 0 keeps keys in worker memory only
+KEY_CACHE_TTL_SECONDS = int(os.getenv("KEY_CACHE_TTL_SECONDS", "600"))
+# Referer discovery before segment fan-out: probe 1 (first), 2 (+last) or 3 (+middle) segments.
+# The working strategy is remembered per CDN host in Redis for REFERER_CACHE_TTL_SECONDS (0 = off).
+REFERER_DISCOVERY_PROBES = int(os.getenv("REFERER_DISCOVERY_PROBES", "1"))
+REFERER_CACHE_TTL_SECONDS = int(os.getenv("REFERER_CACHE_TTL_SECONDS", "86400"))
+# Jobs run at once in this container, each with its own DB session and temp dir
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "3"))
+# In-flight segment requests across all of those jobs (0 = what a single job could use:
+# MAX_DOWNLOAD_WORKERS, or ADAPTIVE_MAX_CONCURRENCY with adaptive concurrency)
+MAX_TOTAL_SEGMENT_FETCHES = int(os.getenv("MAX_TOTAL_SEGMENT_FETCHES", "0"))
+# Segment progress goes to Redis (read by the API); Postgres gets it at most this often
+PROGRESS_DB_INTERVAL_SECONDS = float(os.getenv("PROGRESS_DB_INTERVAL_SECONDS", "15"))
+# Cap on segment requests in flight per source host across all workers and jobs
+# (0 = no cap; per-host overrides in the host_slots:config Redis hash). A dead
+# worker's slots free up after HOST_SLOT_LEASE_SECONDS.
+HOST_CONCURRENCY_LIMIT = int(os.getenv("HOST_CONCURRENCY_LIMIT", "0"))
+HOST_SLOT_LEASE_SECONDS = float(os.getenv("HOST_SLOT_LEASE_SECONDS", "30"))
+# Per job, requests to a CDN host are held once at least this share of its recent
+# attempts failed (403/474, 429, 5xx, timeouts; 0 = off), and probed again after
+# CIRCUIT_BREAKER_OPEN_SECONDS. A circuit opened by 403/474 or anti-hotlinking fails the job.
+CIRCUIT_BREAKER_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "0.5"))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "15"))
+# Sharded HLS jobs: playlists with at least SHARD_MIN_SEGMENTS segments are split into
+# SHARD_SIZE-segment ranges that any idle worker can claim (staged under STAGING_DIR,
+# which must be on the shared /downloads volume). Concat merge mode only.
+SHARDED_DOWNLOADS = os.getenv("SHARDED_DOWNLOADS", "false").strip().lower() in ("1", "true", "yes", "y", "on")
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "500"))
+SHARD_MIN_SEGMENTS = int(os.getenv("SHARD_MIN_SEGMENTS", "2000"))
+# A claimed shard whose worker stops heartbeating for this long is handed to another worker
+SHARD_CLAIM_TIMEOUT_SECONDS = float(os.getenv("SHARD_CLAIM_TIMEOUT_SECONDS", "60"))
+# Workers heartbeat this often; the in-flight jobs of one silent for the timeout are
+# requeued (resuming from their checkpoints) by the others
+QUEUE_HEARTBEAT_SECONDS = float(os.getenv("QUEUE_HEARTBEAT_SECONDS", "3"))
+QUEUE_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("QUEUE_HEARTBEAT_TIMEOUT_SECONDS", "15"))
+# Failed jobs are retried after RETRY_BASE_DELAY_SECONDS, doubling per attempt up to
+# RETRY_MAX_DELAY_SECONDS (jittered), so a rate-limiting CDN isn't hit again right away
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "10"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "600"))
 
 # Setup logging
 logging.basicConfig(
@@ -34,18 +109,81 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Database setup
-engine = create_engine(DATABASE_URL)
+# Each running job holds a session plus a short-lived one for cancellation checks
+engine = create_engine(DATABASE_URL, pool_size=max(5, MAX_CONCURRENT_DOWNLOADS * 2))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Redis setup
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Per-host concurrency limits are learned per worker process and shared by all jobs
+host_concurrency = None
+if ADAPTIVE_CONCURRENCY:
+    from concurrency import AdaptiveConcurrencyController
+    host_concurrency = AdaptiveConcurrencyController(
+        initial_limit=int(os.getenv('MAX_DOWNLOAD_WORKERS', 2)),
+        min_limit=ADAPTIVE_MIN_CONCURRENCY,
+        max_limit=ADAPTIVE_MAX_CONCURRENCY,
+    )
+
+# Every segment download and direct download draws from the same bandwidth budget
+from bandwidth import BandwidthLimiter, parse_rate
+bandwidth_limiter = BandwidthLimiter(
+    redis_client,
+    worker_id=WORKER_ID,
+    global_rate=parse_rate(BANDWIDTH_LIMIT_GLOBAL),
+    worker_rate=parse_rate(BANDWIDTH_LIMIT_PER_WORKER),
+    host_rate=parse_rate(BANDWIDTH_LIMIT_PER_HOST),
+)
+
+# AES-128 keys resolved once per URI across all jobs in this worker (and via Redis, across workers)
+from key_cache import KeyCache
+key_cache = KeyCache(redis_client, ttl=KEY_CACHE_TTL_SECONDS)
+
+# Referer strategy that worked per CDN host, so later jobs skip discovery
+from strategy_cache import RefererStrategyCache
+referer_cache = RefererStrategyCache(redis_client, ttl=REFERER_CACHE_TTL_SECONDS)
+
+# Concurrent jobs draw segment fetches from one budget so total sockets stay bounded
+from concurrency import FetchBudget
+fetch_budget = FetchBudget(
+    MAX_TOTAL_SEGMENT_FETCHES
+    or (ADAPTIVE_MAX_CONCURRENCY if ADAPTIVE_CONCURRENCY else int(os.getenv('MAX_DOWNLOAD_WORKERS', 2)))
+)
+
+# Segment requests per CDN host, counted across every worker through Redis leases
+from host_semaphore import HostSemaphore
+host_slots = HostSemaphore(
+    redis_client,
+    worker_id=WORKER_ID,
+    limit=HOST_CONCURRENCY_LIMIT,
+    lease_seconds=HOST_SLOT_LEASE_SECONDS,
+)
+
+# Output paths picked by running jobs but not written yet (same-title jobs in parallel)
+_reserved_outputs = set()
+_reserved_outputs_lock = threading.Lock()
+
+# Live job progress and cancel flags shared with the API through Redis
+from progress import CANCEL_KEY_PREFIX, JobProgressTracker, bump_jobs_version, publish_job_event, publish_progress
+
+# Segment failure codes and the per-job circuit breaker per CDN host
+from failures import BLOCKED, HOTLINK, CircuitBreaker
+
+# Priority classes with round-robin across source hosts (filled by the API and by retries)
+from fair_queue import FairQueue, QueueHeartbeat, retry_delay
+fair_queue = FairQueue(redis_client, worker_id=WORKER_ID)
+
+# Cancellations pushed by the API; fed by a CancelListener started in main()
+from cancellation import CancelListener, CancelRegistry, CancelToken
+cancel_registry = CancelRegistry()
+
 # Graceful shutdown handler
 shutdown_flag = False
 
 def signal_handler(sig, frame):
     global shutdown_flag
-    logger.info("Shutdown signal received. Finishing current job...")
+    logger.info("Shutdown signal received. Handing back running HLS jobs (direct downloads finish first)...")
     shutdown_flag = True
 
 signal.signal(signal.SIGINT, signal_handler)
@@ -90,8 +228,20 @@ def _enforce_ssrf_guard(url: str) -> None:
 class DownloadWorker:
     """Worker class for processing download jobs"""
     
-    def __init__(self):
+    def __init__(self, cancel_token: CancelToken = None):
+        # One instance per job: sessions aren't thread-safe and jobs run in parallel
         self.db = SessionLocal()
+        self._reserved_outputs = []
+        self._published_host_limits = None
+        # Set by the cancel listener the moment the API publishes a cancellation
+        self.cancel_token = cancel_token or CancelToken("")
+
+    def close(self):
+        with _reserved_outputs_lock:
+            for path in self._reserved_outputs:
+                _reserved_outputs.discard(path)
+        self._reserved_outputs = []
+        self.db.close()
 
     def _probe_duration_seconds(self, file_path: str):
         """Return media duration in seconds using ffprobe, or None if unavailable."""
@@ -127,6 +277,46 @@ class DownloadWorker:
         except Exception:
             return None
     
+    def _publish_host_limits(self, job_id: str, limits):
+        """Store the current per-host concurrency limits for a job in Redis (best effort)"""
+        if not limits:
+            return
+        value = json.dumps(limits, sort_keys=True)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(f"job_host_limits:{job_id}", value, ex=HOST_LIMITS_TTL_SECONDS)
+            if value != self._published_host_limits:
+                bump_jobs_version(pipe, job_id, live=True)
+            pipe.execute()
+            self._published_host_limits = value
+        except Exception as e:
+            logger.debug(f"Failed to publish host limits: {e}")
+    
+    def _build_output_file(self, job_id: str, job: dict) -> str:
+        """Return a collision-free output path under /downloads/completed for the job title"""
+        from pathlib import Path
+
+        safe_title = "".join(c for c in job['title'] if c.isalnum() or c in (' ', '-', '_')).strip()
+        if not safe_title:
+            safe_title = f"video_{job_id[:8]}"
+        
+        # Handle file name collisions
+        output_dir = Path("/downloads/completed")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        base_name = safe_title
+        output_file = output_dir / f"{base_name}.mp4"
+        counter = 1
+        
+        with _reserved_outputs_lock:
+            while output_file.exists() or str(output_file) in _reserved_outputs:
+                output_file = output_dir / f"{base_name} ({counter}).mp4"
+                counter += 1
+            _reserved_outputs.add(str(output_file))
+        self._reserved_outputs.append(str(output_file))
+        
+        return str(output_file)
+    
     def update_job_status(self, job_id: str, status: str, progress: int = None, 
                          error_message: str = None, file_path: str = None, 
                          file_size: int = None):
@@ -163,6 +353,13 @@ class DownloadWorker:
             
             if result.rowcount > 0:
                 logger.info(f"Job {job_id} status updated to {status}")
+                if "progress" in updates:
+                    publish_progress(
+                        redis_client, job_id, status, updates["progress"],
+                        error_message=error_message, file_path=file_path, file_size=file_size,
+                    )
+                else:
+                    publish_job_event(redis_client, job_id, status=status, error_message=error_message)
             # If rowcount is 0, job might be cancelled - don't log to reduce noise
         
         except Exception as e:
@@ -170,10 +367,10 @@ class DownloadWorker:
             self.db.rollback()
     
     def get_job_details(self, job_id: str):
-        """Get job details from database"""
+        """Get job details from database (None if the job is gone; database errors are raised)"""
         try:
             result = self.db.execute(text("""
-                SELECT j.id, j.url, j.title, j.retry_count,
+                SELECT j.id, j.url, j.title, j.status, j.retry_count, j.priority,
                        jm.referer, jm.headers, jm.source_page
                 FROM jobs j
                 LEFT JOIN job_metadata jm ON j.id = jm.job_id
@@ -196,18 +393,38 @@ class DownloadWorker:
                 "id": str(row.id),
                 "url": row.url,
                 "title": row.title,
+                "status": row.status,
                 "retry_count": row.retry_count,
+                "priority": row.priority,
                 "referer": row.referer,
                 "headers": headers,
                 "source_page": row.source_page
             }
         
-        except Exception as e:
-            logger.error(f"Failed to get job details: {e}")
-            return None
+        except Exception:
+            # A database/schema error is not "job not found": let the caller requeue it
+            self.db.rollback()
+            raise
+    
+    def _progress_tracker(self, job_id: str) -> JobProgressTracker:
+        return JobProgressTracker(
+            redis_client,
+            job_id,
+            persist=lambda status, progress: self.update_job_status(job_id, status, progress=progress),
+            check_db_cancelled=lambda: self.is_job_cancelled(job_id),
+            persist_interval=PROGRESS_DB_INTERVAL_SECONDS,
+        )
     
     def is_job_cancelled(self, job_id: str) -> bool:
-        """Check if job has been cancelled - uses fresh DB connection to avoid cache"""
+        """Check if job has been cancelled - pushed cancel, Redis flag, then a fresh DB connection to avoid cache"""
+        if self.cancel_token.is_set():
+            return True
+        try:
+            if redis_client.exists(CANCEL_KEY_PREFIX + job_id):
+                logger.info(f"Job {job_id} detected as cancelled")
+                return True
+        except Exception as e:
+            logger.debug(f"Cancel flag check failed: {e}")
         try:
             # Use a fresh session to avoid SQLAlchemy caching and transaction isolation issues
             fresh_db = SessionLocal()
@@ -236,11 +453,27 @@ class DownloadWorker:
             return
         
         # Get job details
-        job = self.get_job_details(job_id)
+        try:
+            job = self.get_job_details(job_id)
+        except Exception as e:
+            logger.error(f"Failed to get details of job {job_id}, retrying in {RETRY_BASE_DELAY_SECONDS}s: {e}")
+            fair_queue.defer(job_id, RETRY_BASE_DELAY_SECONDS)
+            return
         if not job:
             logger.error(f"Job {job_id} not found")
             return
         
+        # A job requeued from a worker that was presumed dead may have finished there after all
+        if job.get("status") == "completed":
+            logger.info(f"Job {job_id} is already completed, skipping")
+            return
+        
+        # ...or still be running there, if that worker was only slow to heartbeat
+        owner = fair_queue.claim(job_id, QUEUE_HEARTBEAT_TIMEOUT_SECONDS)
+        if owner:
+            logger.info(f"Job {job_id} is still running on worker {owner}, skipping")
+            return
+        
         # Determine download type based on URL
         # Check for MP4 in various forms:
         # - URL ending with .mp4
@@ -300,22 +533,9 @@ class DownloadWorker:
             logger.info(f"Request headers: {headers}")
             
             # Prepare output path
-            safe_title = "".join(c for c in job['title'] if c.isalnum() or c in (' ', '-', '_')).strip()
-            if not safe_title:
-                safe_title = f"video_{job_id[:8]}"
+            output_file = self._build_output_file(job_id, job)
             
-            output_dir = Path("/downloads/completed")
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            base_name = safe_title
-            output_file = output_dir / f"{base_name}.mp4"
-            counter = 1
-            
-            while output_file.exists():
-                output_file = output_dir / f"{base_name} ({counter}).mp4"
-                counter += 1
-            
-            output_file = str(output_file)
+            download_host = urlparse(job['url']).netloc
             
             # Stream download with progress (using legacy SSL for compatibility)
             session = create_legacy_session()
@@ -366,6 +586,8 @@ class DownloadWorker:
                     timeout=30,
                 )
                 resp.raise_for_status()
+                # A pushed cancel closes the response, so even a stalled read returns at once
+                self.cancel_token.add_callback(resp.close)
                 try:
                     with open(output_file, "wb") as f:
                         for chunk in resp.iter_content(chunk_size=chunk_size):
@@ -373,9 +595,10 @@ class DownloadWorker:
                                 continue
                             f.write(chunk)
                             downloaded_size += len(chunk)
+                            bandwidth_limiter.consume(download_host, len(chunk), self.cancel_token.event)
 
                             now = time.monotonic()
-                            if downloaded_size >= next_check_bytes or now >= next_check_time:
+                            if self.cancel_token.is_set() or downloaded_size >= next_check_bytes or now >= next_check_time:
                                 if self.is_job_cancelled(job_id):
                                     logger.info(f"Job {job_id} was cancelled during download, aborting")
                                     resp.close()
@@ -392,7 +615,15 @@ class DownloadWorker:
                                 next_check_time = now + check_interval_sec
                                 next_check_bytes = downloaded_size + check_bytes_step
                     return True
+                except Exception:
+                    if not self.cancel_token.is_set():
+                        raise
+                    logger.info(f"Job {job_id} was cancelled during download, aborting")
+                    if Path(output_file).exists():
+                        Path(output_file).unlink()
+                    return False
                 finally:
+                    self.cancel_token.remove_callback(resp.close)
                     try:
                         resp.close()
                     except Exception:
@@ -448,6 +679,7 @@ class DownloadWorker:
                         return
                 else:
                     stop_event = threading.Event()
+                    self.cancel_token.add_callback(stop_event.set)
                     progress_lock = threading.Lock()
                     db_lock = threading.Lock()
                     part_paths = [None] * range_workers
@@ -488,6 +720,7 @@ class DownloadWorker:
                                     if not chunk:
                                         continue
                                     f.write(chunk)
+                                    bandwidth_limiter.consume(download_host, len(chunk), stop_event)
 
                                     now = time.monotonic()
                                     do_check = False
@@ -540,6 +773,9 @@ class DownloadWorker:
                                     shutil.copyfileobj(in_f, out_f, length=1024 * 1024)
                     except Exception as e:
                         # If range download fails for any reason, fall back to single-stream
+                        if self.cancel_token.is_set():
+                            logger.info(f"Job {job_id} was cancelled during download, aborting")
+                            return
                         logger.warning(f"Range download failed, falling back to single stream: {e}")
                         stop_event.set()
                         # Clean up partial parts
@@ -560,6 +796,7 @@ class DownloadWorker:
                         if not ok:
                             return
                     finally:
+                        self.cancel_token.remove_callback(stop_event.set)
                         # Cleanup part files if they still exist
                         for p in part_files:
                             try:
@@ -618,13 +855,19 @@ class DownloadWorker:
         """Process m3u8 stream download"""
         from m3u8_parser import parse_m3u8
         from downloader import SegmentDownloader
-        from ffmpeg_wrapper import merge_segments
+        from ffmpeg_wrapper import merge_segments, FFmpegStreamMerger
+        from checkpoint import SegmentCheckpoint
         from ssl_adapter import create_impersonated_session
         import tempfile
         import shutil
         from pathlib import Path
         
         temp_dir = None
+        keep_staging = False
+        downloader = None
+        stream_merger = None
+        stream_merged = False
+        sharded = False
         
         try:
             _enforce_ssrf_guard(job["url"])
@@ -758,7 +1001,28 @@ class DownloadWorker:
             
             # Step 2: Download segments (5% - 85%)
             logger.info("Step 2: Downloading segments")
-            temp_dir = tempfile.mkdtemp(prefix=f"m3u8_{job_id}_")
+            checkpoint = None
+            sharded = (
+                SHARDED_DOWNLOADS
+                and MERGE_MODE != "stream"
+                and len(playlist_info['segments']) >= SHARD_MIN_SEGMENTS
+            )
+            if sharded:
+                # Shards are written by several workers: stage on the shared volume,
+                # each shard with its own checkpoint (see sharding.py)
+                temp_dir = str(Path(STAGING_DIR) / job_id)
+                os.makedirs(temp_dir, exist_ok=True)
+            elif SEGMENT_CHECKPOINTS:
+                # Stable per-job staging dir so a retry/restart only fetches missing segments
+                checkpoint = SegmentCheckpoint.for_job(
+                    job_id,
+                    playlist_info['segments'],
+                    root=STAGING_DIR,
+                    verify_checksums=CHECKPOINT_VERIFY,
+                )
+                temp_dir = str(checkpoint.staging_dir)
+            else:
+                temp_dir = tempfile.mkdtemp(prefix=f"m3u8_{job_id}_")
             
             # For segments, keep the original source page Referer (as browsers do)
             # The downloader will try multiple Referer strategies if this fails
@@ -768,52 +1032,117 @@ class DownloadWorker:
             logger.info(f"Segment Referer: {segment_headers.get('Referer', 'None')}")
             logger.info(f"Segment Origin: {segment_headers.get('Origin', 'None')}")
             
-            downloader = SegmentDownloader(
+            downloader_kwargs = dict(
                 segments=playlist_info['segments'],
                 output_dir=temp_dir,
                 headers=segment_headers,
-                max_workers=int(os.getenv('MAX_DOWNLOAD_WORKERS', 2)),
                 # Per-segment keys/IVs are included in segment metadata now.
                 encryption_key=None,
                 encryption_iv=None,
                 m3u8_url=job['url'],  # Pass m3u8 URL for Referer strategies
                 session=shared_session,
+                checkpoint=checkpoint,
+                **_shared_downloader_kwargs(),
             )
+            if MERGE_MODE == "stream":
+                # Pipe validated segments straight into FFmpeg while later ones download.
+                # Out-of-order arrivals wait in a bounded reorder buffer (spilling to temp_dir).
+                output_file = self._build_output_file(job_id, job)
+                stream_merger = FFmpegStreamMerger(
+                    output_file=output_file,
+                    total_segments=len(playlist_info['segments']),
+                    threads=int(os.getenv('FFMPEG_THREADS', 4)),
+                    max_buffered=STREAM_REORDER_BUFFER,
+                    spill_dir=temp_dir,
+                )
+                stream_merger.start()
+                downloader_kwargs['segment_sink'] = stream_merger
+                logger.info(
+                    f"Using streaming merge (reorder buffer: {STREAM_REORDER_BUFFER} segments, "
+                    f"{'segments checkpointed to staging' if checkpoint is not None else 'not resumable'})"
+                )
+            
+            if sharded:
+                from sharding import ShardBoard, ShardedDownload
+                downloader = ShardedDownload(
+                    ShardBoard(redis_client, job_id),
+                    playlist_info['segments'],
+                    spec={'m3u8_url': job['url'], 'headers': segment_headers, 'staging_dir': temp_dir},
+                    # Shards this worker downloads itself keep the playlist's session (cookies, TLS)
+                    run_shard=lambda spec, segments, output_dir, callback: _download_shard(
+                        spec, segments, output_dir, callback, session=shared_session, cancel_token=self.cancel_token
+                    ),
+                    worker_id=WORKER_ID,
+                    shard_size=SHARD_SIZE,
+                    claim_timeout=SHARD_CLAIM_TIMEOUT_SECONDS,
+                )
+            elif DOWNLOAD_ENGINE == "async":
+                from async_downloader import AsyncSegmentDownloader
+                logger.info(f"Using async download engine ({ASYNC_MAX_CONNECTIONS} connections)")
+                downloader = AsyncSegmentDownloader(max_connections=ASYNC_MAX_CONNECTIONS, **downloader_kwargs)
+            else:
+                downloader = SegmentDownloader(**downloader_kwargs)
+            
+            # A pushed cancel aborts in-flight fetches and kills a streaming FFmpeg right away
+            self.cancel_token.add_callback(downloader.request_stop)
+            if stream_merger is not None:
+                self.cancel_token.add_callback(stream_merger.abort)
+            
+            next_limits_publish = 0.0
+            # Runs after every segment: progress and cancellation go through memory/Redis,
+            # Postgres only sees a write every PROGRESS_DB_INTERVAL_SECONDS
+            tracker = self._progress_tracker(job_id)
             
             def progress_callback(completed, total):
+                nonlocal next_limits_publish
                 # Check for cancellation FIRST (before updating status)
-                if self.is_job_cancelled(job_id):
+                if self.cancel_token.is_set() or tracker.cancelled():
                     logger.info(f"Job {job_id} was cancelled during segment download, aborting")
                     raise Exception("Job cancelled by user")
                 
+                if stream_merger is not None and stream_merger.error:
+                    raise Exception(stream_merger.error)
+                
+                if shutdown_flag:
+                    # Completed segments are checkpointed; hand the rest to another worker
+                    raise Exception("Worker shutting down, job handed back to queue")
+                
                 # Map download progress to 5-85%
                 download_progress = int(5 + (completed / total) * 80)
-                self.update_job_status(job_id, "downloading", progress=download_progress)
+                tracker.update("downloading", download_progress, segments_done=completed, segments_total=total)
                 
-                # Check if too many segments failed during download
-                failed_count = len(downloader.failed_segments)
-                if failed_count > 5:
-                    # Count anti-hotlink protection errors
-                    hotlink_count = sum(
-                        1 for item in downloader.failed_segments 
-                        if 'anti-hotlinking' in item['error'].lower() or 'JPEG' in item['error'] or 'PNG' in item['error']
-                    )
-                    
-                    if hotlink_count >= 5:
-                        logger.error(f"Anti-hotlinking protection detected: {hotlink_count} segments blocked")
+                # Expose what each CDN currently tolerates (read by the API)
+                if host_concurrency is not None and time.monotonic() >= next_limits_publish:
+                    next_limits_publish = time.monotonic() + HOST_LIMITS_PUBLISH_INTERVAL
+                    self._publish_host_limits(job_id, downloader.get_progress().get('host_concurrency'))
+                
+                # A host's circuit opened on bans: fail now instead of retrying into them
+                tripped = downloader.circuit_tripped()
+                if tripped is not None:
+                    host, code = tripped
+                    logger.error(f"Circuit for {host} opened on {code} failures, aborting job")
+                    if code == HOTLINK:
                         raise Exception(f"Download aborted: Server blocked segment downloads (anti-hotlinking protection). Try refreshing the source page and retrying.")
-                    
-                    # Count HTTP 403/474 errors
-                    http_error_count = sum(
-                        1 for item in downloader.failed_segments 
-                        if '403' in item['error'] or '474' in item['error']
-                    )
-                    
-                    if http_error_count > 20:
-                        logger.error(f"Too many HTTP 403/474 errors detected: {http_error_count} segments failed")
-                        raise Exception(f"Download aborted: {http_error_count} segments failed with HTTP 403/474 errors (URL expired or blocked)")
+                    raise Exception(f"Download aborted: {host} is answering with HTTP 403/474 errors (URL expired or blocked)")
+                
+                # Check if too many segments failed during download (counted as they fail)
+                failed = downloader.failure_counts.segments
+                hotlink_count = failed[HOTLINK]
+                if hotlink_count >= 5:
+                    logger.error(f"Anti-hotlinking protection detected: {hotlink_count} segments blocked")
+                    raise Exception(f"Download aborted: Server blocked segment downloads (anti-hotlinking protection). Try refreshing the source page and retrying.")
+                
+                http_error_count = failed[BLOCKED]
+                if http_error_count > 20:
+                    logger.error(f"Too many HTTP 403/474 errors detected: {http_error_count} segments failed")
+                    raise Exception(f"Download aborted: {http_error_count} segments failed with HTTP 403/474 errors (URL expired or blocked)")
             
             segment_files = downloader.download_all(progress_callback)
+            if self.cancel_token.is_set():
+                # Stopped mid-download: whatever came back is incomplete
+                raise Exception("Job cancelled by user")
+            if host_concurrency is not None:
+                self._publish_host_limits(job_id, downloader.get_progress().get('host_concurrency'))
             
             if not segment_files:
                 raise Exception("No segments downloaded successfully")
@@ -831,34 +1160,26 @@ class DownloadWorker:
             logger.info("Step 3: Merging segments with FFmpeg")
             self.update_job_status(job_id, "processing", progress=90)
             
-            # Prepare output path
-            safe_title = "".join(c for c in job['title'] if c.isalnum() or c in (' ', '-', '_')).strip()
-            if not safe_title:
-                safe_title = f"video_{job_id[:8]}"
-            
-            # Handle file name collisions
-            output_dir = Path("/downloads/completed")
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            base_name = safe_title
-            output_file = output_dir / f"{base_name}.mp4"
-            counter = 1
-            
-            while output_file.exists():
-                output_file = output_dir / f"{base_name} ({counter}).mp4"
-                counter += 1
-            
-            output_file = str(output_file)
-            
-            # Merge segments
-            success = merge_segments(
-                segment_files=segment_files,
-                output_file=output_file,
-                threads=int(os.getenv('FFMPEG_THREADS', 4)),
-                concat_dir=temp_dir
-            )
+            if stream_merger is not None:
+                # Segments were piped into FFmpeg while downloading; just finalize.
+                success = stream_merger.finish()
+                stream_merged = success
+            else:
+                # Prepare output path
+                output_file = self._build_output_file(job_id, job)
+                
+                # Merge segments
+                success = merge_segments(
+                    segment_files=segment_files,
+                    output_file=output_file,
+                    threads=int(os.getenv('FFMPEG_THREADS', 4)),
+                    concat_dir=temp_dir,
+                    stop_event=self.cancel_token.event,
+                )
             
             if not success:
+                if self.cancel_token.is_set():
+                    raise Exception("Job cancelled by user")
                 raise Exception("FFmpeg merge failed")
             
             # Get file size
@@ -891,23 +1212,57 @@ class DownloadWorker:
         
         except Exception as e:
             logger.error(f"Job {job_id} failed: {e}", exc_info=True)
-            self._handle_job_failure(job_id, job, str(e))
+            # Keep checkpointed segments when the job goes back to the queue
+            keep_staging = self._handle_job_failure(job_id, job, str(e)) and (SEGMENT_CHECKPOINTS or sharded)
         
         finally:
+            if downloader is not None:
+                self.cancel_token.remove_callback(downloader.request_stop)
+            if stream_merger is not None:
+                self.cancel_token.remove_callback(stream_merger.abort)
+            # Kill a streaming FFmpeg that never finished and drop its partial output
+            if stream_merger is not None and not stream_merged:
+                stream_merger.abort()
+            
             # Cleanup temp directory
-            if temp_dir and os.path.exists(temp_dir):
+            if keep_staging:
+                logger.info(f"Keeping checkpointed segments for retry: {temp_dir}")
+            elif temp_dir and os.path.exists(temp_dir):
                 try:
                     shutil.rmtree(temp_dir)
                     logger.info(f"Cleaned up temp directory: {temp_dir}")
                 except Exception as e:
                     logger.warning(f"Failed to cleanup temp directory: {e}")
     
-    def _handle_job_failure(self, job_id: str, job: dict, error_str: str):
-        """Handle job failure with retry logic"""
+    def _handle_job_failure(self, job_id: str, job: dict, error_str: str) -> bool:
+        """
+        Handle job failure with retry logic
+        
+        Returns:
+            True if the job was put back in the queue
+        """
+        # Another worker took the job over while this one was presumed dead: the row
+        # (and the checkpointed staging dir) are its now
+        if fair_queue.taken_over(job_id):
+            logger.info(f"Job {job_id} was taken over by another worker, leaving it to them")
+            return True
+        
         # Check if job was cancelled by user - don't update status or retry
-        if "cancelled by user" in error_str.lower():
+        if self.cancel_token.is_set() or "cancelled by user" in error_str.lower():
             logger.info(f"Job {job_id} was cancelled by user, no action needed")
-            return
+            return False
+        
+        # Worker is shutting down mid-job: hand it back without spending a retry
+        if "worker shutting down" in error_str.lower():
+            logger.info(f"Requeueing job {job_id} for another worker")
+            self.db.execute(text("""
+                UPDATE jobs SET status = 'pending'
+                WHERE id = :job_id AND status != 'cancelled'
+            """), {"job_id": job_id})
+            self.db.commit()
+            fair_queue.push(job_id, job["url"], job.get("priority"))
+            publish_job_event(redis_client, job_id, status="pending")
+            return True
         
         # Check if error is due to 403/474 (URL expired/blocked) - do not retry
         if "403/474 errors" in error_str or "URL expired or blocked" in error_str:
@@ -917,51 +1272,157 @@ class DownloadWorker:
                 "failed",
                 error_message=error_str
             )
-        else:
-            # Update retry count for other errors
-            retry_count = job.get("retry_count", 0) + 1
-            
-            if retry_count < MAX_RETRY_ATTEMPTS:
-                # Retry: put back in queue
-                logger.info(f"Retrying job {job_id} (attempt {retry_count})")
-                self.db.execute(text("""
-                    UPDATE jobs SET retry_count = :retry_count, status = 'pending'
-                    WHERE id = :job_id
-                """), {"retry_count": retry_count, "job_id": job_id})
-                self.db.commit()
-                redis_client.rpush("download_queue", job_id)
-            else:
-                # Max retries reached: mark as failed
-                self.update_job_status(
-                    job_id, 
-                    "failed",
-                    error_message=error_str
-                )
-    
-    def run(self):
-        """Main worker loop"""
-        logger.info("Worker started and waiting for jobs...")
+            return False
         
-        while not shutdown_flag:
-            try:
-                # Blocking pop from Redis queue (timeout: 5 seconds)
-                result = redis_client.blpop("download_queue", timeout=5)
-                
-                if result:
-                    _, job_id = result
-                    logger.info(f"Received job: {job_id}")
-                    self.process_job(job_id)
-                
-            except redis.exceptions.ConnectionError as e:
-                logger.error(f"Redis connection error: {e}")
-                time.sleep(5)  # Wait before retrying
-            
-            except Exception as e:
-                logger.error(f"Unexpected error in worker loop: {e}")
-                time.sleep(1)
+        # Update retry count for other errors
+        retry_count = job.get("retry_count", 0) + 1
         
-        logger.info("Worker shutting down...")
-        self.db.close()
+        if retry_count < MAX_RETRY_ATTEMPTS:
+            # Retry: back in the queue once the backoff has passed
+            delay = retry_delay(retry_count, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS)
+            logger.info(f"Retrying job {job_id} in {delay:.0f}s (attempt {retry_count})")
+            self.db.execute(text("""
+                UPDATE jobs SET retry_count = :retry_count, status = 'pending'
+                WHERE id = :job_id
+            """), {"retry_count": retry_count, "job_id": job_id})
+            self.db.commit()
+            fair_queue.schedule_retry(job_id, job["url"], job.get("priority"), delay)
+            publish_job_event(redis_client, job_id, status="pending")
+            return True
+        
+        # Max retries reached: mark as failed
+        self.update_job_status(
+            job_id, 
+            "failed",
+            error_message=error_str
+        )
+        return False
+
+
+def _shared_downloader_kwargs() -> dict:
+    """
+    SegmentDownloader arguments shared by every job (pool size and worker-wide
+    singletons), plus a fresh circuit breaker for this downloader
+    """
+    return dict(
+        circuit_breaker=CircuitBreaker(
+            threshold=CIRCUIT_BREAKER_THRESHOLD,
+            open_seconds=CIRCUIT_BREAKER_OPEN_SECONDS,
+        ) if CIRCUIT_BREAKER_THRESHOLD > 0 else None,
+        max_workers=int(os.getenv('MAX_DOWNLOAD_WORKERS', 2)),
+        concurrency=host_concurrency,
+        bandwidth=bandwidth_limiter,
+        stream_bodies=STREAM_SEGMENT_BODIES,
+        key_cache=key_cache,
+        referer_cache=referer_cache,
+        discovery_probes=REFERER_DISCOVERY_PROBES,
+        fetch_budget=fetch_budget,
+        host_slots=host_slots,
+    )
+
+
+def _download_shard(spec: dict, segments: list, output_dir: str, progress_callback=None, session=None, cancel_token=None):
+    """
+    Download one shard of a sharded job into output_dir (on the shared staging volume)
+
+    Returns:
+        (segment files, failed_segments)
+    """
+    from downloader import SegmentDownloader
+    from checkpoint import SegmentCheckpoint, playlist_fingerprint
+    from ssl_adapter import create_impersonated_session
+
+    checkpoint = SegmentCheckpoint(output_dir, playlist_fingerprint(segments), verify_checksums=CHECKPOINT_VERIFY)
+    downloader_kwargs = dict(
+        segments=segments,
+        output_dir=output_dir,
+        headers=spec['headers'],
+        m3u8_url=spec['m3u8_url'],
+        session=session or create_impersonated_session(),
+        checkpoint=checkpoint,
+        **_shared_downloader_kwargs(),
+    )
+    if DOWNLOAD_ENGINE == "async":
+        from async_downloader import AsyncSegmentDownloader
+        downloader = AsyncSegmentDownloader(max_connections=ASYNC_MAX_CONNECTIONS, **downloader_kwargs)
+    else:
+        downloader = SegmentDownloader(**downloader_kwargs)
+    if cancel_token is None:
+        files = downloader.download_all(progress_callback)
+        return files, downloader.failed_segments
+    cancel_token.add_callback(downloader.request_stop)
+    try:
+        files = downloader.download_all(progress_callback)
+    finally:
+        cancel_token.remove_callback(downloader.request_stop)
+    if cancel_token.is_set():
+        raise Exception("Job cancelled by user")
+    return files, downloader.failed_segments
+
+
+def run_shard(job_id: str):
+    """Claim and download one shard of another worker's sharded job (SHARD_QUEUE handler)"""
+    from sharding import ShardBoard, run_claimed_shard
+    token = cancel_registry.register(job_id)
+    try:
+        run_claimed_shard(
+            ShardBoard(redis_client, job_id),
+            WORKER_ID,
+            lambda spec, segments, output_dir, callback: _download_shard(
+                spec, segments, output_dir, callback, cancel_token=token
+            ),
+            lambda: shutdown_flag,
+        )
+    finally:
+        cancel_registry.unregister(token)
+
+
+def run_job(job_id: str):
+    """Run one job on the calling thread with its own DownloadWorker (DB session)"""
+    token = cancel_registry.register(job_id)
+    worker = DownloadWorker(cancel_token=token)
+    try:
+        worker.process_job(job_id)
+    finally:
+        worker.close()
+        cancel_registry.unregister(token)
+
+
+def reset_requeued_jobs(job_ids):
+    """Jobs taken back from a dead worker are pending again (their row still says downloading)"""
+    db = SessionLocal()
+    try:
+        for job_id in job_ids:
+            result = db.execute(text("""
+                UPDATE jobs SET status = 'pending'
+                WHERE id = :job_id AND status IN ('downloading', 'processing')
+            """), {"job_id": job_id})
+            if result.rowcount:
+                publish_job_event(redis_client, job_id, status="pending")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to reset requeued jobs: {e}")
+    finally:
+        db.close()
+
+
+def abort_lost_jobs(job_ids):
+    """Stop this worker's copy of jobs another worker claimed while this one was silent"""
+    for job_id in job_ids:
+        cancel_registry.cancel(job_id)
+
+
+def legacy_job_details(job_id: str):
+    """(url, priority) of a job found on the legacy download_queue, or None if it's gone"""
+    db = SessionLocal()
+    try:
+        row = db.execute(
+            text("SELECT url, priority FROM jobs WHERE id = :job_id"), {"job_id": job_id}
+        ).first()
+        return (row.url, row.priority) if row else None
+    finally:
+        db.close()
 
 
 def main():
@@ -1000,9 +1461,50 @@ def main():
             logger.warning(f"Waiting for Redis... ({i+1}/{max_retries})")
             time.sleep(2)
     
+    # Drop checkpoints of jobs that never came back (deleted, or failed elsewhere)
+    if SEGMENT_CHECKPOINTS:
+        from checkpoint import prune_stale_checkpoints
+        try:
+            prune_stale_checkpoints(STAGING_DIR, CHECKPOINT_MAX_AGE_HOURS)
+        except Exception as e:
+            logger.warning(f"Failed to prune stale checkpoints: {e}")
+    
+    # Abort running jobs as soon as the API publishes their cancellation
+    cancel_listener = CancelListener(redis_client, cancel_registry)
+    cancel_listener.start()
+    
+    # Jobs this worker had taken before it was killed (same WORKER_ID after a restart)
+    leftovers = fair_queue.requeue_worker(WORKER_ID)
+    if leftovers:
+        logger.info(f"Requeued {len(leftovers)} job(s) left in flight by the previous run: {', '.join(leftovers)}")
+        reset_requeued_jobs(leftovers)
+    queue_heartbeat = QueueHeartbeat(
+        fair_queue,
+        interval=QUEUE_HEARTBEAT_SECONDS,
+        timeout=QUEUE_HEARTBEAT_TIMEOUT_SECONDS,
+        on_requeued=reset_requeued_jobs,
+        on_lost=abort_lost_jobs,
+        legacy_lookup=legacy_job_details,
+    )
+    queue_heartbeat.start()
+    
     # Start worker
-    worker = DownloadWorker()
-    worker.run()
+    from job_scheduler import JobScheduler
+    from sharding import SHARD_QUEUE
+    scheduler = JobScheduler(
+        redis_client,
+        run_job,
+        max_jobs=MAX_CONCURRENT_DOWNLOADS,
+        extra_queues={SHARD_QUEUE: run_shard} if SHARDED_DOWNLOADS else None,
+        fair_queue=fair_queue,
+    )
+    scheduler.run(lambda: shutdown_flag)
+    cancel_listener.stop()
+    queue_heartbeat.stop()
+    queue_heartbeat.join(timeout=5)
+    # Nothing should be left in flight after a clean stop; hand back anything that is
+    fair_queue.requeue_worker(WORKER_ID)
+    logger.info("Worker shutting down...")
 
 
 if __name__ == "__main__":